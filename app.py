@@ -1,11 +1,10 @@
 import os
 import sys
-import time
+import hmac
 import logging
-from collections import deque
 
-import httpx
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 
 # ============ Path setup ============
 # Add "src" to sys.path for absolute imports like "infra.*" / "functions.*"
@@ -20,47 +19,50 @@ logging.getLogger("httpx").setLevel(logging.WARNING)  # giảm noise httpx
 logger = logging.getLogger("thienco-bot")
 
 # ============ Flask App ============
+from infra import fastjson  # noqa: E402
+
+
+class _FastJSONProvider(DefaultJSONProvider):
+    """request.get_json / jsonify qua infra.fastjson (orjson nếu có) — parse update ở guard lẫn handler."""
+
+    def dumps(self, obj, **kwargs):
+        return fastjson.dumps_str(obj, default=self.default)
+
+    def loads(self, s, **kwargs):
+        return fastjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = _FastJSONProvider(app)
 
 # ============ Env & runtime guards ============
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
-TELEGRAM_SECRET_TOKEN = os.getenv("TELEGRAM_SECRET_TOKEN", "")
-
-# Dedupe update_id & rate-limit đơn giản theo chat
-_seen = deque(maxlen=512)
-_buckets = {}  # chat_id -> {t: last_ts, tok: tokens}
-
-
-def _allow(chat_id, limit=12, refill=12, window=60):
-    """Token bucket đơn giản: limit token / window giây (refill đều)."""
-    now = int(time.time())
-    q = _buckets.get(chat_id) or {"t": now, "tok": limit}
-    elapsed = now - q["t"]
-    if elapsed > 0:
-        q["tok"] = min(limit, q["tok"] + int(elapsed * (refill / window)))
-        q["t"] = now
-    _buckets[chat_id] = q
-    if q["tok"] > 0:
-        q["tok"] -= 1
-        return True
-    return False
-
-
-def _send_text(chat_id, text):
-    """Gửi tin nhắn Telegram ngắn gọn để báo trạng thái (rate-limit…)."""
-    if not TELEGRAM_TOKEN:
+# Token / secret theo bot nằm ở infra.bots (bot "default" = TELEGRAM_TOKEN / TELEGRAM_SECRET_TOKEN)
+WEBHOOK_PREFIX = "/telegram/webhook/"
+# Dedupe (bot, update_id) & rate-limit theo chat: infra.update_guard (dùng chung với poller)
+
+
+def _send_text(token, chat_id, text):
+    """Gửi tin nhắn Telegram ngắn gọn để báo trạng thái (rate-limit…) qua bộ gửi chung."""
+    if not token:
         logger.warning({"event": "missing_token"})
         return
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
+    from infra.telegram_api import send_text_sync
     try:
-        with httpx.Client(timeout=httpx.Timeout(connect=3.0, read=7.0, write=3.0)) as c:
-            r = c.post(url, json=payload)
-            logger.info({"event": "telegram_send", "status": r.status_code})
-    except httpx.HTTPError:
+        ok = send_text_sync(token, chat_id, text)
+        logger.info({"event": "telegram_send", "ok": ok})
+    except Exception:
         logger.exception("telegram_send_error")
 
 
+def _webhook_bot_key(path):
+    """Bot key theo path: "/telegram/webhook" và "/" → bot default; "/telegram/webhook/<key>" → key; khác → None."""
+    if path in ("/telegram/webhook", "/"):
+        return DEFAULT_KEY
+    if path.startswith(WEBHOOK_PREFIX) and "/" not in path[len(WEBHOOK_PREFIX):]:
+        return path[len(WEBHOOK_PREFIX):] or None
+    return None
+
+
 def _is_json_request(req):
     """Chỉ chấp nhận JSON cho webhook POST để tránh rác/scanner."""
     ct = (req.headers.get("Content-Type") or "").lower()
@@ -71,44 +73,58 @@ def _is_json_request(req):
 def _guard_webhook():
     """
     Lớp bảo vệ nhẹ cho webhook:
-      - Yêu cầu header secret
+      - Bot theo path (/telegram/webhook/<bot_key>); key lạ → 404
+      - Yêu cầu header secret (của bot đó)
       - Bắt buộc Content-Type JSON
-      - Dedupe update_id
-      - Rate-limit theo chat
+      - Dedupe (bot, update_id)
+      - Trần update/phút theo bot, rate-limit theo chat
     """
     if request.method != "POST":
         return None
-    if request.path not in ("/telegram/webhook", "/"):
+    bot_key = _webhook_bot_key(request.path)
+    if bot_key is None:
         return None
+    bot = get_bot(bot_key)
+    if bot is None:
+        return ("not found", 404)
+
+    # Đang drain (SIGTERM): từ chối update mới → Telegram gửi lại, instance khác nhận
+    if lifecycle.draining:
+        return jsonify({"error": "draining"}), 503, {"Retry-After": "1"}
 
     # 0) Content-Type JSON
     if not _is_json_request(request):
         return jsonify({"error": "content-type must be application/json"}), 415
 
     # 1) Secret header
-    if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TELEGRAM_SECRET_TOKEN:
+    got = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+    if got is None or not hmac.compare_digest(got, bot.secret):
         return ("unauthorized", 401)
 
     # 2) Parse JSON tối thiểu
     upd = request.get_json(silent=True) or {}
     upd_id = upd.get("update_id")
-    msg = (upd.get("message") or upd.get("edited_message")) or {}
-    chat_id = (msg.get("chat") or {}).get("id")
-    text = msg.get("text")
+    chat_id, text = update_guard.extract(upd)
 
     # 3) Thiếu dữ liệu cơ bản thì bỏ qua (trả 200 để Telegram không retry vô hạn)
     if not chat_id or text is None:
         logger.info({"event": "skip_update", "reason": "no_chat_or_text", "update_id": upd_id})
         return jsonify({"ok": True}), 200
 
-    # 4) Dedupe theo update_id
-    if upd_id in _seen:
+    # 4) Dedupe theo (bot, update_id) — mỗi bot có dãy update_id riêng
+    if update_guard.is_seen(bot_key, upd_id):
         return jsonify({"ok": True}), 200
-    _seen.append(upd_id)
 
-    # 5) Rate-limit theo chat
-    if not _allow(chat_id):
-        _send_text(chat_id, "Nhiều tin nhắn quá 😅 đợi mình tí nhé…")
+    # 5) Trần theo bot: vượt → 429 để Telegram gửi lại sau (không mất update, không lấn bot khác).
+    #    Chạy TRƯỚC khi đánh dấu đã thấy: lần gửi lại cùng update_id phải được xử lý, không bị coi là trùng.
+    if not bot_gate.allow(bot):
+        return jsonify({"error": "bot rate limited"}), 429, {"Retry-After": "2"}
+    update_guard.mark_seen(bot_key, upd_id)
+
+    # 6) Rate-limit theo chat (mảnh gộp vào burst đang mở không tốn thêm token)
+    key = chat_key(chat_id, bot_key)
+    if not is_coalescing(key) and not update_guard.allow_chat(key):
+        _send_text(bot.token, chat_id, update_guard.RATE_LIMIT_REPLY)
         return jsonify({"ok": True}), 200
 
     # Cho phép đi tiếp vào handler chính
@@ -134,21 +150,92 @@ def healthz_alias():
 def app_engine_health_alias():
     return jsonify(status="ok"), 200
 
+@app.get("/_readyz")
+def readyz():
+    # Readiness: fail khi đang drain để load balancer ngừng gửi request mới
+    if lifecycle.draining:
+        return jsonify(status="draining", inflight=lifecycle.inflight_count()), 503
+    return jsonify(status="ok", inflight=lifecycle.inflight_count()), 200
+
 
 # ============ Webhook handler ============
-# Import sau khi setup sys.path
-from functions.http.telegram_webhook import telegram_webhook_route  # noqa: E402
+# Import sau khi setup sys.path. Pipeline webhook (httpx, LLM provider, memory…) được import
+# lười ở request đầu tiên để container lên nhanh; EAGER_IMPORTS=1 để nạp sẵn lúc khởi động.
+from core.coalescer import is_coalescing  # noqa: E402
+from infra.lifecycle import lifecycle  # noqa: E402
+from infra.bots import DEFAULT_KEY, chat_key, gate as bot_gate, get_bot  # noqa: E402
+from infra import update_guard  # noqa: E402
+
+
+def _webhook_route(bot_key=None):
+    from functions.http.telegram_webhook import telegram_webhook_route
+    return telegram_webhook_route(bot_key)
+
+
+if os.getenv("EAGER_IMPORTS", "0") == "1":
+    import functions.http.telegram_webhook  # noqa: E402,F401
 
 
 @app.post("/telegram/webhook")
 def telegram_webhook():
-    return telegram_webhook_route()
+    return _webhook_route()
+
+
+# Nhiều bot trong 1 service: mỗi bot setWebhook về /telegram/webhook/<bot_key> (xem BOTS_CONFIG)
+@app.post("/telegram/webhook/<bot_key>")
+def telegram_webhook_bot(bot_key):
+    return _webhook_route(bot_key)
 
 
 # Cho phép Telegram trỏ vào "/" nếu cần
 @app.post("/")
 def webhook_root_alias():
-    return telegram_webhook_route()
+    return _webhook_route()
+
+
+# ============ Metrics ============
+@app.get("/_metrics")
+def metrics():
+    # Số liệu theo worker process: admission limiter (limit / inflight / shed), buffer usage
+    from core.admission import limiter_snapshot
+    from core.usage import usage_snapshot
+    from core.providers.tiered_provider import tier_snapshot
+    return jsonify(pid=os.getpid(), admission=limiter_snapshot(), usage=usage_snapshot(), tiers=tier_snapshot(),
+                   bots=bot_gate.snapshot(), inflight_updates=lifecycle.inflight_count()), 200
+
+
+# ============ Admin: profiling lấy mẫu ============
+# Tắt hoàn toàn nếu chưa đặt ADMIN_TOKEN (route trả 404).
+#   POST /_admin/profile {"rate": 0.05, "alloc": false, "reset": true}  → bật cho mọi worker trong ≤1s
+#   GET  /_admin/profile?format=collapsed  → flamegraph.pl / speedscope
+#   GET  /_admin/profile?format=alloc      → top cấp phát (tracemalloc, worker đang trả lời; cả process
+#                                            trong lúc có lượt được lấy mẫu, gồm các request chạy song song)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def _admin_ok():
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+
+@app.route("/_admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    if not _admin_ok():
+        return ("not found", 404)
+    from infra.profiling import profiler
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        try:
+            rate = float(body.get("rate", 0))
+        except (TypeError, ValueError):
+            return jsonify(error="rate must be a number"), 400
+        return jsonify(profiler.configure(rate, bool(body.get("alloc")), bool(body.get("reset")))), 200
+    fmt = request.args.get("format", "status")
+    if fmt == "collapsed":
+        return profiler.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    if fmt == "alloc":
+        limit = max(1, min(500, request.args.get("limit", 25, type=int)))
+        return jsonify(pid=os.getpid(), top=profiler.top_allocations(limit)), 200
+    return jsonify(profiler.status()), 200
 
 
 # ============ Version ============
@@ -0,0 +1,15 @@
+# embed_server.py — chạy embedding server chung cho mọi worker (Unix domain socket)
+#   python embed_server.py --socket /tmp/thienco-embed.sock --threads 2
+#   EMBED_SERVER_SOCKET=/tmp/thienco-embed.sock gunicorn app:app ...
+import os
+import sys
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(CURRENT_DIR, "src")
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+
+from core.providers.embed_server import main  # noqa: E402
+
+if __name__ == "__main__":
+    main()
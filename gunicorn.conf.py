@@ -0,0 +1,45 @@
+# gunicorn.conf.py — hook vòng đời cho graceful drain (Cloud Run gửi SIGTERM, ~10s trước SIGKILL)
+import os
+import sys
+import signal
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src")
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+
+# gthread worker chờ request đang chạy tối đa graceful_timeout sau SIGTERM
+graceful_timeout = int(float(os.getenv("DRAIN_DEADLINE_S", "8")))
+
+try:
+    BURST_WINDOW_MS = int(os.getenv("BURST_WINDOW_MS", "0") or 0)
+except ValueError:
+    BURST_WINDOW_MS = 0
+
+
+def on_starting(server):
+    # Bảng burst (core.coalescer) nằm trong RAM của từng worker: >1 worker → các mảnh của 1 burst rơi
+    # vào worker khác nhau, mỗi worker trả lời riêng. Gộp burst bật → ép 1 worker (tăng THREADS thay vì
+    # WEB_CONCURRENCY). Nhiều instance thì không ép được ở đây: cần max-instances=1 hoặc route dính theo chat.
+    if BURST_WINDOW_MS > 0 and server.num_workers > 1:
+        server.log.warning("BURST_WINDOW_MS=%s cần 1 worker; bỏ qua -w %s, chạy 1 worker",
+                           BURST_WINDOW_MS, server.num_workers)
+        server.num_workers = 1
+
+
+def post_worker_init(worker):
+    from infra.lifecycle import lifecycle
+
+    handle_exit = worker.handle_exit
+
+    def _on_sigterm(sig, frame):
+        # Flip readiness + chặn webhook mới trước, rồi để gunicorn dừng nhận kết nối như cũ
+        lifecycle.begin_drain()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+
+
+def worker_exit(server, worker):
+    from infra.lifecycle import lifecycle
+    # Flush buffer + bàn giao update chưa xong cho instance kế tiếp
+    lifecycle.shutdown()
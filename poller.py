@@ -0,0 +1,14 @@
+# poller.py — chạy bot bằng long-polling (self-host / dev), thay cho webhook
+#   python poller.py --limit 100 --timeout 50
+import os
+import sys
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(CURRENT_DIR, "src")
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+
+from functions.polling.telegram_polling import main  # noqa: E402
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# scripts/archive_messages.py — Lưu trữ partition cũ của public.messages (chạy hằng ngày)
+# Usage:
+#   python scripts/archive_messages.py --dry-run
+#   python scripts/archive_messages.py --keep-months 6
+#
+# Requires env: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY
+# Cần chạy supabase_messages_partitioning.sql trước.
+#
+# Partition cũ hơn --keep-months: tin của chat đã được tóm tắt (conv_summaries phủ tới tin cuối)
+# được gói vào messages_archive; partition rỗng thì detach + drop. Đồng thời tạo trước partition
+# cho các tháng tới.
+
+import os, argparse
+from datetime import date
+from supabase import create_client
+
+
+def _cutoff(keep_months: int) -> date:
+    t = date.today().replace(day=1)
+    m = t.year * 12 + (t.month - 1) - max(1, keep_months)
+    return date(m // 12, m % 12 + 1, 1)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--keep-months", type=int, default=int(os.getenv("MESSAGES_KEEP_MONTHS", "6") or 6),
+                    help="số tháng gần nhất giữ nguyên trong bảng nóng")
+    ap.add_argument("--dry-run", action="store_true", help="chỉ liệt kê partition sẽ được xử lý")
+    args = ap.parse_args()
+
+    db = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"])
+    parts = db.rpc("messages_partitions", {}).execute().data or []
+    cutoff = _cutoff(args.keep_months)
+    for p in parts:
+        old = date.fromisoformat(p["month"]) < cutoff
+        print(f"  {p['month'][:7]}  ~{p['est_rows']:>10} rows  {p['bytes'] / 1e6:8.1f} MB  {'→ archive' if old else ''}")
+    if args.dry_run:
+        print("Dry run. cutoff:", cutoff.isoformat())
+        return
+
+    res = db.rpc("messages_archive_old", {"keep_months": args.keep_months}).execute().data or []
+    for r in res:
+        state = "dropped" if r["dropped"] else f"{r['remaining']} rows chờ tóm tắt"
+        print(f"month {r['month'][:7]}: archived {r['archived']} rows, {state}")
+    print("Done. partitions processed:", len(res))
+
+
+if __name__ == "__main__":
+    main()
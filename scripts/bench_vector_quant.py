@@ -0,0 +1,116 @@
+# scripts/bench_vector_quant.py — So sánh lưu vector đầy đủ vs lượng tử hoá (recall@k / latency / bytes)
+# Usage:
+#   python scripts/bench_vector_quant.py --rows 20000 --queries 200 --k 8
+#   python scripts/bench_vector_quant.py --real            # dùng fastembed BGE-small thay vì dữ liệu tổng hợp
+#
+# Chạy cục bộ bằng numpy (không cần Postgres) để ước lượng sai số do lượng tử hoá:
+#   fp32         : baseline (vector(384))            — 1536 B/vector
+#   fp16         : halfvec(384)                      —  768 B/vector
+#   int8         : scalar quantization (tham khảo)   —  384 B/vector
+#   bit+rerank   : ANN hamming trên binary_quantize → rerank fp16 trên c ứng viên (memory_search_compact)
+
+import argparse, time
+import numpy as np
+
+DIM = 384
+
+
+def synthetic(rows: int, queries: int, clusters: int, seed: int):
+    """Vector chuẩn hoá, gom cụm (giống embedding câu ngắn) + query là nhiễu quanh 1 điểm dữ liệu."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, DIM)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    data = centers[labels] + 0.6 * rng.standard_normal((rows, DIM)).astype(np.float32)
+    pick = rng.integers(0, rows, queries)
+    q = data[pick] + 0.3 * rng.standard_normal((queries, DIM)).astype(np.float32)
+    return _norm(data), _norm(q)
+
+
+def real(rows: int, queries: int, seed: int):
+    from fastembed import TextEmbedding
+    rng = np.random.default_rng(seed)
+    words = "trà đá cà phê Dũng Hà Nội Sài Gòn code python deploy bot Telegram nhớ thích ghét học làm việc".split()
+    texts = [" ".join(rng.choice(words, 6)) for _ in range(rows + queries)]
+    m = TextEmbedding(model_name="BAAI/bge-small-en-v1.5")
+    vecs = np.asarray(list(m.embed(texts)), dtype=np.float32)
+    return _norm(vecs[:rows]), _norm(vecs[rows:])
+
+
+def _norm(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def topk(scores, k):
+    idx = np.argpartition(-scores, k, axis=1)[:, :k]
+    order = np.take_along_axis(scores, idx, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def timed(fn):
+    t = time.perf_counter()
+    out = fn()
+    return out, (time.perf_counter() - t)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--candidates", type=int, default=0, help="ứng viên pha 1 (0 = 8*k)")
+    ap.add_argument("--clusters", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--real", action="store_true")
+    args = ap.parse_args()
+
+    data, q = real(args.rows, args.queries, args.seed) if args.real else \
+        synthetic(args.rows, args.queries, args.clusters, args.seed)
+    k, c = args.k, (args.candidates or 8 * args.k)
+    nq = len(q)
+
+    truth, t32 = timed(lambda: topk(q @ data.T, k))
+
+    d16 = data.astype(np.float16)
+    q16 = q.astype(np.float16)
+    f16, t16 = timed(lambda: topk((q16.astype(np.float32) @ d16.astype(np.float32).T), k))
+
+    scale = 127.0 / np.abs(data).max(axis=1, keepdims=True)
+    d8 = np.round(data * scale).astype(np.int8)
+    f8, t8 = timed(lambda: topk((q @ (d8.astype(np.float32) / scale).T), k))
+
+    # binary_quantize: bit = (x > 0); hamming qua popcount trên bytes đã pack
+    dbits = np.packbits(data > 0, axis=1)
+    qbits = np.packbits(q > 0, axis=1)
+    popcnt = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+    def bit_rerank():
+        out = []
+        d16f = d16.astype(np.float32)
+        for i in range(nq):
+            ham = popcnt[np.bitwise_xor(dbits, qbits[i])].sum(axis=1)
+            cand = np.argpartition(ham, c)[:c]
+            s = d16f[cand] @ q16[i].astype(np.float32)
+            out.append(cand[np.argsort(-s)[:k]])
+        return out
+
+    fb, tb = timed(bit_rerank)
+
+    rows = [
+        ("fp32 (vector)", 1.0, t32, DIM * 4),
+        ("fp16 (halfvec)", recall(f16, truth), t16, DIM * 2),
+        ("int8 scalar", recall(f8, truth), t8, DIM),
+        (f"bit ANN + fp16 rerank (c={c})", recall(fb, truth), tb, DIM // 8),
+    ]
+    src = "fastembed" if args.real else "synthetic"
+    print(f"rows={len(data)} queries={nq} k={k} data={src}")
+    print(f"{'mode':34} {'recall@k':>9} {'ms/query':>9} {'B/vector':>9}")
+    for name, r, t, b in rows:
+        print(f"{name:34} {r:9.4f} {1000 * t / nq:9.3f} {b:9d}")
+
+
+if __name__ == "__main__":
+    main()
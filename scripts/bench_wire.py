@@ -0,0 +1,109 @@
+# scripts/bench_wire.py — Micro-benchmark định dạng wire trên đường xử lý 1 update (bytes / µs)
+# Usage:
+#   python scripts/bench_wire.py
+#   python scripts/bench_wire.py --n 5000 --candidates 32 --decimals 5
+#
+# So sánh "cũ" (json stdlib, vector = list float Python) với "mới" (infra.fastjson + literal pgvector
+# dựng từ float32) cho các bước mỗi update đi qua:
+#   parse update        : request.get_json ở guard (body Telegram)
+#   response            : body trả về Telegram
+#   query vector → DB   : tham số q của memory_search_candidates (httpx json= của supabase-py)
+#   candidates ← DB     : parse n embedding dạng chuỗi '[..]' cho MMR
+#   LLM request/reply   : body gửi OpenRouter + parse phản hồi
+# Không cần mạng / DB / model: vector tổng hợp chuẩn hoá 384 chiều.
+import os, sys, json, time, argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from infra import fastjson  # noqa: E402
+from core.providers.embeddings_provider import to_vector_literal  # noqa: E402
+
+DIM = 384
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _bench(fn, n: int) -> float:
+    fn()
+    t = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t) / n * 1e6
+
+
+def _old_dumps(obj) -> bytes:
+    # httpx json= / json.dumps mặc định: ensure_ascii=True, separators có khoảng trắng
+    return json.dumps(obj).encode("utf-8")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="bytes / µs mỗi update: json stdlib + list float vs fastjson + literal float32")
+    ap.add_argument("--n", type=int, default=2000, help="số lần lặp mỗi phép đo")
+    ap.add_argument("--candidates", type=int, default=32, help="số ứng viên MMR trả về kèm embedding")
+    ap.add_argument("--decimals", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vecs = rng.standard_normal((args.candidates + 1, DIM)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    q = vecs[0]
+
+    with open(os.path.join(HERE, "sample_update.json"), "rb") as f:
+        upd = json.loads(f.read())
+    upd["message"]["text"] = "Mình tên Dũng, hôm qua uống trà đá ở Hà Nội, nhớ giúp mình nhé"
+    update_body = _old_dumps(upd)
+
+    # Dạng PostgREST trả embedding: chuỗi '[..]' (float32 đầy đủ, giống cột vector)
+    db_rows = [",".join(f"{x:.9g}" for x in v.tolist()) for v in vecs[1:]]
+    db_rows = ["[" + r + "]" for r in db_rows]
+
+    messages = [
+        {"role": "system", "content": "Bạn là Thiên Cơ – trợ lý trung thực, hài hước, chính xác. " * 20},
+        {"role": "system", "content": "Ngữ cảnh nhớ (nếu liên quan):\n- Tên là Dũng\n- Thích trà đá\n" * 5},
+        {"role": "user", "content": upd["message"]["text"]},
+    ]
+    llm_req = {"model": "openai/gpt-4o-mini", "messages": messages, "max_tokens": 512, "temperature": 0.3}
+    llm_resp = _old_dumps({"id": "gen-1", "model": "openai/gpt-4o-mini", "choices": [{"message": {
+        "role": "assistant", "content": "Chào Dũng! Mình nhớ rồi nhé 😊 " * 20}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 900, "completion_tokens": 200, "cost": 0.0001}})
+
+    def old_vec():
+        return _old_dumps({"u": "111222333", "q": [float(x) for x in q.tolist()], "n": args.candidates})
+
+    def new_vec():
+        return fastjson.dumps({"u": "111222333", "q": to_vector_literal(q, args.decimals), "n": args.candidates})
+
+    cases = [
+        ("parse update", lambda: json.loads(update_body), lambda: fastjson.loads(update_body), None, None),
+        ("response", lambda: _old_dumps({"handled_ms": 123}), lambda: fastjson.dumps({"handled_ms": 123}),
+         len(_old_dumps({"handled_ms": 123})), len(fastjson.dumps({"handled_ms": 123}))),
+        ("query vector → DB", old_vec, new_vec, len(old_vec()), len(new_vec())),
+        (f"candidates ← DB ×{args.candidates}", lambda: [json.loads(r) for r in db_rows],
+         lambda: [fastjson.loads(r) for r in db_rows], None, None),
+        ("LLM request", lambda: _old_dumps(llm_req), lambda: fastjson.dumps(llm_req),
+         len(_old_dumps(llm_req)), len(fastjson.dumps(llm_req))),
+        ("LLM reply", lambda: json.loads(llm_resp), lambda: fastjson.loads(llm_resp), None, None),
+    ]
+
+    print(f"backend: {fastjson.BACKEND} | decimals: {args.decimals} | n={args.n}")
+    print(f"{'step':26} {'old µs':>9} {'new µs':>9} {'saved µs':>9} {'old B':>7} {'new B':>7} {'saved B':>8}")
+    tot_us = tot_b = 0.0
+    for name, old, new, ob, nb in cases:
+        t_old, t_new = _bench(old, args.n), _bench(new, args.n)
+        tot_us += t_old - t_new
+        saved_b = (ob - nb) if ob is not None else 0
+        tot_b += saved_b
+        ob_s = f"{ob:7d}" if ob is not None else f"{'-':>7}"
+        nb_s = f"{nb:7d}" if nb is not None else f"{'-':>7}"
+        print(f"{name:26} {t_old:9.1f} {t_new:9.1f} {t_old - t_new:9.1f} {ob_s} {nb_s} {saved_b:8d}")
+    print(f"{'per update':26} {'':>9} {'':>9} {tot_us:9.1f} {'':>7} {'':>7} {int(tot_b):8d}")
+
+    # Sai số do làm tròn literal: ảnh hưởng tới cosine (thứ hạng kết quả)
+    back = np.asarray(fastjson.loads(to_vector_literal(q, args.decimals)), dtype=np.float32)
+    cos_err = np.abs(vecs[1:] @ back - vecs[1:] @ q).max()
+    print(f"max |Δcos| vs float32: {cos_err:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# scripts/compact_memory.py — Dọn ký ức gần trùng đã tồn tại trong memory_vectors (chạy theo lô)
+# Usage:
+#   python scripts/compact_memory.py --dry-run
+#   python scripts/compact_memory.py --user-id 6149721828 --threshold 0.92
+#
+# Requires env: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY (+ EMBED_STORAGE nếu dùng halfvec)
+# Cần chạy supabase_memory_dedupe.sql trước (cột meta/updated_at + RPC memory_users).
+#
+# Mỗi user: tải toàn bộ vector → gom cụm tham lam kiểu MMR (core.dedupe) theo từng ref_type →
+# giữ 1 đại diện/cụm (cộng dồn count/weight), xoá phần còn lại.
+
+import os, sys, json, argparse
+from supabase import create_client
+sys.path.insert(0, "src")
+from core.dedupe import cluster_near_duplicates
+
+PAGE = 1000
+VEC_COL = "embedding_h" if os.getenv("EMBED_STORAGE", "vector").strip().lower() == "halfvec" else "embedding"
+
+
+def _vec(v):
+    # PostgREST trả vector dạng chuỗi '[...]'
+    return json.loads(v) if isinstance(v, str) else v
+
+
+def fetch_user(db, user_id: str):
+    rows, start = [], 0
+    while True:
+        page = (db.table("memory_vectors")
+                  .select(f"id,ref_type,ref_id,content,meta,updated_at,{VEC_COL}")
+                  .eq("user_id", user_id)
+                  .order("id")  # thứ tự ổn định giữa các trang (không lặp / sót dòng)
+                  .range(start, start + PAGE - 1)
+                  .execute().data or [])
+        rows += [r for r in page if r.get(VEC_COL)]
+        if len(page) < PAGE:
+            return rows
+        start += PAGE
+
+
+def _importance(r):
+    return float((r.get("meta") or {}).get("count", 1))
+
+
+def compact_user(db, user_id: str, threshold: float, dry_run: bool) -> int:
+    rows = fetch_user(db, user_id)
+    removed = 0
+    for ref_type in sorted({r["ref_type"] for r in rows}):
+        group = [r for r in rows if r["ref_type"] == ref_type]
+        # Cùng count → bản mới hơn làm đại diện
+        group.sort(key=lambda r: str(r.get("updated_at") or ""), reverse=True)
+        clusters = cluster_near_duplicates([_vec(r[VEC_COL]) for r in group],
+                                           [_importance(r) for r in group], threshold)
+        for cl in clusters:
+            if len(cl) < 2:
+                continue
+            rep, dups = group[cl[0]], [group[i] for i in cl[1:]]
+            meta = dict(rep.get("meta") or {})
+            meta["count"] = sum(int((r.get("meta") or {}).get("count", 1)) for r in [rep] + dups)
+            meta["weight"] = sum(float((r.get("meta") or {}).get("weight", 1.0)) for r in [rep] + dups)
+            print(f"  [{ref_type}] keep {rep['id']} ({meta['count']}x): {rep['content'][:60]!r}")
+            removed += len(dups)
+            if dry_run:
+                continue
+            db.table("memory_vectors").update({"meta": meta}).eq("id", rep["id"]).execute()
+            ids = [r["id"] for r in dups]
+            db.table("memory_vectors").delete().in_("id", ids).execute()
+            if ref_type == "fact":
+                db.table("memory_facts").delete().in_("id", [r["ref_id"] for r in dups]).execute()
+    return removed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--user-id", type=str, default=None, help="chỉ compact 1 user (mặc định: tất cả)")
+    ap.add_argument("--threshold", type=float, default=float(os.getenv("MEMORY_DEDUPE_THRESHOLD", "0.92") or 0.92))
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    db = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"])
+    users = [args.user_id] if args.user_id else [r["user_id"] for r in (db.rpc("memory_users", {}).execute().data or [])]
+    total = 0
+    for u in users:
+        n = compact_user(db, u, args.threshold, args.dry_run)
+        print(f"user {u}: {'would remove' if args.dry_run else 'removed'} {n} duplicates")
+        total += n
+    print("Done. total:", total)
+
+
+if __name__ == "__main__":
+    main()
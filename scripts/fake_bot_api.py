@@ -0,0 +1,79 @@
+# scripts/fake_bot_api.py — Bot API giả lập (stdlib) để test poller / bộ gửi tại máy
+# Usage:
+#   python scripts/fake_bot_api.py --port 8081 --chats 50 --messages 20
+#   TELEGRAM_API_BASE=http://127.0.0.1:8081 TELEGRAM_TOKEN=x python poller.py --timeout 5
+#
+# - getUpdates: trả update sinh sẵn theo offset/limit (giữ lại tới khi được xác nhận)
+# - sendMessage / sendChatAction / deleteWebhook: luôn ok, đếm số lần gọi
+# - GET /stats: số update đã giao, số tin đã gửi theo chat
+
+import json, time, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_lock = threading.Lock()
+_updates = []
+_sent = {}
+_calls = {"getUpdates": 0}
+
+
+def _gen(chats: int, per_chat: int):
+    uid = 1
+    for i in range(per_chat):
+        for c in range(1, chats + 1):
+            _updates.append({
+                "update_id": uid,
+                "message": {"message_id": i + 1, "date": int(time.time()),
+                            "chat": {"id": c, "type": "private"}, "text": f"tin {i} từ chat {c}"},
+            })
+            uid += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body, status=200):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        with _lock:
+            self._reply({"updates": len(_updates), "calls": _calls, "sent": _sent})
+
+    def do_POST(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(n) or b"{}")
+        method = self.path.rsplit("/", 1)[-1]
+        if method == "getUpdates":
+            offset, limit = int(body.get("offset", 0)), int(body.get("limit", 100))
+            with _lock:
+                _calls["getUpdates"] += 1
+                _updates[:] = [u for u in _updates if u["update_id"] >= offset]
+                batch = _updates[:limit]
+            if not batch:
+                time.sleep(min(float(body.get("timeout", 0)), 1.0))
+            return self._reply({"ok": True, "result": batch})
+        if method == "sendMessage":
+            with _lock:
+                _sent[str(body.get("chat_id"))] = _sent.get(str(body.get("chat_id")), 0) + 1
+            return self._reply({"ok": True, "result": {"message_id": 1}})
+        return self._reply({"ok": True, "result": True})
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--chats", type=int, default=20)
+    ap.add_argument("--messages", type=int, default=5, help="số tin mỗi chat")
+    args = ap.parse_args()
+    _gen(args.chats, args.messages)
+    print(f"fake Bot API on :{args.port} with {len(_updates)} updates")
+    ThreadingHTTPServer(("127.0.0.1", args.port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
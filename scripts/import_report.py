@@ -0,0 +1,75 @@
+# scripts/import_report.py — Báo cáo chi phí import (kiểu `python -X importtime`) + ngân sách cold start
+# Usage:
+#   python scripts/import_report.py                      # đo `import app`, in top 25 theo cumulative
+#   python scripts/import_report.py --module functions.http.telegram_webhook --top 40
+#   python scripts/import_report.py --budget-ms 400      # exit 1 nếu tổng vượt ngân sách (dùng trong CI)
+#   python scripts/import_report.py --by-package         # gộp theo package gốc (flask, httpx, supabase…)
+#
+# Chạy import trong subprocess sạch (không dính cache sys.modules), lặp --runs lần và lấy trung vị.
+
+import os, re, sys, argparse, subprocess, statistics
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def run_once(module: str):
+    """Trả list (module, self_us, cumulative_us, depth) theo thứ tự import."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, "src")]))
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                       cwd=ROOT, env=env, capture_output=True, text=True)
+    if p.returncode != 0:
+        raise SystemExit(f"[ERROR] import {module} thất bại:\n{p.stderr[-2000:]}")
+    rows = []
+    for ln in p.stderr.splitlines():
+        m = _LINE.match(ln)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2))
+    return rows
+
+
+def measure(module: str, runs: int):
+    samples = [run_once(module) for _ in range(max(1, runs))]
+    agg = defaultdict(lambda: ([], []))
+    for rows in samples:
+        for name, self_us, cum_us, _ in rows:
+            agg[name][0].append(self_us)
+            agg[name][1].append(cum_us)
+    depth = {name: d for name, _, _, d in samples[0]}
+    out = {name: (statistics.median(s), statistics.median(c), depth.get(name, 0)) for name, (s, c) in agg.items()}
+    total = statistics.median(sum(r[1] for r in rows) for rows in samples)
+    return out, total
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--module", type=str, default="app")
+    ap.add_argument("--top", type=int, default=25)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--by-package", action="store_true")
+    ap.add_argument("--budget-ms", type=float, default=0.0, help="0 = không kiểm tra")
+    args = ap.parse_args()
+
+    stats, total_us = measure(args.module, args.runs)
+    print(f"import {args.module}: total {total_us / 1000:.1f} ms ({len(stats)} modules, median of {args.runs})")
+
+    if args.by_package:
+        pkg = defaultdict(float)
+        for name, (self_us, _, _) in stats.items():
+            pkg[name.split(".")[0]] += self_us
+        print(f"{'package':32} {'self ms':>9} {'share':>7}")
+        for name, us in sorted(pkg.items(), key=lambda x: -x[1])[:args.top]:
+            print(f"{name:32} {us / 1000:9.1f} {100 * us / max(total_us, 1):6.1f}%")
+    else:
+        print(f"{'module':48} {'self ms':>9} {'cum ms':>9}")
+        for name, (self_us, cum_us, d) in sorted(stats.items(), key=lambda x: -x[1][1])[:args.top]:
+            print(f"{('  ' * min(d, 6) + name)[:48]:48} {self_us / 1000:9.1f} {cum_us / 1000:9.1f}")
+
+    if args.budget_ms and total_us / 1000 > args.budget_ms:
+        print(f"[FAIL] vượt ngân sách import: {total_us / 1000:.1f} ms > {args.budget_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,7 @@ async def main():
         sb.table("memory_facts").insert({"id": fid, "user_id": USER, "content": CONTENT, "meta": {}}).execute()
     sb.table("memory_vectors").insert({
         "user_id": USER, "ref_type": "fact", "ref_id": str(fid),
-        "content": CONTENT, "embedding": vec
+        "content": CONTENT, "embedding": emb.to_db(vec)
     }).execute()
     print("Seed OK. user:", USER, "fact_id:", fid, "dims:", len(vec))
 
@@ -0,0 +1,100 @@
+# src/core/admission.py — Giới hạn đồng thời thích nghi (gradient, kiểu Netflix concurrency-limits)
+#
+# Khi OpenRouter chậm, latency mẫu (short RTT) tăng so với baseline (long RTT, EWMA chậm)
+# → gradient < 1 → giảm số lượt LLM được chạy song song. Request vượt giới hạn bị "shed"
+# ngay (trả lời soạn sẵn) thay vì xếp hàng tới timeout 120s của gunicorn.
+import math
+import time
+import threading
+from typing import Any, Dict, Optional
+
+
+class AdaptiveLimiter:
+    """
+    Gradient2 rút gọn, thread-safe (dùng chung giữa các gthread trong 1 worker):
+      gradient  = clamp(tolerance * long_rtt / short_rtt, 0.5, 1.0)
+      new_limit = limit * gradient + sqrt(limit)          # sqrt(limit) = "hàng chờ" cho phép tăng
+      limit     = limit * (1 - smoothing) + new_limit * smoothing
+    long_rtt là EWMA theo thời gian (hằng số `long_window_s`) nên baseline không bị
+    "đuổi kịp" ngay khi brownout tạo ra nhiều mẫu chậm liên tiếp.
+    Lỗi / timeout được tính là mẫu có RTT = timeout → kéo limit xuống.
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 2, max_limit: int = 64,
+                 tolerance: float = 1.5, smoothing: float = 0.2, long_window_s: float = 300.0,
+                 clock=time.monotonic):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.long_window_s = max(1.0, long_window_s)
+        self._clock = clock
+        self._long_rtt = 0.0
+        self._long_at = 0.0
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.accepted = 0
+        self.shed = 0
+
+    def try_acquire(self) -> Optional[float]:
+        """Trả mốc bắt đầu (token) nếu được chạy, None nếu phải shed."""
+        with self._lock:
+            if self.inflight >= int(self.limit):
+                self.shed += 1
+                return None
+            self.inflight += 1
+            self.accepted += 1
+        return self._clock()
+
+    def release(self, token: float, rtt: Optional[float] = None) -> None:
+        """Trả slot; `rtt` = latency đo được của lượt LLM (None = không có mẫu, vd. lỗi trước khi gọi)."""
+        with self._lock:
+            inflight = self.inflight
+            self.inflight = max(0, self.inflight - 1)
+            if rtt is None or rtt <= 0:
+                return
+            now = self._clock()
+            if self._long_rtt <= 0:
+                self._long_rtt = rtt
+            else:
+                alpha = min(1.0, max(0.0, now - self._long_at) / self.long_window_s)
+                self._long_rtt += alpha * (rtt - self._long_rtt)
+                # Baseline quá cao so với hiện tại (sau brownout) → hồi nhanh về gần mẫu mới
+                if self._long_rtt / rtt > 2.0:
+                    self._long_rtt *= 0.95
+            self._long_at = now
+            gradient = max(0.5, min(1.0, self.tolerance * self._long_rtt / rtt))
+            new_limit = self.limit * gradient + math.sqrt(self.limit)
+            new_limit = self.limit * (1 - self.smoothing) + new_limit * self.smoothing
+            # Đang dùng chưa tới nửa limit → không đủ tín hiệu để TĂNG; tín hiệu giảm (latency xấu) vẫn áp dụng
+            if new_limit > self.limit and inflight < self.limit / 2:
+                return
+            self.limit = float(max(self.min_limit, min(self.max_limit, new_limit)))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "inflight": self.inflight,
+                "accepted": self.accepted,
+                "shed": self.shed,
+                "long_rtt_ms": int(self._long_rtt * 1000),
+            }
+
+
+_limiter: Optional[AdaptiveLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter(initial: int, min_limit: int, max_limit: int) -> AdaptiveLimiter:
+    """Singleton theo process (mọi request thread chia sẻ 1 limit)."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveLimiter(initial=initial, min_limit=min_limit, max_limit=max_limit)
+        return _limiter
+
+
+def limiter_snapshot() -> Dict[str, Any]:
+    return _limiter.snapshot() if _limiter is not None else {}
@@ -0,0 +1,151 @@
+# src/core/coalescer.py — Gộp "burst" tin nhắn liên tiếp của 1 chat thành 1 lượt LLM
+#
+# Bảng burst là singleton theo PROCESS: mọi mảnh của 1 burst phải tới cùng process. gunicorn.conf.py
+# ép 1 worker khi BURST_WINDOW_MS > 0; nhiều instance cần max-instances=1 hoặc route dính theo chat
+# (không thì mỗi instance nhận 1 phần burst và trả lời riêng). Poller: 1 process / bot, luôn đúng.
+import time
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+class _Burst:
+    """Trạng thái burst của 1 chat: các mảnh tin (theo message_id) + bộ đếm thế hệ."""
+    __slots__ = ("parts", "seq", "started_at", "last_at")
+
+    def __init__(self, now: float):
+        self.parts: Dict[int, Tuple[int, str]] = {}  # message_id -> (seq, text)
+        self.seq = 0
+        self.started_at = now
+        self.last_at = now
+
+    def text(self) -> str:
+        return "\n".join(t for _, (_, t) in sorted(self.parts.items()) if t)
+
+
+class BurstCoalescer:
+    """
+    Debounce theo chat (thread-safe, dùng chung giữa các gthread của gunicorn):
+      - Tin đầu tiên của burst → "leader": chờ chat im lặng `window_ms` rồi mới gọi LLM.
+      - Tin đến sau trong lúc leader chờ/đang sinh → chỉ gộp vào burst, trả 200 ngay.
+      - Mảnh mới (hoặc edited_message của mảnh đang xử lý) đến trước khi gửi trả lời
+        → huỷ lượt sinh hiện tại và sinh lại với nội dung đã gộp.
+      - `max_wait_ms` chặn trên tổng thời gian debounce để user gõ liên tục vẫn có trả lời.
+    """
+
+    def __init__(self, window_ms: int, max_wait_ms: int = 4000, poll_ms: int = 50):
+        self.window = max(0, window_ms) / 1000.0
+        self.max_wait = max(window_ms, max_wait_ms) / 1000.0
+        self.poll = max(10, poll_ms) / 1000.0
+        self._lock = threading.Lock()
+        self._bursts: Dict[int, _Burst] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def is_active(self, chat_id: int) -> bool:
+        with self._lock:
+            return chat_id in self._bursts
+
+    def offer(self, chat_id: int, message_id: int, text: str) -> bool:
+        """
+        Đưa 1 mảnh tin vào burst của chat. Trả True nếu caller là leader
+        (phải gọi `run`), False nếu mảnh đã được gộp vào burst đang chạy.
+        Tin đã sửa (edited_message) dùng lại message_id → ghi đè mảnh cũ.
+        """
+        now = time.monotonic()
+        with self._lock:
+            b = self._bursts.get(chat_id)
+            leader = b is None
+            if leader:
+                b = self._bursts[chat_id] = _Burst(now)
+            b.seq += 1
+            b.parts[message_id] = (b.seq, text)
+            b.last_at = now
+            return leader
+
+    def _snapshot(self, chat_id: int) -> Tuple[int, str, float, float]:
+        with self._lock:
+            b = self._bursts[chat_id]
+            return b.seq, b.text(), b.last_at, b.started_at
+
+    def _changed(self, chat_id: int, seq: int) -> bool:
+        with self._lock:
+            return self._bursts[chat_id].seq != seq
+
+    def _finish(self, chat_id: int, seq: int) -> bool:
+        """Bỏ các mảnh đã trả lời; trả True nếu burst đã hết (leader dừng)."""
+        with self._lock:
+            b = self._bursts[chat_id]
+            b.parts = {mid: p for mid, p in b.parts.items() if p[0] > seq}
+            if not b.parts:
+                del self._bursts[chat_id]
+                return True
+            b.started_at = time.monotonic()
+            return False
+
+    async def _wait_quiet(self, chat_id: int) -> None:
+        while True:
+            _, _, last_at, started_at = self._snapshot(chat_id)
+            now = time.monotonic()
+            if now - last_at >= self.window or now - started_at >= self.max_wait:
+                return
+            await asyncio.sleep(min(self.poll, self.window - (now - last_at)))
+
+    async def run(
+        self,
+        chat_id: int,
+        generate: Callable[[str], Awaitable[str]],
+        deliver: Callable[[str, str], Awaitable[None]],
+    ) -> int:
+        """
+        Vòng lặp của leader: chờ im lặng → sinh trả lời → gửi.
+        Nếu burst đổi trong lúc sinh → huỷ task sinh và làm lại.
+        `deliver(user_text, answer)` nhận cả nội dung đã gộp để ghi log.
+        Trả về số lần gọi `generate` (để log/đo).
+        """
+        calls = 0
+        try:
+            while True:
+                await self._wait_quiet(chat_id)
+                seq, text, _, _ = self._snapshot(chat_id)
+                calls += 1
+                task = asyncio.ensure_future(generate(text))
+                superseded = False
+                while not task.done():
+                    await asyncio.wait({task}, timeout=self.poll)
+                    if not task.done() and self._changed(chat_id, seq):
+                        task.cancel()
+                        superseded = True
+                        break
+                if superseded or self._changed(chat_id, seq):
+                    if not task.done():
+                        await asyncio.gather(task, return_exceptions=True)
+                    continue
+                await deliver(text, task.result())
+                if self._finish(chat_id, seq):
+                    return calls
+        except BaseException:
+            # Không để burst "kẹt" leader ảo nếu lỗi → các tin sau tự tạo burst mới
+            with self._lock:
+                self._bursts.pop(chat_id, None)
+            raise
+
+
+_coalescer: Optional[BurstCoalescer] = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer(window_ms: int, max_wait_ms: int) -> BurstCoalescer:
+    """Singleton theo process (mọi request thread dùng chung 1 bảng burst)."""
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = BurstCoalescer(window_ms, max_wait_ms)
+        return _coalescer
+
+
+def is_coalescing(chat_id: int) -> bool:
+    """True nếu chat đang có burst mở (tin mới sẽ được gộp, không tính rate-limit riêng)."""
+    return _coalescer is not None and _coalescer.is_active(chat_id)
@@ -0,0 +1,151 @@
+# src/core/context.py — Hậu xử lý truy xuất: MMR đa dạng hoá + nén ngữ cảnh theo ngân sách token
+#
+# Top-k theo score thường gồm nhiều fact/summary gần giống nhau → tốn prompt cho phần lặp.
+# mmr_select chọn k mục vừa liên quan vừa khác nhau (1 ma trận tương đồng numpy cho cả tập ứng viên);
+# build_context giữ lại các câu liên quan nhất với câu hỏi của mỗi mảnh và dừng ở ngân sách token,
+# không bao giờ cắt giữa câu.
+import math
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from core.dedupe import normalize_rows
+
+_SENT_RE = re.compile(r"(?<=[.!?…;])\s+|\n+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_vi(text: str) -> str:
+    """Chữ thường + bỏ dấu tiếng Việt ('Dũng' → 'dung', 'trà đá' → 'tra da')."""
+    t = unicodedata.normalize("NFD", (text or "").lower())
+    t = "".join(ch for ch in t if unicodedata.category(ch) != "Mn")
+    return t.replace("đ", "d")
+
+
+def tokens(text: str) -> List[str]:
+    return _WORD_RE.findall(fold_vi(text))
+
+
+# Hư từ / đại từ / từ hỏi hay gặp (giữ dấu: bỏ dấu trước sẽ nhập "đã" với "đá", "là" với "lá"…)
+_VI_STOP = frozenset("""
+à ạ ai anh bao bạn bị cái các cần cho chị chưa có còn của cũng đã đang để đến đi đó được em gì giờ
+giúp hả hay hãy hỏi khi không là lại làm lên lúc mà mấy mình một nào này nếu nha nhé nhỉ nhớ như
+những nói ở ơi qua quá ra rằng rồi sao sẽ ta tại thế thì tôi từ và vào vẫn vậy về vì với xin biết đâu
+""".split())
+
+
+def _accented_words(text: str) -> List[str]:
+    return _WORD_RE.findall(unicodedata.normalize("NFC", (text or "").lower()))
+
+
+def lexical_terms(text: str, fold: bool = True) -> List[str]:
+    """
+    Từ đáng để so khớp từ vựng: bỏ hư từ và token 1 ký tự, giữ thứ tự, không lặp.
+    fold=True: bỏ dấu (gửi DB, tăng recall); fold=False: giữ dấu ('đá' ≠ 'đà' ≠ 'da').
+    """
+    out: List[str] = []
+    for w in _accented_words(text):
+        if w in _VI_STOP:
+            continue
+        f = fold_vi(w) if fold else w
+        if len(fold_vi(w)) > 1 and f not in out:
+            out.append(f)
+    return out
+
+
+def term_coverage(terms: Sequence[str], text: str, fold: bool = True) -> float:
+    """Tỉ lệ `terms` có mặt trong `text` (so khớp nguyên từ; fold=False: phải khớp cả dấu)."""
+    if not terms:
+        return 0.0
+    words = set(tokens(text) if fold else _accented_words(text))
+    return sum(1 for t in terms if t in words) / len(terms)
+
+
+def estimate_tokens(text: str) -> int:
+    # Ước lượng thô cho BPE với tiếng Việt có dấu (~3 ký tự / token); đủ để chia ngân sách
+    return max(1, math.ceil(len(text) / 3))
+
+
+def mmr_select(query_vec, cand_vecs, k: int, lambda_: float = 0.5,
+               relevance: Optional[Sequence[float]] = None) -> List[int]:
+    """
+    Maximal Marginal Relevance: lần lượt chọn argmax[ λ·rel(i) − (1−λ)·max_{j∈S} sim(i, j) ].
+    Ma trận sim ứng viên × ứng viên tính 1 lần; mỗi bước chỉ cập nhật vector "max sim tới tập đã chọn".
+    Trả index theo thứ tự chọn.
+    """
+    m = normalize_rows(cand_vecs)
+    n = len(m)
+    if n == 0 or k <= 0:
+        return []
+    if relevance is None:
+        q = normalize_rows([query_vec])[0]
+        rel = m @ q
+    else:
+        rel = np.asarray(relevance, dtype=np.float32)
+    sim = m @ m.T
+    chosen: List[int] = []
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(k, n)):
+        penalty = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        gain = lambda_ * rel - (1.0 - lambda_) * penalty
+        gain[~available] = -np.inf
+        i = int(np.argmax(gain))
+        chosen.append(i)
+        available[i] = False
+        max_sim = np.maximum(max_sim, sim[i])
+    return chosen
+
+
+def compress_snippet(text: str, query_tokens: set, max_tokens: int) -> str:
+    """Giữ các câu chứa nhiều từ của câu hỏi nhất (theo thứ tự gốc) trong `max_tokens`."""
+    text = (text or "").strip()
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sents = [s.strip() for s in _SENT_RE.split(text) if s.strip()]
+    scored = []
+    for idx, s in enumerate(sents):
+        words = tokens(s)
+        overlap = len(query_tokens.intersection(words))
+        scored.append((-(overlap / math.sqrt(len(words) or 1)), idx))
+    keep, used = [], 0
+    for _, idx in sorted(scored):
+        cost = estimate_tokens(sents[idx])
+        if used + cost > max_tokens:
+            continue
+        keep.append(idx)
+        used += cost
+    if not keep:
+        # Câu liên quan nhất một mình đã vượt ngân sách (câu dài không dấu chấm) → cắt theo ranh giới từ
+        return _truncate_words(sents[min(scored)[1]], max_tokens) if sents else ""
+    return " ".join(sents[i] for i in sorted(keep))
+
+
+def _truncate_words(text: str, max_tokens: int) -> str:
+    """Cắt `text` tại khoảng trắng cuối cùng sao cho (kèm '…') vẫn ≤ max_tokens."""
+    limit = max_tokens * 3 - 1  # estimate_tokens ≈ len/3; chừa 1 ký tự cho '…'
+    if limit <= 0:
+        return ""
+    cut = text[:limit]
+    if len(text) > limit and not text[limit].isspace() and " " in cut:
+        cut = cut.rsplit(" ", 1)[0]  # bỏ từ bị cắt dở
+    return cut.rstrip(" ,;:-") + "…"
+
+
+def build_context(items: List[Dict[str, Any]], query: str, token_budget: int = 400,
+                  snippet_tokens: int = 80, prefix: str = "- ") -> str:
+    """Ghép các mảnh (đã xếp thứ tự) thành khối ngữ cảnh ≤ token_budget; mảnh không vừa thì bỏ, không cắt dở."""
+    q = set(tokens(query))
+    lines, used = [], 0
+    for it in items:
+        snippet = compress_snippet(str(it.get("content", "")), q, snippet_tokens)
+        if not snippet:
+            continue
+        cost = estimate_tokens(prefix + snippet)
+        if used + cost > token_budget:
+            continue
+        lines.append(prefix + snippet)
+        used += cost
+    return "\n".join(lines)
@@ -0,0 +1,40 @@
+# src/core/dedupe.py — Gom cụm ký ức gần trùng (dùng cho compaction theo lô)
+from typing import List, Sequence
+
+import numpy as np
+
+
+def normalize_rows(vecs) -> np.ndarray:
+    m = np.asarray(vecs, dtype=np.float32)
+    if m.ndim != 2 or not len(m):
+        return m.reshape(0, 0) if not len(m) else m
+    n = np.linalg.norm(m, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return m / n
+
+
+def cluster_near_duplicates(vecs, importance: Sequence[float], threshold: float) -> List[List[int]]:
+    """
+    Gom cụm tham lam kiểu MMR: duyệt theo độ quan trọng giảm dần; mỗi mục gia nhập
+    đại diện đầu tiên có cosine ≥ threshold, nếu không thì trở thành đại diện mới.
+    Tính 1 ma trận tương đồng duy nhất (numpy), không so từng cặp bằng vòng lặp Python.
+    Trả về list cụm, phần tử đầu mỗi cụm là đại diện (index theo `vecs`).
+    """
+    m = normalize_rows(vecs)
+    n = len(m)
+    if n == 0:
+        return []
+    sim = m @ m.T
+    order = np.argsort(-np.asarray(importance, dtype=np.float64), kind="stable")
+    reps: List[int] = []
+    clusters: List[List[int]] = []
+    for i in order:
+        if reps:
+            s = sim[i, reps]
+            j = int(np.argmax(s))
+            if s[j] >= threshold:
+                clusters[j].append(int(i))
+                continue
+        reps.append(int(i))
+        clusters.append([int(i)])
+    return clusters
@@ -1,20 +1,45 @@
 # src/core/llm_provider.py
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Sequence
 from pydantic import BaseModel
 from pathlib import Path
 
 class ChatMessage(BaseModel):
     role: str
     content: str
+    cache: bool = False   # đánh dấu điểm kết thúc prefix ổn định (gợi ý cache_control cho provider)
+
+class ChatUsage(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: Optional[float] = None   # USD nếu provider trả về (OpenRouter usage.include)
+
+class ChatResult(BaseModel):
+    text: str
+    model: str = ""
+    usage: ChatUsage = ChatUsage()
+    finish_reason: Optional[str] = None
+    latency_ms: int = 0
+    tier: str = ""                                  # tầng model (xem providers/tiered_provider.py)
+    escalated_from: Optional["ChatResult"] = None   # câu trả lời bị bỏ của model nhỏ (vẫn tính usage)
+
+ChatResult.model_rebuild()
 
 class LLMProvider(ABC):
     @abstractmethod
     async def chat(self, messages: List[ChatMessage], max_tokens: int, temperature: float) -> str:
         ...
 
-def build_system_prompt() -> str:
-    p = Path("prompts/persona_system_vi.txt")
+    async def chat_with_usage(self, messages: List[ChatMessage], max_tokens: int, temperature: float) -> ChatResult:
+        """Mặc định: provider không có usage → chỉ bọc text."""
+        return ChatResult(text=await self.chat(messages, max_tokens, temperature))
+
+@lru_cache(maxsize=16)
+def build_system_prompt(persona_path: str = "") -> str:
+    # Đọc 1 lần / process / persona → prefix giống hệt từng byte giữa các chat & các lượt của cùng bot
+    p = Path(persona_path or "prompts/persona_system_vi.txt")
     if p.exists():
         return p.read_text(encoding="utf-8").strip()
     # fallback cũ
@@ -23,3 +48,32 @@ def build_system_prompt() -> str:
         "Luôn giải thích thuật ngữ [trong ngoặc vuông] lần đầu xuất hiện. "
         "Giữ câu trả lời ngắn gọn, rõ ràng, từng bước khi cần."
     )
+
+
+# Chỉ dẫn tĩnh đi kèm persona (thuộc prefix cache được, KHÔNG chứa dữ liệu theo chat/lượt)
+STATIC_INSTRUCTIONS = (
+    "Tin nhắn hệ thống kế tiếp (nếu có) là \"ngữ cảnh nhớ\" về riêng người dùng này; "
+    "chỉ dùng khi liên quan tới câu hỏi hiện tại."
+)
+
+
+def build_messages(
+    user_text: str,
+    context: str = "",
+    history: Optional[Sequence[ChatMessage]] = None,
+    persona_path: str = "",
+) -> List[ChatMessage]:
+    """
+    Bố cục prompt thân thiện với prefix caching của provider:
+      [system: persona + chỉ dẫn tĩnh]   ← ổn định từng byte, đánh dấu cache
+      [system: ngữ cảnh nhớ của chat]    ← thay đổi theo lượt
+      [...lịch sử hội thoại...]
+      [user: câu hỏi hiện tại]
+    Mọi phần thay đổi nằm SAU prefix nên cache khớp ở mọi chat (của cùng persona).
+    """
+    msgs = [ChatMessage(role="system", content=build_system_prompt(persona_path) + "\n\n" + STATIC_INSTRUCTIONS, cache=True)]
+    if context:
+        msgs.append(ChatMessage(role="system", content="Ngữ cảnh nhớ (nếu liên quan):\n" + context))
+    msgs.extend(history or [])
+    msgs.append(ChatMessage(role="user", content=user_text or "ping"))
+    return msgs
@@ -1,8 +1,10 @@
 # src/core/memory_store.py
 import os
+import asyncio
 from typing import List, Dict, Any
-from supabase import create_client
-from core.providers.embeddings_provider import EmbeddingsProvider
+from infra.logging import log, log_error
+from core.providers.embeddings_provider import EmbeddingsProvider, from_db_vector
+from core.context import lexical_terms, mmr_select, term_coverage
 
 EMBED_MODEL   = os.getenv("EMBED_MODEL", "BAAI/bge-small-en-v1.5")
 BASE_URL      = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api")
@@ -10,53 +12,204 @@ API_KEY       = os.getenv("LLM_API_KEY", "")
 SUPABASE_URL  = os.getenv("SUPABASE_URL")
 SUPABASE_KEY  = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 TOPK          = int(os.getenv("MEMORY_TOPK", "8"))
+# "vector" (float32, memory_search) | "halfvec" (cột embedding_h + memory_search_compact)
+STORAGE       = os.getenv("EMBED_STORAGE", "vector").strip().lower()
+CANDIDATES    = int(os.getenv("MEMORY_RERANK_CANDIDATES", "0"))  # 0 = 8*k
+# Cosine ≥ ngưỡng với ký ức cùng loại đã có → gộp (tăng count/weight) thay vì chèn; 0 = tắt
+DEDUPE_THRESHOLD = float(os.getenv("MEMORY_DEDUPE_THRESHOLD", "0.92"))
+# MMR: λ cân bằng liên quan (1.0) vs đa dạng (0.0); 0 = tắt (Top-K theo score như cũ)
+MMR_LAMBDA    = float(os.getenv("MEMORY_MMR_LAMBDA", "0.5"))
+MMR_CANDIDATES = int(os.getenv("MEMORY_MMR_CANDIDATES", "0"))  # 0 = 4*k
+# Lai từ vựng + vector (cần supabase_memory_hybrid.sql): RRF trong 1 RPC + fast path không embedding
+HYBRID        = os.getenv("MEMORY_HYBRID", "0") == "1"
+RRF_K         = int(os.getenv("MEMORY_RRF_K", "60"))
+# Fast path: mục khớp ≥ tỉ lệ này số từ (giữ dấu, bỏ hư từ) của câu hỏi → trả luôn, bỏ qua embed + ANN
+LEXICAL_EXIT  = float(os.getenv("MEMORY_LEXICAL_EXIT", "0.6"))  # 0 = tắt fast path
+# … và lex_score (FTS / trigram từ RPC) ≥ ngưỡng này (kèm min_score của search_diverse nếu cao hơn)
+LEXICAL_MIN_SCORE = float(os.getenv("MEMORY_LEXICAL_MIN_SCORE", "0.6"))
+LEXICAL_MIN_TERMS = 2  # 1 từ ("tên tôi là gì" → ['ten']) luôn "khớp đủ" → không đáng tin để bỏ qua vector
+LEXICAL_MAX_TERMS = 6  # câu dài hơn thường cần ngữ nghĩa → luôn đi đường lai
 
 class MemoryStore:
     def __init__(self):
-        self.db = create_client(SUPABASE_URL, SUPABASE_KEY) if (SUPABASE_URL and SUPABASE_KEY) else None
-        self.emb = EmbeddingsProvider(API_KEY, BASE_URL, EMBED_MODEL)
+        self.db = None
+        if SUPABASE_URL and SUPABASE_KEY:
+            from supabase import create_client  # import lười: nặng, chỉ cần khi có cấu hình DB
+            self.db = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self.emb = EmbeddingsProvider(API_KEY, BASE_URL, EMBED_MODEL, storage=STORAGE)
+        self.vec_col = "embedding_h" if STORAGE == "halfvec" else "embedding"
+
+    def _search_vec(self, user_id: int | str, vec, top_k: int) -> List[Dict[str, Any]]:
+        if STORAGE == "halfvec":
+            # ANN trên binary quantization → rerank chính xác trên halfvec (xem supabase_compact_vectors.sql)
+            rpc = self.db.rpc("memory_search_compact", {
+                "u": str(user_id), "q": self.emb.to_db(vec), "k": top_k, "c": CANDIDATES,
+            }).execute()
+        else:
+            rpc = self.db.rpc("memory_search", {"u": str(user_id), "q": self.emb.to_db(vec), "k": top_k}).execute()
+        return rpc.data or []
+
+    def _search_lexical_first(self, user_id: int | str, query: str, terms: List[str], n: int,
+                              min_score: float = 0.0) -> List[Dict[str, Any]] | None:
+        """
+        Fast path (MEMORY_HYBRID): câu hỏi ngắn có tên riêng / địa danh / mã… khớp nguyên từ (cả dấu)
+        với ký ức → trả ứng viên (kèm embedding, score = lex_score), không tính embedding câu hỏi.
+        None = không đủ mạnh (đi tiếp đường lai).
+        """
+        if LEXICAL_EXIT <= 0 or not (LEXICAL_MIN_TERMS <= len(terms) <= LEXICAL_MAX_TERMS):
+            return None
+        name = "memory_search_lexical_compact" if STORAGE == "halfvec" else "memory_search_lexical"
+        try:
+            rows = self.db.rpc(name, {"u": str(user_id), "qf": " ".join(terms), "k": n}).execute().data or []
+        except Exception as e:
+            log_error("memory lexical error:", e)
+            return None
+        # RPC khớp trên chữ đã bỏ dấu (recall); thoát sớm chỉ khi khớp cả dấu ('trà đá' ≠ 'trả đủ')
+        exact = lexical_terms(query, fold=False)
+        floor = max(LEXICAL_MIN_SCORE, min_score)
+        strong = [r for r in rows if float(r.get("score", 0)) >= floor
+                  and term_coverage(exact, str(r.get("content", "")), fold=False) >= LEXICAL_EXIT]
+        if not strong:
+            return None
+        log("memory lexical exit:", len(strong), "hits")
+        return strong
+
+    def _select(self, vec, rows: List[Dict[str, Any]], relevance: List[float], top_k: int) -> List[Dict[str, Any]]:
+        """k mục từ ứng viên (đã xếp theo độ liên quan): MMR nếu bật, không thì Top-K; bỏ cột embedding."""
+        if MMR_LAMBDA <= 0:
+            order = list(range(min(top_k, len(rows))))
+        else:
+            order = mmr_select(vec, [from_db_vector(r["embedding"]) for r in rows], top_k, MMR_LAMBDA,
+                               relevance=relevance)
+        return [{k: v for k, v in rows[i].items() if k != "embedding"} for i in order]
+
+    def _candidates(self, user_id: int | str, vec, terms: List[str], n: int) -> List[Dict[str, Any]]:
+        """n ứng viên kèm embedding: lai RRF (MEMORY_HYBRID) hoặc chỉ vector (supabase_memory_mmr.sql)."""
+        if HYBRID:
+            name = "memory_search_hybrid_compact" if STORAGE == "halfvec" else "memory_search_hybrid"
+            params = {"u": str(user_id), "q": self.emb.to_db(vec), "qf": " ".join(terms), "n": n, "rrf_k": RRF_K}
+        else:
+            name = "memory_search_candidates_compact" if STORAGE == "halfvec" else "memory_search_candidates"
+            params = {"u": str(user_id), "q": self.emb.to_db(vec), "n": n}
+        return self.db.rpc(name, params).execute().data or []
 
     async def search(self, user_id: int | str, query: str, top_k: int = TOPK) -> List[Dict[str, Any]]:
         if not self.db:
             return []
+        terms = lexical_terms(query) if HYBRID else []
+        if HYBRID:
+            hits = await asyncio.to_thread(self._search_lexical_first, user_id, query, terms, top_k)
+            if hits is not None:
+                return [{k: v for k, v in r.items() if k != "embedding"} for r in hits[:top_k]]
         vec = (await self.emb.embed([query]))[0]
+        if HYBRID:
+            try:
+                rows = await asyncio.to_thread(self._candidates, user_id, vec, terms, top_k)
+                return [{k: v for k, v in r.items() if k != "embedding"} for r in rows]
+            except Exception as e:
+                log_error("memory hybrid error:", e)
         # user_id dạng TEXT trong DB hiện tại → ép string cho an toàn
-        rpc = self.db.rpc("memory_search", {"u": str(user_id), "q": vec, "k": top_k}).execute()
-        return rpc.data or []
+        return await asyncio.to_thread(self._search_vec, user_id, vec, top_k)
 
-    async def add_fact(self, user_id: int | str, content: str, weight: float = 1.0):
+    async def search_diverse(self, user_id: int | str, query: str, top_k: int = TOPK,
+                             min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Lấy tập ứng viên lớn hơn (kèm embedding) rồi chọn k mục đa dạng bằng MMR.
+        MEMORY_HYBRID: thử fast path từ vựng trước (lex_score ≥ min_score, MMR theo lex_score); ứng viên
+        lấy từ RPC lai (RRF), mục khớp từ vựng được giữ dù cosine < min_score (BGE chấm thấp tên riêng
+        tiếng Việt), độ liên quan cho MMR = RRF.
+        RPC ứng viên chưa có (chưa chạy supabase_memory_mmr.sql / _hybrid.sql) / lỗi → Top-K thường.
+        """
         if not self.db:
-            return
-        res = self.db.table("memory_facts").insert({
+            return []
+        terms = lexical_terms(query) if HYBRID else []
+        n = max(top_k, MMR_CANDIDATES or 4 * top_k)
+        if HYBRID:
+            hits = await asyncio.to_thread(self._search_lexical_first, user_id, query, terms, n, min_score)
+            if hits is not None:
+                return self._select(None, hits, [float(r["score"]) for r in hits], top_k)
+        vec = (await self.emb.embed([query]))[0]
+        if MMR_LAMBDA <= 0 and not HYBRID:
+            rows = await asyncio.to_thread(self._search_vec, user_id, vec, top_k)
+            return [r for r in rows if float(r.get("score", 0)) >= min_score]
+        try:
+            rows = await asyncio.to_thread(self._candidates, user_id, vec, terms, n)
+            rows = [r for r in rows if r.get("embedding") and (
+                float(r.get("score", 0)) >= min_score or r.get("lex_rank") is not None)]
+        except Exception as e:
+            log_error("memory candidates error:", e)
+            rows = await asyncio.to_thread(self._search_vec, user_id, vec, top_k)
+            return [r for r in rows if float(r.get("score", 0)) >= min_score]
+        if HYBRID:
+            top = max((float(r["rrf"]) for r in rows), default=1.0) or 1.0
+            relevance = [float(r["rrf"]) / top for r in rows]
+        else:
+            relevance = [float(r["score"]) for r in rows]
+        return self._select(vec, rows, relevance, top_k)  # RPC lai đã xếp theo RRF
+
+    def _merge_duplicate(self, user_id: int | str, ref_type: str, vec, weight: float) -> bool:
+        """
+        Dedupe-on-write: nếu user đã có ký ức cùng loại đủ giống → gọi RPC memory_merge
+        (tăng count/weight, làm mới timestamp) và trả True để bỏ qua insert vector mới.
+        Lỗi bất kỳ → False (quay về insert như cũ, không làm mất dữ liệu).
+        """
+        if DEDUPE_THRESHOLD <= 0:
+            return False
+        try:
+            for row in self._search_vec(user_id, vec, 4):
+                if row.get("ref_type") == ref_type and float(row.get("score", 0)) >= DEDUPE_THRESHOLD:
+                    self.db.rpc("memory_merge", {"rt": ref_type, "rid": row["ref_id"], "w": weight}).execute()
+                    return True
+        except Exception as e:
+            log_error("memory dedupe error:", e)
+            return False
+        return False
+
+    # supabase-py là client đồng bộ: dedupe (2 RPC) + insert chạy trọn trong 1 lần asyncio.to_thread,
+    # không chặn event loop (poller dùng chung loop cho mọi chat)
+    def _insert_vector(self, user_id: int | str, ref_type: str, ref_id, content: str, emb) -> None:
+        self.db.table("memory_vectors").insert({
             "user_id": str(user_id),
+            "ref_type": ref_type,
+            "ref_id": ref_id,           # <— dùng ref_id, KHÔNG phải summary_id
             "content": content,
-            "meta": {"weight": weight}
+            self.vec_col: self.emb.to_db(emb)
         }).execute()
-        fid = res.data[0]["id"]
-        emb = (await self.emb.embed([content]))[0]
-        self.db.table("memory_vectors").insert({
+
+    def _store_fact(self, user_id: int | str, content: str, weight: float, emb) -> None:
+        if self._merge_duplicate(user_id, "fact", emb, weight):
+            return
+        res = self.db.table("memory_facts").insert({
             "user_id": str(user_id),
-            "ref_type": "fact",
-            "ref_id": fid,
             "content": content,
-            "embedding": emb
+            "meta": {"weight": weight}
         }).execute()
+        self._insert_vector(user_id, "fact", res.data[0]["id"], content, emb)
 
-    async def add_summary(self, user_id: int | str, window_start_at: str, window_end_at: str, summary: str):
-        if not self.db:
-            return
+    def _insert_summary(self, user_id: int | str, window_start_at: str, window_end_at: str, summary: str):
         res = self.db.table("conv_summaries").insert({
             "user_id": str(user_id),
             "window_start_at": window_start_at,
             "window_end_at": window_end_at,
             "summary": summary
         }).execute()
-        sid = res.data[0]["id"]
+        return res.data[0]["id"]
+
+    def _store_summary_vector(self, user_id: int | str, sid, summary: str, emb) -> None:
+        if self._merge_duplicate(user_id, "summary", emb, 1.0):
+            return
+        self._insert_vector(user_id, "summary", sid, summary, emb)
+
+    async def add_fact(self, user_id: int | str, content: str, weight: float = 1.0):
+        if not self.db:
+            return
+        emb = (await self.emb.embed([content]))[0]
+        await asyncio.to_thread(self._store_fact, user_id, content, weight, emb)
+
+    async def add_summary(self, user_id: int | str, window_start_at: str, window_end_at: str, summary: str):
+        if not self.db:
+            return
+        # Luôn lưu bản tóm tắt (giữ mốc cửa sổ hội thoại); chỉ vector mới được dedupe
+        sid = await asyncio.to_thread(self._insert_summary, user_id, window_start_at, window_end_at, summary)
         emb = (await self.emb.embed([summary]))[0]
-        self.db.table("memory_vectors").insert({
-            "user_id": str(user_id),
-            "ref_type": "summary",
-            "ref_id": sid,              # <— dùng ref_id, KHÔNG phải summary_id
-            "content": summary,
-            "embedding": emb
-        }).execute()
+        await asyncio.to_thread(self._store_summary_vector, user_id, sid, summary, emb)
@@ -0,0 +1,229 @@
+# src/core/providers/embed_server.py — 1 process giữ model embedding, phục vụ mọi gunicorn worker
+#
+# Giao thức nhị phân qua Unix domain socket (mỗi frame = !I độ dài + body):
+#   request  body: !I len + model_id utf-8, !I n, rồi n lần (!I len + utf-8 bytes)
+#   response body: !I n, !I dim, rồi n*dim float32 little-endian
+#   lỗi         : !I 0xFFFFFFFF, !I len, rồi message utf-8
+# model_id của client khác model server đang giữ → lỗi (client tự embed tại chỗ, không trộn
+# vector của 2 model). Request n = 0 là ping (dùng để chờ server sẵn sàng: --wait-ready).
+# Server gom request của nhiều kết nối thành 1 batch (≤ EMBED_SERVER_BATCH text hoặc
+# chờ tối đa EMBED_SERVER_WAIT_MS) rồi chạy ONNX trên 1 thread, số intra-op thread cố định.
+import os
+import time
+import struct
+import asyncio
+from typing import List, Optional, Tuple
+
+from infra.logging import log, log_error
+
+SOCKET_PATH = os.getenv("EMBED_SERVER_SOCKET", "")
+_ERR = 0xFFFFFFFF
+_U32 = struct.Struct("!I")
+_U32x2 = struct.Struct("!II")
+
+
+# =====================
+# Framing
+# =====================
+
+def encode_request(texts: List[str], model_id: str = "") -> bytes:
+    m = (model_id or "").encode("utf-8")
+    parts = [_U32.pack(len(m)), m, _U32.pack(len(texts))]
+    for t in texts:
+        b = (t or "").encode("utf-8")
+        parts.append(_U32.pack(len(b)))
+        parts.append(b)
+    body = b"".join(parts)
+    return _U32.pack(len(body)) + body
+
+
+def decode_request(body: bytes) -> Tuple[str, List[str]]:
+    (ml,) = _U32.unpack_from(body, 0)
+    model_id = body[4:4 + ml].decode("utf-8")
+    (n,) = _U32.unpack_from(body, 4 + ml)
+    off, out = 8 + ml, []
+    for _ in range(n):
+        (ln,) = _U32.unpack_from(body, off)
+        off += 4
+        out.append(body[off:off + ln].decode("utf-8"))
+        off += ln
+    return model_id, out
+
+
+def encode_response(matrix) -> bytes:
+    import numpy as np
+    m = np.ascontiguousarray(matrix, dtype="<f4")
+    body = _U32x2.pack(m.shape[0], m.shape[1] if m.ndim == 2 else 0) + m.tobytes()
+    return _U32.pack(len(body)) + body
+
+
+def encode_error(msg: str) -> bytes:
+    b = msg.encode("utf-8")
+    body = _U32x2.pack(_ERR, len(b)) + b
+    return _U32.pack(len(body)) + body
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (ln,) = _U32.unpack(await reader.readexactly(4))
+    return await reader.readexactly(ln)
+
+
+# =====================
+# Client (dùng trong EmbeddingsProvider)
+# =====================
+
+async def embed_remote(texts: List[str], path: str = SOCKET_PATH, timeout: float = 10.0, model_id: str = ""):
+    """Gửi batch text tới embed server; trả ma trận float32 (n, dim). Server giữ model khác → RuntimeError."""
+    import numpy as np
+    reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), timeout)
+    try:
+        writer.write(encode_request(texts, model_id))
+        await writer.drain()
+        body = await asyncio.wait_for(_read_frame(reader), timeout)
+    finally:
+        writer.close()
+    n, dim = _U32x2.unpack_from(body, 0)
+    if n == _ERR:
+        raise RuntimeError("embed server error: " + body[8:8 + dim].decode("utf-8", "replace"))
+    return np.frombuffer(body, dtype="<f4", offset=8, count=n * dim).reshape(n, dim)
+
+
+def wait_ready(path: str, model_id: str, timeout_s: float) -> bool:
+    """Ping tới khi server trả lời (đúng model) hoặc hết `timeout_s`; dùng trước khi exec gunicorn."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            asyncio.run(embed_remote([], path, timeout=2.0, model_id=model_id))
+            return True
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RuntimeError) as e:
+            if time.monotonic() >= deadline:
+                log_error("embed server not ready:", path, e)
+                return False
+        time.sleep(0.5)
+
+
+# =====================
+# Server
+# =====================
+
+class EmbedServer:
+    def __init__(self, path: str, model_id: str, threads: Optional[int] = None,
+                 max_batch: int = 64, wait_ms: int = 5):
+        self.path = path
+        self.model_id = model_id
+        self.threads = threads
+        self.max_batch = max(1, max_batch)
+        self.wait = max(0, wait_ms) / 1000.0
+        self._queue: "asyncio.Queue[Tuple[List[str], asyncio.Future]]" = asyncio.Queue()
+        self._model = None
+
+    def _load(self):
+        from fastembed import TextEmbedding
+        from core.providers.embeddings_provider import CACHE_DIR
+        self._model = TextEmbedding(model_name=self.model_id, cache_dir=CACHE_DIR, threads=self.threads)
+
+    def _embed(self, texts: List[str]):
+        import numpy as np
+        return np.asarray(list(self._model.embed(texts)), dtype=np.float32)
+
+    async def _batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            count = len(items[0][0])
+            deadline = loop.time() + self.wait
+            while count < self.max_batch:
+                left = deadline - loop.time()
+                if left <= 0:
+                    break
+                try:
+                    it = await asyncio.wait_for(self._queue.get(), left)
+                except asyncio.TimeoutError:
+                    break
+                items.append(it)
+                count += len(it[0])
+            texts = [t for ts, _ in items for t in ts]
+            try:
+                # Batcher chạy tuần tự → mỗi lúc chỉ 1 lượt ONNX (dùng `threads` intra-op đã ghim)
+                mat = await loop.run_in_executor(None, self._embed, texts)
+                off = 0
+                for ts, fut in items:
+                    if not fut.done():
+                        fut.set_result(mat[off:off + len(ts)])
+                    off += len(ts)
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    async def _serve_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    body = await _read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    return
+                try:
+                    model_id, texts = decode_request(body)
+                    if model_id and model_id != self.model_id:
+                        raise RuntimeError(f"model mismatch: server {self.model_id}, client {model_id}")
+                    if not texts:  # ping
+                        writer.write(_U32.pack(8) + _U32x2.pack(0, 0))
+                        await writer.drain()
+                        continue
+                    fut = asyncio.get_running_loop().create_future()
+                    await self._queue.put((texts, fut))
+                    writer.write(encode_response(await fut))
+                except Exception as e:
+                    log_error("embed server request error:", e)
+                    writer.write(encode_error(str(e)))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def run(self) -> None:
+        self._load()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._serve_conn, path=self.path)
+        os.chmod(self.path, 0o660)
+        log("embed server ready:", self.path, "model", self.model_id, "threads", self.threads)
+        batcher = asyncio.ensure_future(self._batcher())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def main() -> None:
+    import argparse
+    from core.providers.embeddings_provider import DEFAULT_MODEL
+
+    ap = argparse.ArgumentParser(description="Thiên Cơ bot — embedding server (Unix socket)")
+    ap.add_argument("--socket", type=str, default=SOCKET_PATH or "/tmp/thienco-embed.sock")
+    ap.add_argument("--model", type=str, default=DEFAULT_MODEL)
+    ap.add_argument("--threads", type=int, default=int(os.getenv("EMBED_THREADS", "0") or 0),
+                    help="số intra-op thread của ONNX (0 = mặc định runtime)")
+    ap.add_argument("--max-batch", type=int, default=int(os.getenv("EMBED_SERVER_BATCH", "64")))
+    ap.add_argument("--wait-ms", type=int, default=int(os.getenv("EMBED_SERVER_WAIT_MS", "5")))
+    ap.add_argument("--wait-ready", type=float, default=0,
+                    help="không chạy server: chờ tối đa N giây tới khi server ở --socket sẵn sàng (exit 1 nếu không)")
+    args = ap.parse_args()
+
+    if args.wait_ready > 0:
+        raise SystemExit(0 if wait_ready(args.socket, args.model, args.wait_ready) else 1)
+
+    threads = args.threads or None
+    if threads:
+        # Ghim thread trước khi onnxruntime được import
+        os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    srv = EmbedServer(args.socket, args.model, threads=threads, max_batch=args.max_batch, wait_ms=args.wait_ms)
+    try:
+        asyncio.run(srv.run())
+    except KeyboardInterrupt:
+        log("embed server stopped")
+
+
+if __name__ == "__main__":
+    main()
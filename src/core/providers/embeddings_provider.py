@@ -1,30 +1,117 @@
 # src/core/providers/embeddings_provider.py
 import os
+import asyncio
+import threading
 from functools import lru_cache
 from typing import Iterable, List
 
+from infra import fastjson
+from infra.logging import log, log_error
+
 DEFAULT_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-small-en-v1.5")
 CACHE_DIR = os.getenv("FASTEMBED_CACHE_DIR", "/tmp/fastembed")
+# Nếu đặt: dùng embed server chung (core.providers.embed_server) thay vì nạp model trong mỗi worker
+SERVER_SOCKET = os.getenv("EMBED_SERVER_SOCKET", "")
+# Ghim số intra-op thread của ONNX (0 = mặc định runtime, dễ tranh CPU với gthread)
+THREADS = int(os.getenv("EMBED_THREADS", "0") or 0)
+# Số chữ số thập phân khi gửi vector(384) lên DB: 5 → sai số ≤5e-6/chiều (cosine lệch <1e-6),
+# payload ~3.2KB thay vì ~8.4KB của list float64 đầy đủ
+WIRE_DECIMALS = max(3, min(8, int(os.getenv("EMBED_WIRE_DECIMALS", "5") or 5)))
 
 @lru_cache(maxsize=1)
 def _get_fastembed(model_id: str):
     from fastembed import TextEmbedding
-    return TextEmbedding(model_name=model_id, cache_dir=CACHE_DIR)
+    return TextEmbedding(model_name=model_id, cache_dir=CACHE_DIR, threads=THREADS or None)
+
+# Model nạp tạm khi embed server không dùng được (chưa lên / chết / khác model); server trả lời
+# lại được → bỏ để worker không giữ bản model riêng suốt đời process
+_fallback = None  # (model_id, TextEmbedding)
+_fallback_lock = threading.Lock()
+
+def _get_fallback(model_id: str):
+    global _fallback
+    with _fallback_lock:
+        if _fallback is None or _fallback[0] != model_id:
+            from fastembed import TextEmbedding
+            _fallback = (model_id, TextEmbedding(model_name=model_id, cache_dir=CACHE_DIR, threads=THREADS or None))
+        return _fallback[1]
+
+def _drop_fallback() -> None:
+    global _fallback
+    if _fallback is None:
+        return
+    with _fallback_lock:
+        if _fallback is not None:
+            _fallback = None
+            log("embed server back; local fallback model released")
+
+def _as_rows(vecs) -> list:
+    # Giữ nguyên float32 (không box 384 float Python / vector); mỗi phần tử là 1 hàng ndarray
+    import numpy as np
+    return list(np.asarray(vecs if hasattr(vecs, "shape") else list(vecs), dtype=np.float32))
 
-def _to_pyfloat_list(vec) -> List[float]:
-    if hasattr(vec, "tolist"):
-        vec = vec.tolist()
-    return [float(x) for x in vec]
+@lru_cache(maxsize=8)
+def _literal_template(dim: int, decimals: int) -> str:
+    return "[" + ",".join([f"%.{decimals}f"] * dim) + "]"
+
+def to_vector_literal(vec, decimals: int = WIRE_DECIMALS) -> str:
+    """
+    Literal pgvector '[..]' dựng thẳng từ buffer float32, làm tròn `decimals` chữ số thập phân.
+    orjson: serialize mảng numpy trực tiếp (không qua float Python); không có → 1 lần %-format.
+    """
+    import numpy as np
+    v = np.round(np.asarray(vec, dtype=np.float32), decimals)
+    if fastjson.orjson is not None:
+        return fastjson.dumps_str(v)
+    return _literal_template(len(v), decimals) % tuple(v.tolist())
+
+def to_halfvec_literal(vec) -> str:
+    """
+    Lượng tử hoá về float16 (đúng độ chính xác cột halfvec) và trả literal pgvector '[..]'.
+    5 chữ số có nghĩa là đủ để round-trip float16 → payload ngắn hơn ~3x so với repr float64.
+    """
+    import numpy as np
+    h = np.asarray(vec, dtype=np.float32).astype(np.float16)
+    return "[" + ",".join(f"{x:.5g}" for x in h.tolist()) + "]"
+
+def from_db_vector(v) -> List[float]:
+    """PostgREST trả cột vector/halfvec dạng chuỗi '[..]' → list float."""
+    if isinstance(v, str):
+        return fastjson.loads(v)
+    return list(v or [])
 
 class EmbeddingsProvider:
-    def __init__(self, api_key: str = "", base_url: str = "", model_id: str | None = None):
+    def __init__(self, api_key: str = "", base_url: str = "", model_id: str | None = None,
+                 storage: str = "vector"):
         self.api_key = api_key
         self.base_url = (base_url or "").rstrip("/")
         self.model_id = model_id or DEFAULT_MODEL
+        # "vector" = literal float32 làm tròn (mặc định) | "halfvec" = literal float16 cho cột/RPC halfvec
+        self.storage = storage
 
-    async def embed(self, texts: Iterable[str]) -> List[List[float]]:
+    def to_db(self, vec):
+        """Định dạng vector gửi lên DB theo chế độ lưu trữ."""
+        if self.storage == "halfvec":
+            return to_halfvec_literal(vec)
+        return to_vector_literal(vec)
+
+    async def embed(self, texts: Iterable[str]) -> list:
+        """Mỗi text → 1 vector float32 (ndarray 1 chiều); gửi lên DB qua to_db()."""
         texts = list(texts or [])
         if not texts:
             return []
-        emb = _get_fastembed(self.model_id)
-        return [_to_pyfloat_list(v) for v in emb.embed(texts)]
+        if SERVER_SOCKET:
+            from core.providers.embed_server import embed_remote
+            try:
+                rows = _as_rows(await embed_remote(texts, SERVER_SOCKET, model_id=self.model_id))
+                _drop_fallback()
+                return rows
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RuntimeError) as e:
+                # Server chưa sẵn sàng/chết/khác model → nạp tạm model tại chỗ để không rớt request
+                log_error("embed server unavailable, fallback local:", e)
+                return await asyncio.to_thread(self._embed_local, texts, _get_fallback)
+        # Nạp model + ONNX chạy đồng bộ (CPU) → thread pool, event loop vẫn phục vụ update khác
+        return await asyncio.to_thread(self._embed_local, texts)
+
+    def _embed_local(self, texts: List[str], get_model=_get_fastembed) -> list:
+        return _as_rows(get_model(self.model_id).embed(texts))
@@ -1,7 +1,14 @@
+import os
 import httpx
-from typing import List
-from infra.logging import log, log_error
-from core.llm_provider import LLMProvider, ChatMessage
+from typing import Any, Dict, List
+from infra import fastjson, http_pool
+from infra.logging import log, log_error, Timer
+from core.llm_provider import LLMProvider, ChatMessage, ChatResult, ChatUsage
+
+# Gợi ý cache_control: "auto" = chỉ với model cần đánh dấu tường minh (Anthropic, Gemini);
+# OpenAI / DeepSeek… tự cache prefix nên không cần. "on" / "off" để ép.
+CACHE_HINTS = os.getenv("LLM_CACHE_HINTS", "auto").strip().lower()
+_EXPLICIT_CACHE_PREFIXES = ("anthropic/", "google/gemini")
 
 class OpenRouterProvider(LLMProvider):
     def __init__(self, api_key: str, model: str, base_url: str):
@@ -13,7 +20,14 @@ class OpenRouterProvider(LLMProvider):
     if self.base_url.endswith("/v1")
     else f"{self.base_url}/v1/chat/completions"
 )
+        self.cache_hints = CACHE_HINTS == "on" or (
+            CACHE_HINTS == "auto" and self.model.startswith(_EXPLICIT_CACHE_PREFIXES)
+        )
+
     async def chat(self, messages: List[ChatMessage], max_tokens: int, temperature: float) -> str:
+        return (await self.chat_with_usage(messages, max_tokens, temperature)).text
+
+    async def chat_with_usage(self, messages: List[ChatMessage], max_tokens: int, temperature: float) -> ChatResult:
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -21,25 +35,56 @@ class OpenRouterProvider(LLMProvider):
         }
         payload = {
             "model": self.model,
-            "messages": [m.model_dump() for m in messages],
+            "messages": [_render(m, self.cache_hints) for m in messages],
             "max_tokens": max_tokens,
             "temperature": temperature,
         }
+        if "openrouter" in self.base_url:
+            # Yêu cầu OpenRouter trả cost + cached tokens trong block usage
+            payload["usage"] = {"include": True}
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                r = await client.post(self.endpoint, headers=headers, json=payload)
-                if r.status_code != 200:
-                    log_error("LLM error:", r.status_code, r.text)
-                    raise RuntimeError(f"LLM error: {r.status_code}")
-                data = r.json()
-                try:
-                    return data["choices"][0]["message"]["content"]
-                except (KeyError, IndexError) as e:
-                    log_error("Unexpected LLM response format:", data)
-                    raise RuntimeError(f"Invalid LLM response format: {e}")
+            timer = Timer()
+            client = http_pool.get_client(f"llm:{self.endpoint}", timeout=60.0)
+            r = await client.post(self.endpoint, headers=headers, content=fastjson.dumps(payload))
+            if r.status_code != 200:
+                log_error("LLM error:", r.status_code, r.text)
+                raise RuntimeError(f"LLM error: {r.status_code}")
+            data = fastjson.loads(r.content)
+            try:
+                choice = data["choices"][0]
+                text = choice["message"]["content"]
+            except (KeyError, IndexError) as e:
+                log_error("Unexpected LLM response format:", data)
+                raise RuntimeError(f"Invalid LLM response format: {e}")
+            return ChatResult(
+                text=text or "",
+                model=data.get("model") or self.model,
+                usage=_parse_usage(data.get("usage") or {}),
+                finish_reason=choice.get("finish_reason"),
+                latency_ms=timer.stop_ms(),
+            )
         except httpx.TimeoutException:
             log_error("LLM request timeout")
             raise RuntimeError("LLM request timeout")
         except Exception as e:
             log_error("LLM request failed:", str(e))
             raise
+
+
+def _render(m: ChatMessage, cache_hints: bool) -> Dict[str, Any]:
+    if m.cache and cache_hints:
+        return {"role": m.role, "content": [
+            {"type": "text", "text": m.content, "cache_control": {"type": "ephemeral"}},
+        ]}
+    return {"role": m.role, "content": m.content}
+
+
+def _parse_usage(u: dict) -> ChatUsage:
+    details = u.get("prompt_tokens_details") or {}
+    cost = u.get("cost")
+    return ChatUsage(
+        prompt_tokens=int(u.get("prompt_tokens") or 0),
+        completion_tokens=int(u.get("completion_tokens") or 0),
+        cached_tokens=int(details.get("cached_tokens") or u.get("cache_read_input_tokens") or 0),
+        cost=float(cost) if cost is not None else None,
+    )
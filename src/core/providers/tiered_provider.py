@@ -0,0 +1,144 @@
+# src/core/providers/tiered_provider.py — Phân tầng model: model nhỏ/nhanh trước, leo thang khi cần
+#
+# Heuristic cục bộ (độ dài, dạng câu hỏi, dấu hiệu code/kỹ thuật, số mảnh nhớ liên quan) chọn
+# tầng "small" hoặc "large". Câu trả lời của model nhỏ rỗng / bị cắt ở MAX_TOKENS / từ chối
+# → (tuỳ chọn) gọi lại bằng model lớn. Thống kê hit-rate và latency theo tầng cho /_metrics.
+# Timeout áp cho TỪNG lần gọi model (không phải cả lượt): leo thang quá hạn / lỗi → vẫn trả câu
+# của model nhỏ (đã tốn token) thay vì mất cả hai.
+import re
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+from infra.logging import log, log_error
+from core.llm_provider import LLMProvider, ChatMessage, ChatResult
+
+SMALL, LARGE = "small", "large"
+
+_CODE_RE = re.compile(r"```|`[^`]+`|\b(def|class|import|select|function|return)\b|[{};]\s*$|Traceback|\w+\(\)",
+                      re.IGNORECASE | re.MULTILINE)
+_TECH_WORDS = (
+    "code", "python", "sql", "api", "deploy", "server", "docker", "database", "bug", "lỗi",
+    "thuật toán", "cấu hình", "kiến trúc", "checklist", "hướng dẫn", "so sánh", "phân tích",
+    "giải thích", "tối ưu", "kế hoạch", "chiến lược",
+)
+_HOW_WORDS = ("tại sao", "vì sao", "làm sao", "như thế nào", "thế nào", "cách nào", "why", "how")
+_REFUSAL_RE = re.compile(
+    r"(tôi|mình) không thể (giúp|trả lời|hỗ trợ)|xin lỗi,? (tôi|mình) không|i can(no|')t help|"
+    r"i'?m (sorry|unable)|as an ai",
+    re.IGNORECASE,
+)
+
+
+def classify(user_text: str, memory_hits: int = 0) -> str:
+    """Chấm điểm độ khó của lượt hỏi; ≥ 2 điểm → model lớn."""
+    t = (user_text or "").strip()
+    low = t.lower()
+    score = 0
+    if len(t) > 280:
+        score += 2
+    elif len(t) > 120:
+        score += 1
+    if _CODE_RE.search(t):
+        score += 2
+    score += min(2, sum(1 for w in _TECH_WORDS if w in low))
+    if any(w in low for w in _HOW_WORDS):
+        score += 1
+    if t.count("?") >= 2 or t.count("\n") >= 3:
+        score += 1
+    if memory_hits >= 3:  # cần tổng hợp nhiều mảnh nhớ
+        score += 1
+    return LARGE if score >= 2 else SMALL
+
+
+def needs_escalation(res: ChatResult) -> Optional[str]:
+    """Lý do leo thang (None = câu trả lời của model nhỏ dùng được)."""
+    text = (res.text or "").strip()
+    if not text:
+        return "empty"
+    if res.finish_reason == "length":
+        return "truncated"
+    if len(text) < 300 and _REFUSAL_RE.search(text):
+        return "refusal"
+    return None
+
+
+class _TierStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.data: Dict[str, Dict[str, float]] = {
+            tier: {"routed": 0, "served": 0, "escalated": 0, "latency_ms_sum": 0}
+            for tier in (SMALL, LARGE)
+        }
+
+    def add(self, tier: str, **inc: float) -> None:
+        with self._lock:
+            d = self.data[tier]
+            for k, v in inc.items():
+                d[k] += v
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(d["routed"] for d in self.data.values()) or 1
+            return {
+                tier: {
+                    "routed": int(d["routed"]),
+                    "hit_rate": round(d["routed"] / total, 3),
+                    "escalated": int(d["escalated"]),
+                    "avg_latency_ms": int(d["latency_ms_sum"] / d["served"]) if d["served"] else 0,
+                }
+                for tier, d in self.data.items()
+            }
+
+
+stats = _TierStats()
+
+
+class TieredProvider(LLMProvider):
+    def __init__(self, small: LLMProvider, large: LLMProvider, escalate: bool = True, timeout: float = 0):
+        self.small = small
+        self.large = large
+        self.escalate = escalate
+        self.timeout = timeout  # giây / lần gọi model (0 = không giới hạn)
+
+    async def chat(self, messages: List[ChatMessage], max_tokens: int, temperature: float) -> str:
+        return (await self.chat_with_usage(messages, max_tokens, temperature)).text
+
+    async def chat_with_usage(self, messages: List[ChatMessage], max_tokens: int, temperature: float,
+                              tier: Optional[str] = None, count_route: bool = True) -> ChatResult:
+        """count_route=False: lần thử lại của cùng lượt hỏi (routing chỉ đếm 1 lần / lượt)."""
+        if tier is None:
+            user = next((m.content for m in reversed(messages) if m.role == "user"), "")
+            tier = classify(user)
+        if count_route:
+            stats.add(tier, routed=1)
+        if tier == LARGE:
+            return await self._call(LARGE, self.large, messages, max_tokens, temperature)
+
+        res = await self._call(SMALL, self.small, messages, max_tokens, temperature)
+        reason = needs_escalation(res) if self.escalate else None
+        if reason is None:
+            return res
+        log("llm escalate:", reason, res.model)
+        stats.add(SMALL, escalated=1)
+        try:
+            big = await self._call(LARGE, self.large, messages, max_tokens, temperature)
+        except Exception as e:  # gồm asyncio.TimeoutError
+            if not (res.text or "").strip():
+                raise  # câu nhỏ rỗng: không có gì để giữ → để caller thử lại
+            log_error("llm escalate failed; keep small answer:", type(e).__name__, e)
+            return res
+        big.escalated_from = res
+        return big
+
+    async def _call(self, tier: str, provider: LLMProvider, messages: List[ChatMessage],
+                    max_tokens: int, temperature: float) -> ChatResult:
+        call = provider.chat_with_usage(messages, max_tokens, temperature)
+        res = await (asyncio.wait_for(call, timeout=self.timeout) if self.timeout > 0 else call)
+        res.tier = tier
+        stats.add(tier, served=1, latency_ms_sum=res.latency_ms)
+        return res
+
+
+def tier_snapshot() -> Dict[str, Any]:
+    return stats.snapshot()
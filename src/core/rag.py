@@ -1,29 +1,51 @@
 # src/core/rag.py — Small-dimension (1536) RAG retriever for Thien Co Bot
 import os, asyncio
-from typing import List, Dict, Any
-from supabase import Client
+from typing import List, Dict, Any, TYPE_CHECKING
+
+from core.context import mmr_select, compress_snippet, tokens
+from core.providers.embeddings_provider import from_db_vector, to_vector_literal
+
+if TYPE_CHECKING:  # chỉ cho type hint, không import supabase lúc chạy
+    from supabase import Client
 
 class RAGRetriever:
-    def __init__(self, supabase_client: Client, embeddings_provider, dim: int = 384, topk: int = 8, min_score: float = 0.65):
+    def __init__(self, supabase_client: "Client", embeddings_provider, dim: int = 384, topk: int = 8, min_score: float = 0.65,
+                 mmr_lambda: float = 0.5, candidates: int = 0):
         self.db = supabase_client
         self.emb = embeddings_provider
         self.dim = dim
         self.topk = topk
         self.min_score = min_score
+        self.mmr_lambda = mmr_lambda      # 0 = plain top-k by score
+        self.candidates = candidates      # 0 = 4 * topk
 
     async def _retrieve_async(self, user_id: str, query_text: str) -> List[Dict[str, Any]]:
         # 1) Get embedding
         vecs = await self.emb.embed([query_text])
         q = vecs[0]
+        q_lit = to_vector_literal(q)  # literal pgvector gọn (không gửi list float đầy đủ)
+
+        # 2) Diverse path: larger candidate set with embeddings -> MMR (supabase_memory_mmr.sql)
+        if self.mmr_lambda > 0:
+            try:
+                n = max(self.topk, self.candidates or 4 * self.topk)
+                resp = self.db.rpc("memory_search_candidates", {"u": str(user_id), "q": q_lit, "n": n}).execute()
+                rows = [r for r in (resp.data or [])
+                        if r.get("embedding") and float(r.get("score", 0.0)) >= self.min_score]
+                order = mmr_select(q, [from_db_vector(r["embedding"]) for r in rows], self.topk,
+                                   self.mmr_lambda, relevance=[float(r["score"]) for r in rows])
+                return [{k: v for k, v in rows[i].items() if k != "embedding"} for i in order]
+            except Exception:
+                pass  # RPC missing / error -> plain top-k below
 
-        # 2) Call RPC memory_search(u bigint, q vector(1536), k int)
+        # 3) Call RPC memory_search(u bigint, q vector(1536), k int)
         try:
-            resp = self.db.rpc("memory_search", {"u": str(user_id), "q": q, "k": self.topk}).execute()
+            resp = self.db.rpc("memory_search", {"u": str(user_id), "q": q_lit, "k": self.topk}).execute()
             rows = resp.data or []
         except Exception:
             rows = []
 
-        # 3) Filter by score
+        # 4) Filter by score
         results = [r for r in rows if float(r.get("score", 0.0)) >= self.min_score]
         return results
 
@@ -40,14 +62,20 @@ class RAGRetriever:
             return asyncio.run(self._retrieve_async(user_id, query_text))
 
     @staticmethod
-    def build_context(items: List[Dict[str, Any]], max_chars: int = 1200) -> str:
-        # Join top items into a context block (truncated to max_chars).
-        parts = []
-        for i, it in enumerate(items, 1):
+    def build_context(items: List[Dict[str, Any]], max_chars: int = 1200, query: str = "",
+                      snippet_tokens: int = 80) -> str:
+        # Join items into a context block of at most max_chars. Each snippet keeps its most
+        # query-relevant sentences; items that do not fit are skipped, never cut mid-sentence.
+        q = set(tokens(query))
+        parts, used = [], 0
+        for it in items:
             score = float(it.get("score", 0.0))
-            content = str(it.get("content", "")).strip()
-            parts.append(f"[{i}] (score={score:.2f}) {content}")
-        text = "\n".join(parts).strip()
-        if len(text) > max_chars:
-            return text[:max_chars] + " …"
-        return text
+            content = compress_snippet(str(it.get("content", "")), q, snippet_tokens)
+            if not content:
+                continue
+            line = f"[{len(parts) + 1}] (score={score:.2f}) {content}"
+            if used + len(line) + 1 > max_chars:
+                continue
+            parts.append(line)
+            used += len(line) + 1
+        return "\n".join(parts).strip()
@@ -0,0 +1,184 @@
+# src/core/usage.py — Kế toán token / latency / chi phí theo chat & model (gộp trong RAM, flush theo lô)
+#
+# record() chỉ cộng dồn vào dict theo khoá (phút, chat_id, model) → không ghi DB mỗi tin.
+# Thread nền flush các phút đã gộp sang Supabase bằng 1 RPC (usage_rollup) mỗi USAGE_FLUSH_S,
+# và lúc drain. Hạn mức token/ngày theo chat được kiểm tra từ bộ đếm trong RAM
+# (nạp mốc ban đầu từ DB 1 lần/chat/ngày).
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from infra.logging import log, log_error
+
+FLUSH_S = float(os.getenv("USAGE_FLUSH_S", "60"))
+# Giá dự phòng khi provider không trả usage.cost (USD / 1M token)
+PRICE_IN_PER_MTOK = float(os.getenv("LLM_PRICE_IN_PER_MTOK", "0") or 0)
+PRICE_OUT_PER_MTOK = float(os.getenv("LLM_PRICE_OUT_PER_MTOK", "0") or 0)
+
+_Key = Tuple[int, int, str]  # (epoch phút, chat_id, model)
+
+
+def _local_day(tz_name: str) -> str:
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo(tz_name)).strftime("%Y-%m-%d")
+    except Exception:
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+class UsageAccumulator:
+    def __init__(self, flush_s: float = FLUSH_S, tz_name: str = "Asia/Ho_Chi_Minh"):
+        self.flush_s = max(5.0, flush_s)
+        self.tz_name = tz_name
+        self._lock = threading.Lock()
+        self._rows: Dict[_Key, Dict[str, float]] = {}
+        self._today: Dict[int, Tuple[str, int]] = {}  # chat_id -> (ngày, tokens)
+        self._thread: Optional[threading.Thread] = None
+        self._prompt_total = 0  # tổng theo process, để theo dõi tỉ lệ cache hit của prefix
+        self._cached_total = 0
+
+    # ---------- ghi nhận ----------
+    def record(self, chat_id: int, model: str, prompt_tokens: int, completion_tokens: int,
+               cached_tokens: int = 0, cost: Optional[float] = None, latency_ms: int = 0) -> None:
+        if cost is None:
+            cost = (prompt_tokens * PRICE_IN_PER_MTOK + completion_tokens * PRICE_OUT_PER_MTOK) / 1e6
+        key = (int(time.time() // 60), int(chat_id), model or "")
+        day = _local_day(self.tz_name)
+        with self._lock:
+            r = self._rows.get(key)
+            if r is None:
+                r = self._rows[key] = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                       "cached_tokens": 0, "cost_usd": 0.0,
+                                       "latency_ms_sum": 0, "latency_ms_max": 0}
+            r["calls"] += 1
+            r["prompt_tokens"] += prompt_tokens
+            r["completion_tokens"] += completion_tokens
+            r["cached_tokens"] += cached_tokens
+            r["cost_usd"] += cost
+            r["latency_ms_sum"] += latency_ms
+            r["latency_ms_max"] = max(r["latency_ms_max"], latency_ms)
+            self._prompt_total += prompt_tokens
+            self._cached_total += cached_tokens
+            d, n = self._today.get(int(chat_id), (day, 0))
+            self._today[int(chat_id)] = (day, (n if d == day else 0) + prompt_tokens + completion_tokens)
+        self._ensure_flusher()
+
+    # ---------- hạn mức ngày ----------
+    def tokens_today(self, chat_id: int) -> int:
+        day = _local_day(self.tz_name)
+        with self._lock:
+            cur = self._today.get(int(chat_id))
+        if cur and cur[0] == day:
+            return cur[1]
+        # Lần đầu trong ngày (của process): lấy tổng đã flush từ DB làm mốc
+        base = _load_today(int(chat_id), self.tz_name)
+        with self._lock:
+            cur = self._today.get(int(chat_id))
+            n = (cur[1] if cur and cur[0] == day else 0) + base
+            self._today[int(chat_id)] = (day, n)
+        return n
+
+    def over_budget(self, chat_id: int, budget: int) -> bool:
+        return budget > 0 and self.tokens_today(chat_id) >= budget
+
+    # ---------- flush ----------
+    def _ensure_flusher(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="usage-flush", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.flush_s)
+            self.flush(closed_only=True)
+
+    def flush(self, closed_only: bool = False) -> int:
+        """
+        Đẩy rollup sang DB (1 RPC). closed_only=True: chỉ các phút đã qua (phút hiện tại còn gộp tiếp).
+        Lỗi → trả dữ liệu về buffer để lần sau thử lại.
+        """
+        cur_min = int(time.time() // 60)
+        with self._lock:
+            keys = [k for k in self._rows if not closed_only or k[0] < cur_min]
+            batch = {k: self._rows.pop(k) for k in keys}
+        if not batch:
+            return 0
+        from infra import supabase_client
+        if not supabase_client.is_ready():
+            return 0  # chưa cấu hình DB: bỏ rollup (bộ đếm ngày trong RAM vẫn giữ)
+        rows = [_to_row(k, v) for k, v in batch.items()]
+        if _save_rollup(rows):
+            log("usage flushed:", len(rows), "rows")
+            return len(rows)
+        with self._lock:
+            for k, v in batch.items():
+                r = self._rows.setdefault(k, dict.fromkeys(v, 0))
+                for f, x in v.items():
+                    r[f] = max(r[f], x) if f == "latency_ms_max" else r[f] + x
+        return 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "buffered_rows": len(self._rows),
+                "chats_today": len(self._today),
+                "prompt_tokens": self._prompt_total,
+                "cached_ratio": round(self._cached_total / self._prompt_total, 3) if self._prompt_total else 0.0,
+            }
+
+
+def _to_row(k: _Key, v: Dict[str, float]) -> Dict[str, Any]:
+    minute, chat_id, model = k
+    return {
+        "minute": datetime.fromtimestamp(minute * 60, tz=timezone.utc).isoformat(),
+        "chat_id": chat_id,
+        "model": model,
+        **{f: (round(x, 8) if f == "cost_usd" else int(x)) for f, x in v.items()},
+    }
+
+
+def _save_rollup(rows: List[Dict[str, Any]]) -> bool:
+    from infra import supabase_client
+    try:
+        supabase_client._client.rpc("usage_rollup", {"rows": rows}).execute()
+        return True
+    except Exception as e:
+        log_error("usage rollup error:", e)
+        return False
+
+
+def _load_today(chat_id: int, tz_name: str) -> int:
+    from infra import supabase_client
+    if not supabase_client.is_ready():
+        return 0
+    try:
+        res = supabase_client._client.rpc("usage_today", {"c": chat_id, "tz": tz_name}).execute()
+        return int(res.data or 0)
+    except Exception as e:
+        log_error("usage_today error:", e)
+        return 0
+
+
+_usage: Optional[UsageAccumulator] = None
+_usage_lock = threading.Lock()
+
+
+def get_usage(tz_name: str = "Asia/Ho_Chi_Minh") -> UsageAccumulator:
+    """Singleton theo process; tự đăng ký flush lúc drain."""
+    global _usage
+    with _usage_lock:
+        if _usage is None:
+            _usage = UsageAccumulator(tz_name=tz_name)
+            from infra.lifecycle import lifecycle
+            lifecycle.on_drain(_usage.flush)
+        return _usage
+
+
+def usage_snapshot() -> Dict[str, Any]:
+    return _usage.snapshot() if _usage is not None else {}
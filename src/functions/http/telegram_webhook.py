@@ -1,30 +1,50 @@
-import json
 import asyncio
 import hmac
+import threading
 from typing import Any, Dict, Optional
 
 from flask import Request, request, make_response
 
+from infra import fastjson
 from infra.config import load_settings_from_env
 from infra.logging import log, log_error, Timer
-from infra.supabase_client import init_supabase, insert_message
-from infra.telegram_api import send_message, send_typing
-
-from core.llm_provider import ChatMessage, build_system_prompt
+from infra.supabase_client import init_supabase, insert_message, is_ready
+from infra.telegram_api import send_text, send_typing
+from infra.lifecycle import lifecycle
+from infra.journal import get_journal
+from infra.profiling import profiler
+from infra import http_pool, update_guard
+from infra.bots import activate, apply_bot, chat_key, current_bot, gate, is_default, memory_user, update_key
+
+from core.llm_provider import build_messages
+from core.context import build_context
 from core.providers.openrouter_provider import OpenRouterProvider
+from core.providers.tiered_provider import LARGE, TieredProvider, classify
+from core.coalescer import get_coalescer
+from core.admission import get_limiter
+from core.usage import get_usage
+
+# RAG / Memory: khởi tạo lười ở lần dùng đầu (supabase-py + client không nằm trên đường cold start)
+_memory = None
+
 
-# RAG / Memory
-from core.memory_store import MemoryStore
+_memory_lock = threading.Lock()
 
-# Khởi tạo bộ nhớ 1 lần (dựa trên ENV)
-_memory = MemoryStore()
+
+def _get_memory():
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            from core.memory_store import MemoryStore
+            _memory = MemoryStore()
+        return _memory
 
 # =====================
 # HTTP helpers
 # =====================
 
 def _ok(body: Optional[Dict[str, Any]] = None, status: int = 200):
-    resp = make_response(json.dumps(body or {"ok": True}), status)
+    resp = make_response(fastjson.dumps(body or {"ok": True}), status)
     resp.headers["Content-Type"] = "application/json"
     return resp
 
@@ -55,12 +75,35 @@ def _supabase_is_configured(settings) -> bool:
     return bool(getattr(settings, "SUPABASE_URL", "") and getattr(settings, "SUPABASE_SERVICE_ROLE_KEY", ""))
 
 
+def _bot_settings():
+    """Settings env + phần riêng của bot hiện hành (token/secret/model)."""
+    return apply_bot(load_settings_from_env())
+
+
+# Cặp (URL, key) đã init thành công: client tạo 1 lần / process, không phải mỗi update
+_supabase_inited: Optional[tuple] = None
+_supabase_lock = threading.Lock()
+
+
+def _supabase_pending(settings) -> bool:
+    """Có cấu hình nhưng chưa init (hoặc lần trước lỗi) → cần gọi _init_supabase_if_configured."""
+    return _supabase_is_configured(settings) and \
+        _supabase_inited != (settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+
+
 def _init_supabase_if_configured(settings) -> None:
-    if _supabase_is_configured(settings):
+    global _supabase_inited
+    if not _supabase_pending(settings):
+        return
+    with _supabase_lock:
+        if not _supabase_pending(settings):
+            return
         try:
             init_supabase(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+            if is_ready():
+                _supabase_inited = (settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
         except Exception as e:
-            # Không làm vỡ luồng nếu key sai; chỉ log nhẹ
+            # Không làm vỡ luồng nếu key sai; chỉ log nhẹ (update sau thử lại)
             log_error("supabase init error:", e)
 
 
@@ -68,7 +111,8 @@ async def _safe_insert_message(settings, data: Dict[str, Any]) -> None:
     if not _supabase_is_configured(settings):
         return
     try:
-        insert_message(data)
+        # supabase-py là client đồng bộ → chạy ở thread pool, không chặn event loop (poller dùng chung loop)
+        await asyncio.to_thread(insert_message, data)
     except Exception as e:
         # Best-effort: không để lỗi DB ảnh hưởng webhook
         log_error("supabase insert error:", e)
@@ -79,95 +123,187 @@ async def _safe_insert_message(settings, data: Dict[str, Any]) -> None:
 # =====================
 
 async def _send_safe(token: str, chat_id: int, text: str, parse_mode: Optional[str] = "Markdown") -> None:
-    """Gửi Telegram an toàn: nếu lỗi Markdown, thử lại dạng thường."""
+    """Gửi Telegram an toàn qua bộ gửi chung (sanitize Markdown, cắt tin dài, lùi theo 429)."""
     try:
-        await send_message(token, chat_id, text, parse_mode=parse_mode)
+        if not await send_text(token, chat_id, text, parse_mode=parse_mode):
+            log_error("telegram send failed; chat", chat_id)
     except Exception as e:
-        log_error("telegram send error (markdown):", e)
-        try:
-            await send_message(token, chat_id, text, parse_mode=None)
-        except Exception as e2:
-            log_error("telegram send error (plain):", e2)
+        log_error("telegram send error:", e)
 
 
 # =====================
 # RAG nội bộ (smart reply)
 # =====================
 
+SHED_REPLY = "Mình đang hơi quá tải 😅 Bạn nhắn lại sau ít phút giúp mình nhé!"
+BUDGET_REPLY = "Hôm nay bạn đã dùng hết hạn mức trò chuyện rồi 🙏 Hẹn bạn ngày mai nhé!"
+
+
+def _over_budget(settings, chat_id: int) -> bool:
+    budget = int(getattr(settings, "CHAT_DAILY_TOKEN_BUDGET", 0))
+    if budget <= 0:
+        return False
+    try:
+        return get_usage(getattr(settings, "TIMEZONE_DEFAULT", "Asia/Ho_Chi_Minh")).over_budget(chat_id, budget)
+    except Exception as e:
+        log_error("budget check error:", e)
+        return False
+
+
+def _get_limiter(settings):
+    max_limit = int(getattr(settings, "LLM_CONCURRENCY_MAX", 64))
+    if max_limit <= 0:
+        return None
+    return get_limiter(
+        int(getattr(settings, "LLM_CONCURRENCY_INIT", 8)),
+        int(getattr(settings, "LLM_CONCURRENCY_MIN", 2)),
+        max_limit,
+    )
+
+
 async def smart_reply(user_id: int, user_text: str) -> str:
     """
-    Trộn persona + 'ngữ cảnh nhớ' (vector Top-K) + câu hỏi hiện tại -> gọi LLM.
-    user_id: dùng chính chat_id Telegram để đồng nhất với DB (messages.user_id)
+    Admission control trước pipeline RAG + LLM: vượt giới hạn đồng thời thích nghi
+    → trả lời soạn sẵn ngay (không embed, không gọi LLM) thay vì xếp hàng.
     """
-    settings = load_settings_from_env()
+    settings = _bot_settings()
+    bot = current_bot()
+    if not gate.try_enter(bot):  # trần riêng của bot: 1 bot ồn không chiếm hết limiter chung
+        log("llm shed (bot)", bot.key)
+        return SHED_REPLY
+    try:
+        limiter = _get_limiter(settings)
+        token = limiter.try_acquire() if limiter else 0.0
+        if token is None:
+            log("llm shed", limiter.snapshot())
+            return SHED_REPLY
+        sample: Dict[str, float] = {}
+        try:
+            return await _generate_reply(settings, user_id, user_text, sample)
+        finally:
+            if limiter:
+                limiter.release(token, sample.get("rtt"))
+    finally:
+        gate.leave(bot)
 
-    # 1) Truy xuất ngữ cảnh liên quan (Top-K)
+
+async def _generate_reply(settings, user_id: int, user_text: str, sample: Dict[str, float]) -> str:
+    """
+    Trộn persona + 'ngữ cảnh nhớ' (vector Top-K) + câu hỏi hiện tại -> gọi LLM.
+    user_id: dùng chính chat_id Telegram để đồng nhất với DB (messages.user_id);
+    bộ nhớ tra theo memory_user(user_id) (có tiền tố namespace nếu bot cấu hình riêng)
+    `sample["rtt"]` nhận thời gian (giây) của pha gọi LLM để limiter học latency.
+    """
+    # 1) Truy xuất ngữ cảnh liên quan: ứng viên → MMR (đa dạng) → nén theo ngân sách token
     topk = int(getattr(settings, "MEMORY_TOPK", 8))
     try:
-        retrieved = await _memory.search(user_id, user_text, top_k=topk)
+        memory = _memory or await asyncio.to_thread(_get_memory)  # lần đầu: import + create_client ở thread
+        retrieved = await memory.search_diverse(memory_user(user_id), user_text, top_k=topk, min_score=0.65)
     except Exception as e:
         log_error("memory_search error:", e)
         retrieved = []
 
-    ctx_lines = []
-    for row in (retrieved or []):
-        try:
-            # score 0..1; càng cao càng liên quan
-            if float(row.get("score", 0)) >= 0.65:
-                ctx_lines.append(f"- {row['content']}")
-        except Exception:
-            pass
-    context = "\n".join(ctx_lines)
-
-    # 2) System prompt (persona) + Ngữ cảnh nhớ
-    sys = build_system_prompt()
-    if context:
-        sys += "\n\nNgữ cảnh nhớ (nếu liên quan):\n" + context
-
-    messages = [
-        ChatMessage(role="system", content=sys),
-        ChatMessage(role="user", content=user_text or "ping")
-    ]
-
-    # 3) Gọi LLM (tận dụng OpenRouter provider sẵn có)
-    provider = OpenRouterProvider(
-        api_key=getattr(settings, "LLM_API_KEY", ""),
-        model=getattr(settings, "LLM_MODEL", "openai/gpt-3.5-turbo"),
-        base_url=getattr(settings, "LLM_BASE_URL", "https://openrouter.ai/api"),
-    )
+    context = build_context(retrieved or [], user_text,
+                            token_budget=int(getattr(settings, "MEMORY_CONTEXT_TOKENS", 400)))
+    memory_hits = len(retrieved or [])
+
+    # 2) Prompt: prefix ổn định (persona + chỉ dẫn tĩnh) trước, ngữ cảnh nhớ theo chat sau
+    #    → provider cache được prefix ở mọi lượt / mọi chat
+    messages = build_messages(user_text, context, persona_path=current_bot().persona)
+
+    # 3) Gọi LLM (tận dụng OpenRouter provider sẵn có; phân tầng model nếu có LLM_MODEL_SMALL —
+    #    khi đó TieredProvider tự áp LLM_TIMEOUT cho từng lần gọi model nhỏ / leo thang)
+    provider = _get_provider(settings)
+    tiered = isinstance(provider, TieredProvider)
+    kwargs = {"tier": classify(user_text, memory_hits)} if tiered else {}
     llm_timeout = int(getattr(settings, "LLM_TIMEOUT", 8))
     max_tokens = int(getattr(settings, "MAX_TOKENS", 256))
     temperature = float(getattr(settings, "TEMPERATURE", 0.3))
 
+    llm_timer = Timer()
     for i in range(3):
         try:
             t = Timer()  # không truyền tham số
-            ans = await asyncio.wait_for(
-                provider.chat(messages, max_tokens=max_tokens, temperature=temperature),
-                timeout=llm_timeout,
-            )
+            call = provider.chat_with_usage(messages, max_tokens=max_tokens, temperature=temperature, **kwargs)
+            res = await (call if tiered else asyncio.wait_for(call, timeout=llm_timeout))
             ms = t.stop_ms()
-            log("llm_call_retry", i, "ms", ms)
-            return ans.strip()
+            log("llm_call_retry", i, "ms", ms, "tier", res.tier or "-")
+            sample["rtt"] = llm_timer.stop_ms() / 1000.0
+            _record_usage(settings, user_id, res, ms)
+            return res.text.strip()
         except asyncio.TimeoutError:
             log_error(f"LLM timeout at retry {i}")
             await asyncio.sleep(0.4 * (2 ** i))
         except Exception as e:
             log_error("LLM error:", e)
             await asyncio.sleep(0.4 * (2 ** i))
+        if tiered:
+            # Thử lại thẳng model lớn (tầng vừa lỗi không chạy lại); routing đã đếm ở lần đầu
+            kwargs = {"tier": LARGE, "count_route": False}
 
+    # Hết retry: RTT = toàn bộ thời gian chờ → limiter co lại
+    sample["rtt"] = llm_timer.stop_ms() / 1000.0
     return "Xin lỗi, hệ thống đang bận. Mình trả lời ngắn trước nhé 🤖💤"
 
 
+def _get_provider(settings):
+    def _openrouter(model: str) -> OpenRouterProvider:
+        return OpenRouterProvider(
+            api_key=getattr(settings, "LLM_API_KEY", ""),
+            model=model,
+            base_url=getattr(settings, "LLM_BASE_URL", "https://openrouter.ai/api"),
+        )
+    large = _openrouter(getattr(settings, "LLM_MODEL", "openai/gpt-3.5-turbo"))
+    small_model = getattr(settings, "LLM_MODEL_SMALL", "")
+    if not small_model:
+        return large
+    return TieredProvider(_openrouter(small_model), large, escalate=bool(getattr(settings, "LLM_TIER_ESCALATE", 1)),
+                          timeout=int(getattr(settings, "LLM_TIMEOUT", 8)))
+
+
+def _record_usage(settings, chat_id: int, res, ms: int) -> None:
+    # Chỉ cộng dồn trong RAM; flush theo lô ở thread nền (không ghi DB mỗi tin)
+    try:
+        usage = get_usage(getattr(settings, "TIMEZONE_DEFAULT", "Asia/Ho_Chi_Minh"))
+        while res is not None:  # gồm cả lượt model nhỏ đã bị leo thang (vẫn tốn token)
+            u = res.usage
+            if u.prompt_tokens:
+                log("llm tokens", u.prompt_tokens, "+", u.completion_tokens,
+                    "cached_ratio", round(u.cached_tokens / u.prompt_tokens, 2))
+            usage.record(
+                chat_id, res.model, u.prompt_tokens, u.completion_tokens,
+                cached_tokens=u.cached_tokens, cost=u.cost, latency_ms=res.latency_ms or ms,
+            )
+            res = res.escalated_from
+    except Exception as e:
+        log_error("usage record error:", e)
+
+
 # =====================
 # Core handler (async)
 # =====================
 
+def _activate_update_bot(update: Dict[str, Any]) -> bool:
+    """
+    Đặt bot của update. "_bot" lạ (orphan journal / mảnh bàn giao / poller sau khi bot bị bỏ khỏi
+    cấu hình) → từ chối: không trả lời bằng token / namespace bộ nhớ của bot default.
+    """
+    if activate(update.get("_bot")) is None:
+        log_error("unknown bot; drop update", update.get("_bot"), update.get("update_id"))
+        return False
+    return True
+
+
 async def _handle_update(update: Dict[str, Any]):
-    settings = load_settings_from_env()
+    # Bot của update (route /telegram/webhook/<bot_key> hoặc poller --bot gắn "_bot"); mặc định: bot env
+    if not _activate_update_bot(update):
+        return
+    settings = _bot_settings()
 
-    # Supabase (chỉ init nếu có cấu hình đầy đủ)
-    _init_supabase_if_configured(settings)
+    # Supabase (chỉ init nếu có cấu hình đầy đủ; 1 lần / process). create_client đồng bộ, có thể chậm
+    # → chạy ở thread pool, không chặn các chat khác trên loop chung của poller
+    if _supabase_pending(settings):
+        await asyncio.to_thread(_init_supabase_if_configured, settings)
 
     # Parse message
     msg = update.get("message") or update.get("edited_message")
@@ -215,23 +351,131 @@ async def _handle_update(update: Dict[str, Any]):
         await _safe_insert_message(settings, {"user_id": chat_id, "chat_id": chat_id, "role": "assistant", "content": reply})
         return
 
+    # === Gộp burst (tuỳ chọn): nhiều tin liên tiếp → 1 lượt LLM ===
+    # Mảnh khoá theo message_id; thiếu message_id thì không gộp (tránh các tin như vậy ghi đè nhau ở khoá 0)
+    window_ms = int(getattr(settings, "BURST_WINDOW_MS", 0))
+    message_id = msg.get("message_id")
+    if window_ms > 0 and message_id:
+        coalescer = get_coalescer(window_ms, int(getattr(settings, "BURST_MAX_WAIT_MS", 4000)))
+        burst_key = chat_key(chat_id)
+        if not coalescer.offer(burst_key, message_id, user_text):
+            # Đã ack nhưng chưa trả lời: giữ lại để bàn giao nếu instance tắt giữa chừng
+            lifecycle.defer(burst_key, update)
+            log("burst merged; chat", chat_id)
+            return
+
+        async def _generate(merged: str) -> str:
+            if await asyncio.to_thread(_over_budget, settings, chat_id):
+                return BUDGET_REPLY
+            return await smart_reply(chat_id, merged[: max(1, max_input)])
+
+        async def _deliver(merged_text: str, answer: str) -> None:
+            await _send_safe(settings.TELEGRAM_TOKEN, chat_id, answer, parse_mode="Markdown")
+            _journal_replied(update, answer)
+            await _safe_insert_message(settings, {"user_id": chat_id, "chat_id": chat_id, "role": "assistant", "content": answer})
+
+        try:
+            calls = await coalescer.run(burst_key, _generate, _deliver)
+        finally:
+            journal = get_journal()
+            for merged_update in lifecycle.release_chat(burst_key):
+                if journal:
+                    journal.complete(update_key(merged_update))
+        log("burst handled; chat", chat_id, "llm_calls", calls)
+        return
+
     # === NÃO RAG: persona + ngữ cảnh nhớ + LLM ===
-    answer = await smart_reply(chat_id, user_text)
+    # Hạn mức token/ngày theo chat (tuỳ chọn) — kiểm tra trước khi gọi LLM
+    if await asyncio.to_thread(_over_budget, settings, chat_id):  # lần đầu trong ngày đọc DB
+        answer = BUDGET_REPLY
+    else:
+        answer = await smart_reply(chat_id, user_text)
 
     # Gửi và log (best-effort)
     await _send_safe(settings.TELEGRAM_TOKEN, chat_id, answer, parse_mode="Markdown")
+    _journal_replied(update, answer)
     await _safe_insert_message(settings, {"user_id": chat_id, "chat_id": chat_id, "role": "assistant", "content": answer})
 
 
+# =====================
+# Journal / resume (crash-safe)
+# =====================
+
+def _journal_replied(update: Dict[str, Any], answer: str) -> None:
+    journal = get_journal()
+    if journal:
+        journal.mark_replied(update_key(update), answer)
+
+
+def _journal_complete(update: Dict[str, Any]) -> None:
+    # Mảnh đã gộp vào burst chỉ hoàn tất khi leader trả lời xong (xem release_chat)
+    journal = get_journal()
+    if journal and not lifecycle.is_deferred(update):
+        journal.complete(update_key(update))
+
+
+def _journal_release(update: Dict[str, Any]) -> None:
+    # Lỗi giữa chừng: bỏ entry 'received' để lần gửi lại của Telegram không bị coi là trùng
+    journal = get_journal()
+    if journal:
+        try:
+            journal.release(update_key(update))
+        except Exception as e:
+            log_error("journal release error:", e)
+
+
+async def _handle_tracked(update: Dict[str, Any]) -> None:
+    """Xử lý 1 update nhận lại từ instance/worker trước (được theo dõi để bàn giao tiếp nếu lại drain)."""
+    lifecycle.enter(update)
+    try:
+        await _handle_update(update)
+        _journal_complete(update)
+    except Exception as e:
+        log_error("resumed update error:", update.get("update_id"), e)
+        _journal_release(update)
+    finally:
+        lifecycle.exit(update)
+
+
+async def _finish_logging(update: Dict[str, Any], answer: str) -> None:
+    """Entry journal đã 'replied' nhưng chưa ghi log: chỉ ghi lại log assistant, không trả lời lần 2."""
+    if not _activate_update_bot(update):
+        _journal_complete(update)
+        return
+    settings = _bot_settings()
+    chat_id = ((update.get("message") or update.get("edited_message") or {}).get("chat") or {}).get("id")
+    if chat_id:
+        await _safe_insert_message(settings, {"user_id": chat_id, "chat_id": chat_id, "role": "assistant", "content": answer})
+    _journal_complete(update)
+
+
+async def _resume_jobs() -> None:
+    jobs = [_handle_tracked(u) for u in lifecycle.claim()]
+    journal = get_journal()
+    for u, state, answer in (journal.claim_orphans() if journal else []):
+        jobs.append(_finish_logging(u, answer or "") if state == "replied" else _handle_tracked(u))
+    if jobs:
+        log("resuming unfinished updates:", len(jobs))
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+
+def _resume_pending() -> None:
+    """Thread nền của lifecycle: nhận update được bàn giao (drain / worker crash) và xử lý ngoài request."""
+    _init_supabase_if_configured(load_settings_from_env())
+    http_pool.run(_resume_jobs())
+
+
 # =====================
 # Flask entrypoint
 # =====================
 
-def telegram_webhook_route():
-    settings = load_settings_from_env()
+def telegram_webhook_route(bot_key: Optional[str] = None):
+    bot = activate(bot_key)
+    if bot is None:
+        return _error("Not found", 404)
 
-    # Verify secret lần nữa (đã có lớp ở app.py)
-    if not _verify_secret(request, settings.TELEGRAM_SECRET_TOKEN):
+    # Verify secret lần nữa (đã có lớp ở app.py) — secret riêng của bot
+    if not _verify_secret(request, bot.secret):
         log_error("Invalid secret token")
         return _error("Unauthorized", 401)
 
@@ -243,14 +487,37 @@ def telegram_webhook_route():
     except Exception as e:
         log_error("Bad JSON:", e)
         return _error("Bad request JSON", 400)
+    if not is_default(bot):
+        # Gắn bot vào body: journal / bàn giao khi drain / resume đều biết update thuộc bot nào
+        update["_bot"] = bot.key
+
+    # Journal (nếu bật): ghi bền trước khi xử lý; update_id đã có → redelivery, bỏ qua
+    journal = get_journal()
+    if journal:
+        try:
+            if not journal.begin(update):
+                log("duplicate update (journal):", update.get("update_id"))
+                return _ok({"duplicate": True})
+        except Exception as e:
+            log_error("journal append error:", e)
 
     # Xử lý cập nhật
     try:
         timer = Timer()
-        asyncio.run(_handle_update(update))
+        lifecycle.start_resumer(_resume_pending)  # 1 lần / process; việc bàn giao chạy nền, không chặn trả 200
+        lifecycle.enter(update)
+        try:
+            with profiler.sample():  # no-op trừ khi đã bật profiling (PROFILE_SAMPLE_RATE / /_admin/profile)
+                http_pool.run(_handle_update(update))  # client HTTP dùng chung trong request, đóng khi xong
+            _journal_complete(update)
+        finally:
+            lifecycle.exit(update)
         ms = timer.stop_ms()
-        log("handled update in", ms, "ms")
+        gate.record(bot, ms)
+        log("handled update in", ms, "ms", "bot", bot.key)
         return _ok({"handled_ms": ms})
     except Exception as e:
         log_error("handler error:", e)
+        _journal_release(update)
+        update_guard.forget(bot.key, update.get("update_id"))
         return _error("Internal error", 500)
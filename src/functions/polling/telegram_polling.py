@@ -0,0 +1,253 @@
+# src/functions/polling/telegram_polling.py — Chế độ nhận update bằng long-polling (getUpdates)
+#
+# Dành cho self-host / dev (không cần HTTPS public). Mỗi vòng getUpdates kéo tới `limit`
+# update, dispatch đồng thời qua cùng pipeline `_handle_update` của webhook:
+#   - Khác chat → chạy song song; cùng chat → giữ thứ tự.
+#   - Offset + các update đang xử lý được ghi ra file state TRƯỚC khi xác nhận offset với
+#     Telegram → restart không mất update (pending được chạy lại) và không lặp update đã xong.
+#     Ghi theo lô: 1 lần mỗi trang getUpdates (+ khi hết việc), không ghi lại sau từng update.
+#   - Cùng bộ lọc với webhook (infra.update_guard): bỏ update không có text, dedupe, rate-limit theo chat.
+import os
+import json
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from infra import http_pool, update_guard
+from infra.bots import DEFAULT_KEY, chat_key, get_bot
+from infra.logging import log, log_error
+from infra.telegram_api import delete_webhook, get_updates, send_text
+from core.coalescer import is_coalescing
+
+DEFAULT_STATE_PATH = os.getenv("TELEGRAM_POLL_STATE", "/tmp/thienco-poll-state.json")
+ALLOWED_UPDATES = ["message", "edited_message"]
+
+
+class _PollState:
+    """File state nhỏ (JSON, ghi atomically): offset kế tiếp + body các update chưa xong."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.pending: Dict[int, Dict[str, Any]] = {}
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.offset = int(data.get("offset", 0))
+            self.pending = {int(u["update_id"]): u for u in data.get("pending", [])}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_error("poll state load error:", e)
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": self.offset, "pending": list(self.pending.values())}, f)
+        os.replace(tmp, self.path)
+
+
+class TelegramPoller:
+    """
+    Vòng long-polling: getUpdates(offset, limit, timeout) → ghi state → dispatch.
+    `max_inflight` giới hạn số update đang xử lý (backpressure: ngừng kéo khi đầy).
+    """
+
+    def __init__(
+        self,
+        token: str,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        state_path: str = DEFAULT_STATE_PATH,
+        limit: int = 100,
+        timeout: int = 50,
+        max_inflight: int = 256,
+        bot_key: str = DEFAULT_KEY,
+    ):
+        self.token = token
+        self.bot_key = bot_key
+        self.handler = handler
+        self.state = _PollState(state_path)
+        self.limit = max(1, min(100, limit))
+        self.timeout = max(0, timeout)
+        self.max_inflight = max(1, max_inflight)
+        self._tails: Dict[int, asyncio.Event] = {}  # chat_id -> "được phép chạy update kế tiếp"
+        self._tasks: set = set()
+        self._stopping = False
+        self._dirty = False  # pending đã đổi từ lần ghi state gần nhất
+        self._poll: Optional[asyncio.Future] = None
+
+    # ---------- lọc (giống guard của webhook) ----------
+    def _admit(self, update: Dict[str, Any]) -> bool:
+        upd_id = update.get("update_id")
+        chat_id, text = update_guard.extract(update)
+        if not chat_id or text is None:
+            log("poll skip update (no chat/text):", upd_id)
+            return False
+        if update_guard.is_seen(self.bot_key, upd_id):
+            return False
+        update_guard.mark_seen(self.bot_key, upd_id)
+        key = chat_key(chat_id, self.bot_key)
+        if not is_coalescing(key) and not update_guard.allow_chat(key):
+            self._spawn(self._notify_limited(chat_id))
+            return False
+        return True
+
+    async def _notify_limited(self, chat_id: int) -> None:
+        try:
+            await send_text(self.token, chat_id, update_guard.RATE_LIMIT_REPLY, parse_mode=None)
+        except Exception as e:
+            log_error("poll rate-limit notice error:", e)
+
+    # ---------- dispatch ----------
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _dispatch(self, update: Dict[str, Any]) -> None:
+        if self.bot_key != DEFAULT_KEY:
+            update["_bot"] = self.bot_key
+        chat_id = update_guard.extract(update)[0]
+        prev = self._tails.get(chat_id) if chat_id is not None else None
+        release = asyncio.Event()
+        if chat_id is not None:
+            self._tails[chat_id] = release
+        self._spawn(self._process(update, chat_id, prev, release))
+
+    async def _process(self, update: Dict[str, Any], chat_id: Optional[int],
+                       prev: Optional[asyncio.Event], release: asyncio.Event) -> None:
+        uid = int(update.get("update_id", 0))
+        try:
+            if prev is not None:
+                await prev.wait()
+            task = asyncio.ensure_future(self.handler(update))
+            while not task.done():
+                await asyncio.wait({task}, timeout=0.05)
+                # Đã được gộp vào burst đang mở → leader lo phần trả lời, tin sau của chat được chạy
+                if not task.done() and chat_id is not None and is_coalescing(chat_key(chat_id, self.bot_key)):
+                    release.set()
+            task.result()
+        except Exception as e:
+            log_error("poll handler error:", uid, e)
+        finally:
+            release.set()
+            if chat_id is not None and self._tails.get(chat_id) is release:
+                del self._tails[chat_id]
+            self.state.pending.pop(uid, None)
+            self._dirty = True
+            # Hết việc giữa 2 trang (long-poll có thể chờ tới `timeout` giây) → ghi luôn
+            if not self.state.pending:
+                self._save()
+
+    def _save(self) -> None:
+        self._dirty = False
+        try:
+            self.state.save()
+        except Exception as e:
+            log_error("poll state save error:", e)
+
+    # ---------- vòng chính ----------
+    async def run(self, client: Optional[httpx.AsyncClient] = None, drop_webhook: bool = True) -> None:
+        self.state.load()
+        own = client is None
+        if own:
+            client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout + 10.0, connect=5.0))
+        try:
+            if drop_webhook:
+                await delete_webhook(client, self.token)
+            # Chạy lại các update đã nhận nhưng chưa xử lý xong ở lần chạy trước
+            replay = sorted(self.state.pending.values(), key=lambda u: u["update_id"])
+            if replay:
+                log("poll replay pending:", len(replay))
+            for u in replay:
+                self._dispatch(u)
+
+            while not self._stopping:
+                if len(self._tasks) >= self.max_inflight:
+                    await asyncio.wait(set(self._tasks), return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                self._poll = asyncio.ensure_future(get_updates(client, self.token, self.state.offset,
+                                                               self.limit, self.timeout, ALLOWED_UPDATES))
+                try:
+                    batch = await self._poll
+                except asyncio.CancelledError:
+                    break
+                except (httpx.HTTPError, RuntimeError, ValueError) as e:
+                    log_error("getUpdates error:", e)
+                    await asyncio.sleep(2.0)
+                    continue
+                if not batch:
+                    continue
+                self._accept(batch)
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            if self._dirty:
+                self._save()
+            if own:
+                await client.aclose()
+
+    def _accept(self, batch: List[Dict[str, Any]]) -> None:
+        fresh = [u for u in batch if int(u.get("update_id", -1)) >= self.state.offset]
+        if not fresh:
+            return
+        fresh.sort(key=lambda u: u["update_id"])
+        # Offset vượt qua cả update bị lọc; chỉ update được nhận mới vào pending
+        self.state.offset = int(fresh[-1]["update_id"]) + 1
+        admitted = [u for u in fresh if self._admit(u)]
+        for u in admitted:
+            self.state.pending[int(u["update_id"])] = u
+        # 1 lần ghi / trang: offset mới + pending (kể cả các update đã xong từ trang trước),
+        # trước khi lần getUpdates sau xác nhận offset với Telegram
+        self._save()
+        log("poll batch:", len(fresh), "admitted", len(admitted), "next offset", self.state.offset)
+        for u in admitted:
+            self._dispatch(u)
+
+    def stop(self) -> None:
+        """Ngừng kéo update mới (SIGTERM/SIGINT); update đang xử lý vẫn chạy xong, pending còn trong state."""
+        self._stopping = True
+        if self._poll is not None and not self._poll.done():
+            self._poll.cancel()
+
+
+def main() -> None:
+    import argparse
+    from functions.http.telegram_webhook import _handle_update
+
+    ap = argparse.ArgumentParser(description="Thiên Cơ bot — long-polling runner")
+    ap.add_argument("--limit", type=int, default=100, help="số update tối đa mỗi getUpdates (≤100)")
+    ap.add_argument("--timeout", type=int, default=50, help="long-poll timeout (giây)")
+    ap.add_argument("--max-inflight", type=int, default=256)
+    ap.add_argument("--state", type=str, default=DEFAULT_STATE_PATH, help="file lưu offset/pending")
+    ap.add_argument("--keep-webhook", action="store_true", help="không gọi deleteWebhook khi khởi động")
+    ap.add_argument("--bot", type=str, default=DEFAULT_KEY, help="bot key trong BOTS_CONFIG (mặc định: bot env)")
+    args = ap.parse_args()
+
+    bot = get_bot(args.bot)
+    if bot is None:
+        raise SystemExit(f"Không có bot '{args.bot}' trong BOTS_CONFIG")
+    if not bot.token:
+        raise SystemExit("Thiếu TELEGRAM_TOKEN")
+    state_path = args.state if bot.key == DEFAULT_KEY else f"{args.state}.{bot.key}"
+    poller = TelegramPoller(bot.token, _handle_update, state_path=state_path, limit=args.limit,
+                            timeout=args.timeout, max_inflight=args.max_inflight, bot_key=bot.key)
+    async def _run():
+        import signal
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, poller.stop)
+        try:
+            await poller.run(drop_webhook=not args.keep_webhook)
+        finally:
+            await http_pool.aclose_loop()  # client Telegram / LLM dùng chung của cả vòng poll
+
+    asyncio.run(_run())
+    log("poller stopped")
+
+
+if __name__ == "__main__":
+    main()
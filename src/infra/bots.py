@@ -0,0 +1,192 @@
+# src/infra/bots.py — Nhiều bot trong 1 process: cấu hình theo bot + bot hiện hành (contextvar)
+#
+# Mọi bot dùng chung model embedding, Supabase client, limiter LLM… của process; chỉ khác token,
+# secret, persona, model và namespace bộ nhớ. Route /telegram/webhook/<bot_key> chọn bot;
+# /telegram/webhook (và "/") là bot "default" lấy từ TELEGRAM_TOKEN / TELEGRAM_SECRET_TOKEN như cũ.
+# Bot không phải default BẮT BUỘC có secret (thiếu → bỏ bot khỏi cấu hình): không thì ai đoán được
+# key cũng POST được vào /telegram/webhook/<key> và tiêu ngân sách LLM của bot đó.
+#
+# BOTS_CONFIG = đường dẫn file JSON hoặc JSON inline, dạng list:
+#   [{"key": "en", "token_env": "BOT_EN_TOKEN", "secret_env": "BOT_EN_SECRET",
+#     "persona": "prompts/persona_system_en.txt", "model": "openai/gpt-4o-mini",
+#     "namespace": "en", "rate_per_min": 600, "max_inflight": 8}]
+import os
+import json
+import time
+import zlib
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Hashable, List, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+from .config import _clean
+from .logging import log_error
+
+DEFAULT_KEY = "default"
+
+
+class BotConfig(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())  # cho phép field model / model_small
+
+    key: str
+    token: str = ""
+    secret: str = ""
+    persona: str = ""        # file persona ("" = prompts/persona_system_vi.txt)
+    model: str = ""          # "" = LLM_MODEL
+    model_small: str = ""    # "" = LLM_MODEL_SMALL
+    namespace: str = ""      # tiền tố user_id trong memory_* ("" = chat_id như cũ)
+    rate_per_min: int = 0    # trần update/phút của cả bot (0 = không giới hạn riêng)
+    max_inflight: int = 0    # trần lượt LLM đồng thời của bot (0 = chỉ theo limiter chung)
+
+
+def _load_config() -> Dict[str, BotConfig]:
+    bots = {DEFAULT_KEY: BotConfig(
+        key=DEFAULT_KEY,
+        token=_clean(os.getenv("TELEGRAM_TOKEN", "")) or "",
+        secret=_clean(os.getenv("TELEGRAM_SECRET_TOKEN", "")) or "",
+    )}
+    raw = (_clean(os.getenv("BOTS_CONFIG", "")) or "")
+    if not raw:
+        return bots
+    try:
+        if not raw.lstrip().startswith("["):
+            with open(raw, "r", encoding="utf-8") as f:
+                raw = f.read()
+        for item in json.loads(raw):
+            item = dict(item)
+            for field in ("token", "secret"):
+                env = item.pop(f"{field}_env", None)
+                if env:
+                    item[field] = _clean(os.getenv(env, "")) or ""
+            bot = BotConfig(**item)
+            if bot.key != DEFAULT_KEY and not bot.secret:
+                log_error("BOTS_CONFIG: skip bot without secret:", bot.key)
+                continue
+            bots[bot.key] = bot
+    except (OSError, ValueError, TypeError) as e:
+        log_error("BOTS_CONFIG error:", e)
+    return bots
+
+
+_bots: Optional[Dict[str, BotConfig]] = None
+_bots_lock = threading.Lock()
+_current: ContextVar[Optional[BotConfig]] = ContextVar("current_bot", default=None)
+
+
+def all_bots() -> Dict[str, BotConfig]:
+    global _bots
+    with _bots_lock:
+        if _bots is None:
+            _bots = _load_config()
+        return _bots
+
+
+def get_bot(key: Optional[str]) -> Optional[BotConfig]:
+    return all_bots().get(key or DEFAULT_KEY)
+
+
+def activate(key: Optional[str]) -> Optional[BotConfig]:
+    """
+    Đặt bot hiện hành cho context (request thread / task asyncio hiện tại).
+    Key lạ (bot đã bỏ khỏi cấu hình…) → None: caller phải từ chối update, không rơi về bot default.
+    """
+    bot = get_bot(key)
+    _current.set(bot)
+    return bot
+
+
+def current_bot() -> BotConfig:
+    return _current.get() or get_bot(DEFAULT_KEY)
+
+
+def is_default(bot: Optional[BotConfig]) -> bool:
+    return bot is None or bot.key == DEFAULT_KEY
+
+
+def apply_bot(settings, bot: Optional[BotConfig] = None):
+    """Settings đã ghép phần riêng của bot (token/secret/model); bot default → giữ nguyên env."""
+    bot = bot or current_bot()
+    if is_default(bot):
+        return settings
+    update: Dict[str, Any] = {"TELEGRAM_TOKEN": bot.token, "TELEGRAM_SECRET_TOKEN": bot.secret}
+    if bot.model:
+        update["LLM_MODEL"] = bot.model
+    if bot.model_small:
+        update["LLM_MODEL_SMALL"] = bot.model_small
+    return settings.model_copy(update=update)
+
+
+def chat_key(chat_id: int, bot_key: Optional[str] = None) -> Hashable:
+    """Khoá theo chat cho state trong RAM (burst, rate-limit…): chat riêng có cùng id ở mọi bot."""
+    key = bot_key if bot_key is not None else current_bot().key
+    return chat_id if key == DEFAULT_KEY else (key, chat_id)
+
+
+def memory_user(chat_id: int | str) -> str:
+    ns = current_bot().namespace
+    return f"{ns}:{chat_id}" if ns else str(chat_id)
+
+
+def update_key(update: Dict[str, Any]) -> int:
+    """update_id là dãy riêng của từng bot → khoá journal/lifecycle = (bot, update_id) gói vào 1 int64."""
+    uid = int(update.get("update_id", 0))
+    key = update.get("_bot")
+    if not key or key == DEFAULT_KEY:
+        return uid
+    return ((zlib.crc32(key.encode("utf-8")) & 0x7FFFFFFF) << 32) | (uid & 0xFFFFFFFF)
+
+
+class _BotGate:
+    """Trần theo bot: update/phút (token bucket) + số lượt LLM đồng thời; kèm số liệu cho /_metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[float]] = {}   # key -> [tokens, last_ts]
+        self._inflight: Dict[str, int] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _stat(self, key: str) -> Dict[str, int]:
+        s = self._stats.get(key)
+        if s is None:
+            s = self._stats[key] = {"updates": 0, "throttled": 0, "shed": 0, "handled_ms_sum": 0}
+        return s
+
+    def allow(self, bot: BotConfig) -> bool:
+        with self._lock:
+            st = self._stat(bot.key)
+            st["updates"] += 1
+            if bot.rate_per_min <= 0:
+                return True
+            now = time.monotonic()
+            tok, last = self._buckets.get(bot.key, [float(bot.rate_per_min), now])
+            tok = min(float(bot.rate_per_min), tok + (now - last) * bot.rate_per_min / 60.0)
+            ok = tok >= 1.0
+            self._buckets[bot.key] = [tok - 1.0 if ok else tok, now]
+            if not ok:
+                st["throttled"] += 1
+            return ok
+
+    def try_enter(self, bot: BotConfig) -> bool:
+        with self._lock:
+            n = self._inflight.get(bot.key, 0)
+            if bot.max_inflight > 0 and n >= bot.max_inflight:
+                self._stat(bot.key)["shed"] += 1
+                return False
+            self._inflight[bot.key] = n + 1
+            return True
+
+    def leave(self, bot: BotConfig) -> None:
+        with self._lock:
+            self._inflight[bot.key] = max(0, self._inflight.get(bot.key, 0) - 1)
+
+    def record(self, bot: BotConfig, handled_ms: int) -> None:
+        with self._lock:
+            self._stat(bot.key)["handled_ms_sum"] += handled_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {k: {**s, "inflight": self._inflight.get(k, 0)} for k, s in self._stats.items()}
+
+
+gate = _BotGate()
@@ -58,6 +58,23 @@ class Settings(BaseModel):
     MEMORY_TOPK: int = 8           # số mảnh ngữ cảnh lấy vào prompt
     SUMMARY_EVERY_N: int = 12      # tóm tắt sau mỗi N tin (nếu bật summarize)
     TIMEZONE_DEFAULT: str = "Asia/Ho_Chi_Minh"
+    MEMORY_CONTEXT_TOKENS: int = 400  # ngân sách token cho khối 'ngữ cảnh nhớ' (đã nén, không cắt giữa câu)
+
+    # --- MỚI: GỘP TIN NHẮN DỒN DẬP (burst) ---
+    BURST_WINDOW_MS: int = 0       # 0 = tắt; >0: chờ chat im lặng bấy nhiêu ms rồi mới gọi LLM
+    BURST_MAX_WAIT_MS: int = 4000  # chặn trên tổng thời gian chờ gộp
+
+    # --- MỚI: GIỚI HẠN ĐỒNG THỜI THÍCH NGHI (admission control cho LLM) ---
+    LLM_CONCURRENCY_INIT: int = 8
+    LLM_CONCURRENCY_MIN: int = 2
+    LLM_CONCURRENCY_MAX: int = 64  # 0 = tắt (không shed)
+
+    # --- MỚI: PHÂN TẦNG MODEL ---
+    LLM_MODEL_SMALL: str = ""      # trống = tắt; có giá trị: lượt đơn giản dùng model này, khó dùng LLM_MODEL
+    LLM_TIER_ESCALATE: int = 1     # 1 = gọi lại model lớn khi model nhỏ trả rỗng / bị cắt / từ chối
+
+    # --- MỚI: KẾ TOÁN USAGE / HẠN MỨC ---
+    CHAT_DAILY_TOKEN_BUDGET: int = 0  # 0 = không giới hạn; >0: tổng token/chat/ngày (theo TIMEZONE_DEFAULT)
 
 def load_settings_from_env() -> Settings:
     fields = {
@@ -88,15 +105,37 @@ def load_settings_from_env() -> Settings:
         "MEMORY_TOPK": _to_int(os.environ.get("MEMORY_TOPK"), 8),
         "SUMMARY_EVERY_N": _to_int(os.environ.get("SUMMARY_EVERY_N"), 12),
         "TIMEZONE_DEFAULT": _clean(os.environ.get("TIMEZONE_DEFAULT", "Asia/Ho_Chi_Minh")),
+        "MEMORY_CONTEXT_TOKENS": _to_int(os.environ.get("MEMORY_CONTEXT_TOKENS"), 400),
+
+        # MỚI: gộp burst
+        "BURST_WINDOW_MS": _to_int(os.environ.get("BURST_WINDOW_MS"), 0),
+        "BURST_MAX_WAIT_MS": _to_int(os.environ.get("BURST_MAX_WAIT_MS"), 4000),
+
+        # MỚI: admission control
+        "LLM_CONCURRENCY_INIT": _to_int(os.environ.get("LLM_CONCURRENCY_INIT"), 8),
+        "LLM_CONCURRENCY_MIN": _to_int(os.environ.get("LLM_CONCURRENCY_MIN"), 2),
+        "LLM_CONCURRENCY_MAX": _to_int(os.environ.get("LLM_CONCURRENCY_MAX"), 64),
+
+        # MỚI: phân tầng model
+        "LLM_MODEL_SMALL": _clean(os.environ.get("LLM_MODEL_SMALL", "")),
+        "LLM_TIER_ESCALATE": _to_int(os.environ.get("LLM_TIER_ESCALATE"), 1),
+
+        # MỚI: hạn mức token/ngày
+        "CHAT_DAILY_TOKEN_BUDGET": _to_int(os.environ.get("CHAT_DAILY_TOKEN_BUDGET"), 0),
     }
 
     # Clamp nhẹ để tránh cấu hình “bậy”
     if fields["MEMORY_TOPK"] < 1: fields["MEMORY_TOPK"] = 1
     if fields["MEMORY_TOPK"] > 32: fields["MEMORY_TOPK"] = 32
+    if fields["MEMORY_CONTEXT_TOKENS"] < 50: fields["MEMORY_CONTEXT_TOKENS"] = 50
     if fields["MAX_TOKENS"] < 64: fields["MAX_TOKENS"] = 64
     if fields["MAX_TOKENS"] > 4096: fields["MAX_TOKENS"] = 4096
     if fields["TEMPERATURE"] < 0: fields["TEMPERATURE"] = 0.0
     if fields["TEMPERATURE"] > 1: fields["TEMPERATURE"] = 1.0
     if fields["LLM_TIMEOUT"] < 3: fields["LLM_TIMEOUT"] = 3
+    if fields["BURST_WINDOW_MS"] < 0: fields["BURST_WINDOW_MS"] = 0
+    if fields["BURST_WINDOW_MS"] > 10000: fields["BURST_WINDOW_MS"] = 10000
+    if fields["LLM_CONCURRENCY_MIN"] < 1: fields["LLM_CONCURRENCY_MIN"] = 1
+    if fields["CHAT_DAILY_TOKEN_BUDGET"] < 0: fields["CHAT_DAILY_TOKEN_BUDGET"] = 0
 
     return Settings(**fields)
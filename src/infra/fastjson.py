@@ -0,0 +1,32 @@
+# src/infra/fastjson.py — JSON cho đường nóng (webhook, body gọi LLM/Telegram, literal vector gửi Supabase)
+#
+# Có orjson → dùng orjson (nhanh ~5-10x json stdlib, serialize thẳng mảng numpy float32 không qua float
+# Python). Không có → json stdlib với output tương đương (compact, giữ nguyên UTF-8).
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # tuỳ chọn: thiếu thì chạy bằng json stdlib
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    return dumps(obj, default).decode("utf-8")
+
+
+def loads(data: bytes | bytearray | memoryview | str) -> Any:
+    """Lỗi cú pháp → ValueError (orjson.JSONDecodeError cũng là lớp con của json.JSONDecodeError)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
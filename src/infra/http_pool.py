@@ -0,0 +1,52 @@
+# src/infra/http_pool.py — httpx.AsyncClient dùng chung (giữ kết nối keep-alive / TLS) theo event loop
+#
+# AsyncClient gắn với event loop tạo ra nó → pool khoá theo (loop, tên):
+#   - poller: 1 loop sống suốt process → mọi chat / mọi lượt dùng lại cùng kết nối.
+#   - webhook (gthread): mỗi request 1 asyncio.run → typing + LLM + sendMessage của request đó
+#     dùng chung kết nối; `run()` đóng các client của loop trước khi loop đóng.
+# Tên client do caller chọn: Telegram khoá theo token (mỗi bot 1 pool), LLM theo endpoint.
+import asyncio
+import threading
+import weakref
+from typing import Any, Coroutine, Dict, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+
+
+def get_client(name: str, timeout: float = 20.0) -> httpx.AsyncClient:
+    """Client `name` của event loop đang chạy (tạo ở lần đầu); không tự đóng — xem `run()` / `aclose_loop()`."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        pool = _clients.get(loop)
+        if pool is None:
+            pool = _clients[loop] = {}
+        client = pool.get(name)
+        if client is None or client.is_closed:
+            client = pool[name] = httpx.AsyncClient(timeout=timeout)
+        return client
+
+
+async def aclose_loop() -> None:
+    """Đóng mọi client của loop đang chạy (gọi trước khi loop kết thúc)."""
+    with _lock:
+        pool = _clients.pop(asyncio.get_running_loop(), None) or {}
+    for client in pool.values():
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+def run(coro: Coroutine[Any, Any, T]) -> T:
+    """asyncio.run(coro) rồi đóng các client pool của loop đó (không rò socket mỗi request)."""
+    async def _main() -> T:
+        try:
+            return await coro
+        finally:
+            await aclose_loop()
+    return asyncio.run(_main())
@@ -0,0 +1,261 @@
+# src/infra/journal.py — Nhật ký update bền vững cục bộ (sqlite WAL, group commit)
+#
+# Mỗi update được ghi "received" TRƯỚC khi xử lý, "replied" (kèm câu trả lời) sau khi gửi,
+# "logged" khi đã ghi log xong. Worker chết giữa chừng → worker mới nhận lại các entry
+# chưa xong (chủ cũ không còn sống) và chạy lại đúng phần còn thiếu; update_id đã có trong
+# journal được coi là trùng (thay cho deque `_seen` mất khi crash) — trừ entry 'received' mà
+# không ai đang xử lý (xử lý lỗi / chủ đã chết): Telegram gửi lại thì chạy lại như mới.
+#
+# Ghi qua 1 writer thread: mọi thao tác đến trong lúc đang commit được gom vào 1 transaction
+# → 1 fsync cho cả nhóm update đồng thời, không phải 1 fsync / update.
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from . import fastjson
+from .bots import update_key
+from .logging import log, log_error
+
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "")
+RETENTION_S = float(os.getenv("JOURNAL_RETENTION_S", "3600"))  # giữ entry đã xong để dedupe redelivery
+COMPACT_EVERY_S = 60.0
+
+RECEIVED, REPLIED, LOGGED = "received", "replied", "logged"
+
+
+class _Op:
+    __slots__ = ("fn", "done", "result", "error")
+
+    def __init__(self, fn: Callable[[sqlite3.Connection], Any]):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class UpdateJournal:
+    def __init__(self, path: str, retention_s: float = RETENTION_S):
+        self.path = path
+        self.retention_s = retention_s
+        self._cv = threading.Condition()
+        self._queue: List[_Op] = []
+        self._stopped = False
+        self._last_compact = time.monotonic()
+        self._handling: Set[int] = set()  # update_id process này đang xử lý (entry owner = pid này)
+        self._handling_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._writer, name="update-journal", daemon=True)
+        self._thread.start()
+
+    # ---------- writer (group commit) ----------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=10.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")  # fsync khi COMMIT (1 lần / nhóm)
+        conn.execute(
+            "create table if not exists updates ("
+            " update_id integer primary key, body text not null, state text not null,"
+            " answer text, owner integer not null, updated_at real not null)"
+        )
+        conn.execute("create index if not exists idx_updates_state on updates(state, updated_at)")
+        return conn
+
+    def _writer(self) -> None:
+        try:
+            conn = self._connect()
+        except Exception as e:
+            log_error("journal open error:", e)
+            conn = None
+        while True:
+            with self._cv:
+                while not self._queue and not self._stopped:
+                    self._cv.wait(COMPACT_EVERY_S)
+                    if not self._queue:
+                        break
+                batch, self._queue = self._queue, []
+                stopped = self._stopped
+            if batch:
+                self._commit(conn, batch)
+            if conn is not None and time.monotonic() - self._last_compact >= COMPACT_EVERY_S:
+                self._compact(conn)
+            if stopped and not batch:
+                if conn is not None:
+                    conn.close()
+                return
+
+    def _commit(self, conn: Optional[sqlite3.Connection], batch: List[_Op]) -> None:
+        if conn is None:
+            for op in batch:
+                op.error = RuntimeError("journal unavailable")
+                op.done.set()
+            return
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for op in batch:
+                try:
+                    op.result = op.fn(conn)
+                except sqlite3.Error as e:
+                    op.error = e
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            log_error("journal commit error:", e)
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            for op in batch:
+                op.error = op.error or e
+        for op in batch:
+            op.done.set()
+
+    def _compact(self, conn: sqlite3.Connection) -> None:
+        self._last_compact = time.monotonic()
+        try:
+            cur = conn.execute("delete from updates where state = ? and updated_at < ?",
+                               (LOGGED, time.time() - self.retention_s))
+            if cur.rowcount:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                log("journal compacted:", cur.rowcount)
+        except sqlite3.Error as e:
+            log_error("journal compact error:", e)
+
+    def _submit(self, fn: Callable[[sqlite3.Connection], Any], wait: bool) -> Any:
+        op = _Op(fn)
+        with self._cv:
+            if self._stopped:
+                raise RuntimeError("journal closed")
+            self._queue.append(op)
+            self._cv.notify()
+        if not wait:
+            return None
+        op.done.wait()
+        if op.error:
+            raise op.error
+        return op.result
+
+    def _track(self, update_id: int) -> None:
+        with self._handling_lock:
+            self._handling.add(update_id)
+
+    def _untrack(self, update_id: int) -> None:
+        with self._handling_lock:
+            self._handling.discard(update_id)
+
+    def _is_handling(self, update_id: int) -> bool:
+        with self._handling_lock:
+            return update_id in self._handling
+
+    # ---------- API ----------
+    def begin(self, update: Dict[str, Any]) -> bool:
+        """
+        Ghi bền 'received' (chờ fsync của nhóm); khoá = update_key(). Trả False nếu update đã có (trùng).
+        Ngoại lệ: entry còn 'received' mà chủ không còn xử lý (pid chết, hoặc chính process này
+        nhưng lượt trước đã bỏ dở) → nhận lại và trả True để lần gửi lại được xử lý.
+        """
+        uid = update_key(update)
+        body = fastjson.dumps_str(update)
+        pid = os.getpid()
+
+        def fn(conn):
+            now = time.time()
+            if conn.execute(
+                "insert or ignore into updates(update_id, body, state, owner, updated_at) values (?,?,?,?,?)",
+                (uid, body, RECEIVED, pid, now),
+            ).rowcount != 1:
+                row = conn.execute("select state, owner from updates where update_id = ?", (uid,)).fetchone()
+                if row is None or row[0] != RECEIVED:
+                    return False
+                owner = int(row[1])
+                busy = self._is_handling(uid) if owner == pid else _alive(owner)
+                if busy:
+                    return False
+                conn.execute("update updates set body = ?, owner = ?, updated_at = ? where update_id = ?",
+                             (body, pid, now, uid))
+            # Đánh dấu ngay trong writer thread: 2 lần gửi lại đồng thời không cùng lọt qua
+            self._track(uid)
+            return True
+        return bool(self._submit(fn, wait=True))
+
+    def mark_replied(self, update_id: int, answer: str) -> None:
+        """Đã gửi trả lời: lưu câu trả lời để nếu crash trước khi ghi log thì chỉ cần ghi log lại."""
+        self._submit(lambda conn: conn.execute(
+            "update updates set state = ?, answer = ?, updated_at = ? where update_id = ?",
+            (REPLIED, answer, time.time(), int(update_id))), wait=False)
+
+    def complete(self, update_id: int) -> None:
+        self._untrack(int(update_id))
+        self._submit(lambda conn: conn.execute(
+            "update updates set state = ?, updated_at = ? where update_id = ?",
+            (LOGGED, time.time(), int(update_id))), wait=False)
+
+    def release(self, update_id: int) -> None:
+        """
+        Xử lý lỗi giữa chừng: xoá entry còn 'received' để lần Telegram gửi lại (sau 500) được xử lý
+        như mới thay vì bị coi là trùng. Entry đã 'replied' giữ nguyên (không trả lời lần 2).
+        """
+        self._untrack(int(update_id))
+        self._submit(lambda conn: conn.execute(
+            "delete from updates where update_id = ? and state = ?", (int(update_id), RECEIVED)), wait=False)
+
+    def claim_orphans(self) -> List[Tuple[Dict[str, Any], str, Optional[str]]]:
+        """
+        Nhận entry chưa xong của process đã chết (pid không còn sống); gọi định kỳ được —
+        BEGIN IMMEDIATE nên mỗi entry chỉ 1 process nhận. Trả list (update, state, answer).
+        """
+        pid = os.getpid()
+
+        def fn(conn):
+            rows = conn.execute(
+                "select update_id, body, state, answer, owner from updates where state != ? order by update_id",
+                (LOGGED,)).fetchall()
+            out = []
+            for uid, body, state, answer, owner in rows:
+                if _alive(int(owner)):
+                    continue
+                conn.execute("update updates set owner = ?, updated_at = ? where update_id = ?",
+                             (pid, time.time(), uid))
+                self._track(uid)
+                out.append((fastjson.loads(body), state, answer))
+            return out
+        try:
+            return self._submit(fn, wait=True) or []
+        except Exception as e:
+            log_error("journal claim error:", e)
+            return []
+
+    def close(self) -> None:
+        """Flush mọi thao tác đang chờ rồi đóng (gọi lúc drain)."""
+        with self._cv:
+            self._stopped = True
+            self._cv.notify()
+        self._thread.join(timeout=5.0)
+
+
+_journal: Optional[UpdateJournal] = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> Optional[UpdateJournal]:
+    """Journal theo process (None nếu chưa cấu hình JOURNAL_PATH)."""
+    global _journal
+    if not JOURNAL_PATH:
+        return None
+    with _journal_lock:
+        if _journal is None:
+            _journal = UpdateJournal(JOURNAL_PATH)
+            from .lifecycle import lifecycle
+            lifecycle.on_drain(_journal.close)
+        return _journal
@@ -0,0 +1,175 @@
+# src/infra/lifecycle.py — Vòng đời instance: drain khi SIGTERM (Cloud Run scale-down / redeploy)
+#
+#   1) begin_drain(): readiness fail (/_readyz → 503), webhook mới trả 503 để Telegram gửi lại
+#      sang instance khác.
+#   2) wait_idle(deadline): chờ các update đang xử lý (LLM + send) xong trong hạn.
+#   3) shutdown(): chạy các hàm flush đã đăng ký (log/memory/usage…), rồi lưu lại body các update
+#      ĐÃ ack nhưng chưa trả lời (mảnh đã gộp vào burst) để instance khác nhận và xử lý. Update còn
+#      đang xử lý (chưa ack) không bàn giao: Telegram tự gửi lại, tránh trả lời 2 lần.
+#   4) start_resumer(): thread nền mỗi RESUME_INTERVAL_S nhận việc được bàn giao — không chờ cold start,
+#      không nằm trên đường trả lời webhook.
+import os
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable, List
+
+from .bots import update_key
+from .logging import log, log_error
+
+DRAIN_DEADLINE_S = float(os.getenv("DRAIN_DEADLINE_S", "8"))
+SPOOL_PATH = os.getenv("DRAIN_SPOOL_PATH", "/tmp/thienco-unfinished.json")
+RESUME_INTERVAL_S = max(1.0, float(os.getenv("RESUME_INTERVAL_S", "15")))
+
+
+class Lifecycle:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._draining = False
+        self._drain_started = 0.0
+        self._inflight: Dict[int, Dict[str, Any]] = {}            # update_key -> body
+        self._deferred: Dict[Hashable, List[Dict[str, Any]]] = {}  # chat_key -> update đã gộp vào burst
+        self._flushers: List[Callable[[], None]] = []
+        self._resumer: threading.Thread | None = None
+
+    # ---------- trạng thái ----------
+    @property
+    def draining(self) -> bool:
+        return self._draining
+
+    def begin_drain(self) -> None:
+        with self._cond:
+            if not self._draining:
+                self._draining = True
+                self._drain_started = time.monotonic()
+                self._cond.notify_all()  # resumer dừng ngay, không đợi hết interval
+                log("lifecycle: draining; inflight", len(self._inflight))
+
+    # ---------- theo dõi update ----------
+    def enter(self, update: Dict[str, Any]) -> None:
+        with self._cond:
+            self._inflight[update_key(update)] = update
+
+    def exit(self, update: Dict[str, Any]) -> None:
+        with self._cond:
+            self._inflight.pop(update_key(update), None)
+            self._cond.notify_all()
+
+    def defer(self, chat_id: Hashable, update: Dict[str, Any]) -> None:
+        """Update đã ack 200 nhưng nội dung đang nằm trong burst của leader."""
+        with self._cond:
+            self._deferred.setdefault(chat_id, []).append(update)
+
+    def release_chat(self, chat_id: Hashable) -> List[Dict[str, Any]]:
+        """Leader đã trả lời xong burst → trả về các update đã gộp (để đánh dấu hoàn tất)."""
+        with self._cond:
+            return self._deferred.pop(chat_id, None) or []
+
+    def is_deferred(self, update: Dict[str, Any]) -> bool:
+        with self._cond:
+            return any(u is update for ups in self._deferred.values() for u in ups)
+
+    def inflight_count(self) -> int:
+        with self._cond:
+            return len(self._inflight)
+
+    # ---------- flush ----------
+    def on_drain(self, fn: Callable[[], None]) -> None:
+        """Đăng ký hàm flush (đồng bộ) chạy khi tắt: buffer log, memory write, usage…"""
+        self._flushers.append(fn)
+
+    def wait_idle(self, deadline_s: float = DRAIN_DEADLINE_S) -> bool:
+        """Chờ hết update đang xử lý; hạn tính từ lúc bắt đầu drain (không cộng dồn với gunicorn)."""
+        end = (self._drain_started or time.monotonic()) + max(0.0, deadline_s)
+        with self._cond:
+            while self._inflight:
+                left = end - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """Update đã ack 200 nhưng chưa trả lời (nằm trong burst) — Telegram sẽ KHÔNG gửi lại."""
+        with self._cond:
+            rows = [u for ups in self._deferred.values() for u in ups]
+        seen, out = set(), []
+        for u in sorted(rows, key=update_key):
+            if update_key(u) not in seen:
+                seen.add(update_key(u))
+                out.append(u)
+        return out
+
+    def shutdown(self, deadline_s: float = DRAIN_DEADLINE_S) -> None:
+        self.begin_drain()
+        idle = self.wait_idle(deadline_s)
+        for fn in self._flushers:
+            try:
+                fn()
+            except Exception as e:
+                log_error("lifecycle flush error:", e)
+        rows = self.unfinished()
+        if rows:
+            _persist(rows)
+        log("lifecycle: shutdown; idle", idle, "handed off", len(rows))
+
+    # ---------- nhận lại việc dang dở ----------
+    def claim(self) -> List[Dict[str, Any]]:
+        """Lấy các update instance/worker khác để lại (mỗi update chỉ 1 nơi nhận)."""
+        return _claim()
+
+    def start_resumer(self, run: Callable[[], None], interval_s: float = RESUME_INTERVAL_S) -> None:
+        """Chạy `run` (nhận + xử lý việc bàn giao) ngay rồi định kỳ trên 1 thread nền; dừng khi drain."""
+        with self._cond:
+            if self._resumer is not None:
+                return
+            self._resumer = threading.Thread(target=self._resume_loop, args=(run, interval_s),
+                                             name="resumer", daemon=True)
+        self._resumer.start()
+
+    def _resume_loop(self, run: Callable[[], None], interval_s: float) -> None:
+        while not self._draining:
+            try:
+                run()
+            except Exception as e:
+                log_error("lifecycle resume error:", e)
+            with self._cond:
+                self._cond.wait_for(lambda: self._draining, timeout=interval_s)
+
+
+def _persist(rows: List[Dict[str, Any]]) -> None:
+    from .supabase_client import save_pending_updates
+    if save_pending_updates(rows):
+        return
+    # Không có Supabase → spool ra file cục bộ (VM / restart cùng máy)
+    try:
+        old = []
+        if os.path.exists(SPOOL_PATH):
+            with open(SPOOL_PATH, "r", encoding="utf-8") as f:
+                old = json.load(f)
+        tmp = SPOOL_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(old + rows, f)
+        os.replace(tmp, SPOOL_PATH)
+    except Exception as e:
+        log_error("lifecycle spool error:", e)
+
+
+def _claim() -> List[Dict[str, Any]]:
+    from .supabase_client import claim_pending_updates
+    rows = claim_pending_updates()
+    try:
+        if os.path.exists(SPOOL_PATH):
+            tmp = SPOOL_PATH + ".claimed"
+            os.replace(SPOOL_PATH, tmp)  # rename atomically → chỉ 1 worker nhận
+            with open(tmp, "r", encoding="utf-8") as f:
+                rows += json.load(f)
+            os.unlink(tmp)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_error("lifecycle spool claim error:", e)
+    return rows
+
+
+lifecycle = Lifecycle()
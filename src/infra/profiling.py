@@ -0,0 +1,269 @@
+# src/infra/profiling.py — Profiling lấy mẫu theo yêu cầu cho pipeline webhook (bật/tắt không cần redeploy)
+#
+# - CPU: 1 phần `rate` lượt xử lý update được đánh dấu; thread lấy mẫu đọc stack của đúng các thread
+#   đó mỗi PROFILE_INTERVAL_MS (sys._current_frames) → đếm theo "collapsed stack" (flamegraph.pl,
+#   speedscope, inferno đọc trực tiếp).
+# - Bộ nhớ (alloc=1): tracemalloc chỉ chạy trong khoảng có lượt đang được lấy mẫu (tracemalloc làm chậm
+#   ~10x code Python thuần nên không bật thường trực); cuối khoảng chụp snapshot, cộng dồn top vị trí
+#   cấp phát còn sống rồi tắt. tracemalloc theo dõi MỌI thread → số liệu cấp phát là của cả process
+#   trong khoảng đó (gồm các lượt không được lấy mẫu chạy song song), không riêng lượt được chọn.
+# - Tắt (mặc định): mỗi lượt chỉ tốn 1 phép so sánh; file điều khiển được stat tối đa 1 lần/giây.
+#
+# Điều khiển dùng chung giữa các gunicorn worker qua PROFILE_DIR/control.json (ghi bởi /_admin/profile);
+# mỗi worker định kỳ đổ stack của mình ra PROFILE_DIR/stacks-<pid>.txt để báo cáo gộp được
+# (file của worker đã chết — gunicorn restart / max_requests — bị xoá khi gộp).
+import os
+import sys
+import json
+import time
+import random
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from .logging import log, log_error
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/thienco-profile")
+INTERVAL_S = max(0.001, float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0)
+DUMP_EVERY_S = 10.0
+MAX_DEPTH = 64
+ALLOC_FRAMES = 1
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        co = frame.f_code
+        parts.append(f"{frame.f_globals.get('__name__', '?')}:{co.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SampledProfiler:
+    def __init__(self, rate: float = 0.0, alloc: bool = False, control_dir: str = PROFILE_DIR):
+        self.rate = max(0.0, min(1.0, rate))
+        self.alloc = alloc
+        self.dir = control_dir
+        self.epoch = 0
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self._targets: Dict[int, int] = {}  # thread ident -> số lượt đang được profile
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._checked = 0.0
+        self._ctl_mtime = 0.0
+        self._dumped = 0.0
+        self._dirty = False
+        self._allocs: Counter = Counter()        # "file:line" -> bytes còn sống cuối các khoảng lấy mẫu
+        self._alloc_counts: Counter = Counter()
+        self._alloc_active = 0
+        self.samples = 0
+        self.profiled = 0
+
+    # ---------- điều khiển ----------
+    @property
+    def _ctl_path(self) -> str:
+        return os.path.join(self.dir, "control.json")
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < 1.0:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self._ctl_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._ctl_mtime:
+            return
+        self._ctl_mtime = mtime
+        try:
+            with open(self._ctl_path, "r", encoding="utf-8") as f:
+                ctl = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._apply(float(ctl.get("rate", 0)), bool(ctl.get("alloc")), int(ctl.get("epoch", 0)))
+
+    def _apply(self, rate: float, alloc: bool, epoch: int) -> None:
+        if epoch != self.epoch:
+            with self._lock:
+                self._stacks.clear()
+                self._allocs.clear()
+                self._alloc_counts.clear()
+                self.samples = self.profiled = 0
+            self.epoch = epoch
+        self.rate = max(0.0, min(1.0, rate))
+        self.alloc = alloc
+        log("profiler:", {"rate": self.rate, "alloc": self.alloc, "epoch": self.epoch})
+
+    def configure(self, rate: float, alloc: bool = False, reset: bool = False) -> Dict[str, Any]:
+        """Áp dụng ngay cho worker này + ghi control.json để các worker khác nhận trong ≤1s."""
+        epoch = self.epoch + 1 if reset else self.epoch
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self._ctl_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"rate": rate, "alloc": alloc, "epoch": epoch}, f)
+        os.replace(tmp, self._ctl_path)
+        if reset:
+            for name in os.listdir(self.dir):
+                if name.startswith("stacks-"):
+                    try:
+                        os.remove(os.path.join(self.dir, name))
+                    except OSError:
+                        pass
+        self._apply(rate, alloc, epoch)
+        self._ctl_mtime = os.stat(self._ctl_path).st_mtime
+        return self.status()
+
+    # ---------- lấy mẫu ----------
+    @contextmanager
+    def sample(self):
+        """Bọc 1 lượt xử lý; chỉ 1 phần `rate` lượt thực sự được lấy mẫu."""
+        self._refresh()
+        ident = None
+        alloc = False
+        if self.rate > 0 and random.random() < self.rate:
+            ident = threading.get_ident()
+            alloc = self.alloc
+            with self._lock:
+                self._targets[ident] = self._targets.get(ident, 0) + 1
+                self.profiled += 1
+                if alloc:
+                    if self._alloc_active == 0 and not tracemalloc.is_tracing():
+                        tracemalloc.start(ALLOC_FRAMES)
+                    self._alloc_active += 1
+            self._ensure_sampler()
+            self._wake.set()
+        try:
+            yield
+        finally:
+            if ident is not None:
+                collect = False
+                with self._lock:
+                    n = self._targets.get(ident, 1) - 1
+                    if n > 0:
+                        self._targets[ident] = n
+                    else:
+                        self._targets.pop(ident, None)
+                    if alloc:
+                        self._alloc_active -= 1
+                        collect = self._alloc_active == 0
+                if collect:
+                    self._collect_allocs()
+
+    def _collect_allocs(self) -> None:
+        # Lượt lấy mẫu alloc cuối cùng vừa xong → chụp, cộng dồn, tắt tracemalloc. Chụp snapshot toàn heap
+        # NGOÀI _lock (chậm): các lượt khác vào / ra sample() không phải chờ.
+        if not tracemalloc.is_tracing():
+            return
+        snap = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__)])
+        stats = snap.statistics("lineno")
+        with self._lock:
+            # Lượt mới bật alloc trong lúc chụp → để lượt đó chụp khi xong; đã có thread khác tắt → bỏ
+            if self._alloc_active or not tracemalloc.is_tracing():
+                return
+            tracemalloc.stop()
+            for st in stats:
+                where = str(st.traceback[0])
+                self._allocs[where] += st.size
+                self._alloc_counts[where] += st.count
+
+    def _ensure_sampler(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="profiler", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            with self._lock:
+                targets = list(self._targets)
+            if not targets:
+                if self._dirty:
+                    self._dump()
+                self._wake.wait(DUMP_EVERY_S)
+                self._wake.clear()
+                continue
+            time.sleep(INTERVAL_S)
+            frames = sys._current_frames()
+            stacks = [_collapse(frames[t]) for t in targets if t in frames]
+            with self._lock:
+                for s in stacks:
+                    self._stacks[s] += 1
+                self.samples += len(stacks)
+            self._dirty = True
+            if time.monotonic() - self._dumped >= DUMP_EVERY_S:
+                self._dump()
+
+    def _dump(self) -> None:
+        self._dumped = time.monotonic()
+        self._dirty = False
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            path = os.path.join(self.dir, f"stacks-{os.getpid()}.txt")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(self.collapsed(merge=False))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log_error("profiler dump error:", e)
+
+    # ---------- báo cáo ----------
+    def collapsed(self, merge: bool = True) -> str:
+        """Định dạng collapsed: 'a;b;c <count>' mỗi dòng. merge=True: gộp cả file của các worker khác."""
+        with self._lock:
+            total = Counter(self._stacks)
+        if merge and os.path.isdir(self.dir):
+            me = f"stacks-{os.getpid()}.txt"
+            for name in os.listdir(self.dir):
+                if not name.startswith("stacks-") or not name.endswith(".txt") or name == me:
+                    continue
+                pid = name[len("stacks-"):-len(".txt")]
+                if pid.isdigit() and not _pid_alive(int(pid)):
+                    try:
+                        os.remove(os.path.join(self.dir, name))
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    with open(os.path.join(self.dir, name), "r", encoding="utf-8") as f:
+                        for line in f:
+                            stack, _, n = line.rstrip("\n").rpartition(" ")
+                            if stack and n.isdigit():
+                                total[stack] += int(n)
+                except OSError:
+                    continue
+        return "".join(f"{s} {n}\n" for s, n in total.most_common())
+
+    def top_allocations(self, limit: int = 25) -> List[Dict[str, Any]]:
+        """
+        Top vị trí cấp phát (của worker này) còn sống cuối các khoảng lấy mẫu, cộng dồn.
+        Phạm vi cả process trong khoảng tracemalloc bật, không chỉ các lượt được lấy mẫu.
+        """
+        with self._lock:
+            top = self._allocs.most_common(limit)
+            return [{"where": w, "size_kb": round(b / 1024, 1), "count": self._alloc_counts[w]} for w, b in top]
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"pid": os.getpid(), "rate": self.rate, "alloc": self.alloc, "epoch": self.epoch,
+                    "profiled": self.profiled, "samples": self.samples, "stacks": len(self._stacks)}
+
+
+profiler = SampledProfiler(
+    rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0),
+    alloc=os.getenv("PROFILE_ALLOC", "0") == "1",
+)
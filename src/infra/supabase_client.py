@@ -1,5 +1,6 @@
 # src/infra/supabase_client.py
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+from .bots import update_key
 from .logging import log_error
 
 _client = None
@@ -60,3 +61,29 @@ def insert_message(row: Dict[str, Any]) -> None:
 
     except Exception as e:
         log_error(f"Supabase insert error: {e}")
+
+def save_pending_updates(updates: List[Dict[str, Any]]) -> bool:
+    """
+    Lưu body các update chưa xử lý xong (khi instance tắt) vào public.pending_updates.
+    Trả False nếu Supabase chưa sẵn sàng / lỗi → caller tự spool ra chỗ khác.
+    """
+    if _client is None or not updates:
+        return False
+    try:
+        rows = [{"update_id": update_key(u), "body": u} for u in updates if u.get("update_id") is not None]
+        _client.table("pending_updates").upsert(rows, on_conflict="update_id").execute()
+        return True
+    except Exception as e:
+        log_error(f"pending_updates save error: {e}")
+        return False
+
+def claim_pending_updates(limit: int = 100) -> List[Dict[str, Any]]:
+    """Nhận (và xoá) update instance trước để lại — RPC dùng SKIP LOCKED nên mỗi update chỉ 1 nơi nhận."""
+    if _client is None:
+        return []
+    try:
+        res = _client.rpc("claim_pending_updates", {"n": limit}).execute()
+        return [r["body"] for r in (res.data or []) if r.get("body")]
+    except Exception as e:
+        log_error(f"pending_updates claim error: {e}")
+        return []
@@ -1,21 +1,223 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Optional
 
 import httpx
-from .logging import log
+from . import fastjson, http_pool
+from .logging import log, log_error
+from .telegram_format import sanitize_markdown, split_message, unescape_markdown
 
-BASE = "https://api.telegram.org"
+# Cho phép trỏ sang Bot API server riêng / fake server khi test
+BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
 
-async def send_message(token: str, chat_id: int, text: str, parse_mode: str | None = None):
+# Giới hạn Telegram (xấp xỉ): ~30 msg/s toàn bot, ~1 msg/s mỗi chat, ~20 msg/phút mỗi group
+GLOBAL_RPS = 30.0
+CHAT_RPS = 1.0
+GROUP_RPM = 20.0
+MAX_SEND_ATTEMPTS = 3
+# Chỉ lỗi pha kết nối mới gửi lại; ValueError = body không phải JSON (502 của proxy…), tin chưa được nhận
+_RETRYABLE = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, ValueError)
+_JSON = {"Content-Type": "application/json"}
+
+
+class _Gcra:
+    """Token bucket dạng GCRA: chỉ lưu 'theoretical arrival time' → O(1), không cần timer."""
+    __slots__ = ("interval", "tau", "tat")
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1.0 / rate
+        self.tau = self.interval * max(0, burst - 1)
+        self.tat = 0.0
+
+    def earliest(self, now: float) -> float:
+        return max(now, self.tat - self.tau)
+
+    def commit(self, at: float) -> None:
+        self.tat = max(self.tat, at) + self.interval
+
+
+class SendScheduler:
+    """
+    Lịch gửi dùng chung cho mọi thread/event loop trong process:
+      - Bucket toàn cục (GLOBAL_RPS) + bucket theo chat (CHAT_RPS, group dùng GROUP_RPM).
+      - `reserve(chat_id)` chiếm slot (trả 0) hoặc trả số giây cần chờ → caller tự sleep rồi gọi lại, không giữ lock.
+      - `penalize(chat_id, retry_after)` khi Telegram trả 429 → chặn chat (và toàn cục) tới hạn.
+    """
+
+    def __init__(self, global_rps: float = GLOBAL_RPS, chat_rps: float = CHAT_RPS, group_rpm: float = GROUP_RPM):
+        self._lock = threading.Lock()
+        self._global = _Gcra(global_rps, burst=int(global_rps))
+        self._chat_rps = chat_rps
+        self._group_rps = group_rpm / 60.0
+        self._chats: Dict[int, _Gcra] = {}
+        self._blocked: Dict[int, float] = {}
+        self._global_blocked = 0.0
+
+    def _bucket(self, chat_id: int) -> _Gcra:
+        b = self._chats.get(chat_id)
+        if b is None:
+            # chat_id âm = group/channel → giới hạn theo phút chặt hơn
+            b = _Gcra(self._group_rps, burst=3) if chat_id < 0 else _Gcra(self._chat_rps, burst=3)
+            if len(self._chats) > 10000:
+                self._chats.clear()
+            self._chats[chat_id] = b
+        return b
+
+    def reserve(self, chat_id: int) -> float:
+        """
+        0 → đã chiếm slot, gửi ngay. >0 → chưa tới lượt: chờ bấy nhiêu giây rồi gọi lại.
+        Chưa tới lượt thì KHÔNG đặt trước slot tương lai: bucket GCRA chỉ có 1 mốc, đặt trước
+        (vd. chat đang bị 429 chặn 30s) sẽ đẩy lùi mọi chat khác theo.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cb = self._bucket(chat_id)
+            blocked = self._blocked.get(chat_id, 0.0)
+            if blocked and blocked <= now:
+                del self._blocked[chat_id]  # hết hạn chặn → bỏ, dict không phình theo số chat từng bị 429
+            at = max(
+                self._global.earliest(now),
+                cb.earliest(now),
+                blocked,
+                self._global_blocked,
+            )
+            if at > now:
+                return at - now
+            self._global.commit(now)
+            cb.commit(now)
+        return 0.0
+
+    def penalize(self, chat_id: int, retry_after: float, global_scope: bool = False) -> None:
+        now = time.monotonic()
+        until = now + max(0.0, retry_after)
+        with self._lock:
+            if len(self._blocked) > 1000:
+                self._blocked = {c: t for c, t in self._blocked.items() if t > now}
+            self._blocked[chat_id] = max(self._blocked.get(chat_id, 0.0), until)
+            if global_scope:
+                self._global_blocked = max(self._global_blocked, until)
+
+
+# Giới hạn của Telegram tính theo từng bot → mỗi token 1 lịch gửi riêng (multi-bot trong 1 process)
+_schedulers: Dict[str, SendScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(token: str) -> SendScheduler:
+    s = _schedulers.get(token)
+    if s is None:
+        with _schedulers_lock:
+            s = _schedulers.setdefault(token, SendScheduler())
+    return s
+
+
+def _client(token: str) -> httpx.AsyncClient:
+    """Client dùng chung của bot (theo token) trên event loop hiện tại — giữ kết nối tới Bot API."""
+    return http_pool.get_client(f"telegram:{token}", timeout=20.0)
+
+
+async def send_message(token: str, chat_id: int, text: str, parse_mode: str | None = None,
+                       client: Optional[httpx.AsyncClient] = None):
     url = f"{BASE}/bot{token}/sendMessage"
     payload = {"chat_id": chat_id, "text": text}
     if parse_mode:
         payload["parse_mode"] = parse_mode
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        r = await client.post(url, json=payload)
-        log("telegram sendMessage status:", r.status_code)
-        if r.status_code != 200:
-            log("telegram error:", r.text)
-        return r.json()
+    r = await (client or _client(token)).post(url, content=fastjson.dumps(payload), headers=_JSON)
+    log("telegram sendMessage status:", r.status_code)
+    if r.status_code != 200:
+        log("telegram error:", r.text)
+    return fastjson.loads(r.content)
+
+
+async def _send_chunk(client: httpx.AsyncClient, token: str, chat_id: int, text: str,
+                      parse_mode: Optional[str]) -> bool:
+    scheduler = get_scheduler(token)
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        while True:
+            delay = scheduler.reserve(chat_id)
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        try:
+            data = await send_message(token, chat_id, text, parse_mode=parse_mode, client=client)
+        except _RETRYABLE as e:
+            # Lỗi trước khi request rời máy (chưa kết nối được / chờ pool) → gửi lại không sợ trùng
+            log_error("telegram send error:", e)
+            await asyncio.sleep(0.5 * (2 ** attempt))
+            continue
+        except httpx.HTTPError as e:
+            # Đã gửi rồi mới lỗi (ReadTimeout…): Telegram có thể đã nhận → không gửi lại, tránh tin lặp
+            log_error("telegram send error (not retried):", e)
+            return False
+        if data.get("ok"):
+            return True
+        code = data.get("error_code")
+        desc = str(data.get("description", "")).lower()
+        if code == 429:
+            retry_after = float((data.get("parameters") or {}).get("retry_after", 1))
+            # 429 kèm retry_after lớn thường là flood toàn bot → chặn cả bucket toàn cục
+            scheduler.penalize(chat_id, retry_after, global_scope=retry_after > 5)
+            continue
+        if code == 400 and parse_mode and "parse" in desc:
+            # Phòng hờ: sanitize cục bộ bỏ sót → gửi dạng thường cho riêng phần này (bỏ escape đã thêm)
+            parse_mode = None
+            text = unescape_markdown(text)
+            continue
+        log_error("telegram send failed:", code, desc)
+        return False
+    return False
+
+
+async def send_text(token: str, chat_id: int, text: str, parse_mode: Optional[str] = "Markdown") -> bool:
+    """
+    Đường gửi duy nhất ra Telegram: cắt tin > 4096 theo đoạn, chuẩn hoá Markdown cục bộ,
+    xếp lịch theo giới hạn toàn cục/theo chat và tự lùi theo `retry_after` khi bị 429.
+    """
+    if not token:
+        log_error("telegram send skipped: missing token")
+        return False
+    ok = True
+    # Sanitize cả tin TRƯỚC khi cắt: escape làm tin dài thêm, và cắt phải biết entity nằm đâu
+    if parse_mode == "Markdown":
+        parts = split_message(sanitize_markdown(text), markdown=True)
+    else:
+        parts = split_message(text)
+    client = _client(token)
+    for part in parts:
+        ok = await _send_chunk(client, token, chat_id, part, parse_mode) and ok
+    return ok
+
+
+def send_text_sync(token: str, chat_id: int, text: str, parse_mode: Optional[str] = None) -> bool:
+    """Bản đồng bộ cho code chạy ngoài event loop (vd. before_request của Flask)."""
+    return http_pool.run(send_text(token, chat_id, text, parse_mode=parse_mode))
+
+
 async def send_typing(token: str, chat_id: int):
     url = f"{BASE}/bot{token}/sendChatAction"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        await client.post(url, json={"chat_id": chat_id, "action": "typing"})
+    await _client(token).post(url, json={"chat_id": chat_id, "action": "typing"}, timeout=10.0)
+
+
+async def get_updates(client: httpx.AsyncClient, token: str, offset: int, limit: int = 100,
+                      timeout: int = 50, allowed_updates: Optional[list] = None) -> list:
+    """Long-poll getUpdates; trả list update (rỗng nếu hết timeout mà không có gì)."""
+    url = f"{BASE}/bot{token}/getUpdates"
+    payload = {"offset": offset, "limit": limit, "timeout": timeout}
+    if allowed_updates is not None:
+        payload["allowed_updates"] = allowed_updates
+    r = await client.post(url, content=fastjson.dumps(payload), headers=_JSON)
+    data = fastjson.loads(r.content)
+    if not data.get("ok"):
+        if data.get("error_code") == 429:
+            await asyncio.sleep(float((data.get("parameters") or {}).get("retry_after", 1)))
+            return []
+        raise RuntimeError(f"getUpdates error: {data.get('error_code')} {data.get('description')}")
+    return data.get("result") or []
+
+
+async def delete_webhook(client: httpx.AsyncClient, token: str) -> None:
+    """getUpdates không chạy khi bot còn webhook → gỡ webhook (giữ lại update đang chờ)."""
+    r = await client.post(f"{BASE}/bot{token}/deleteWebhook", json={"drop_pending_updates": False})
+    log("telegram deleteWebhook status:", r.status_code)
@@ -0,0 +1,138 @@
+# src/infra/telegram_format.py — Chuẩn hoá Markdown (legacy) & cắt tin dài cho Telegram
+from typing import List, Optional, Tuple
+
+MAX_MESSAGE_LEN = 4096  # giới hạn ký tự của sendMessage
+
+_SPECIAL = "*_`["
+
+
+def escape_markdown(text: str) -> str:
+    """Escape toàn bộ ký tự đặc biệt của Markdown legacy (dùng cho nội dung thô)."""
+    out = []
+    for ch in text or "":
+        if ch in _SPECIAL:
+            out.append("\\")
+        out.append(ch)
+    return "".join(out)
+
+
+def unescape_markdown(text: str) -> str:
+    """Bỏ các escape `\\*` `\\_`… do sanitize_markdown thêm vào (để gửi lại dạng thường, không có parse_mode)."""
+    out = []
+    i, n = 0, len(text or "")
+    while i < n:
+        if text[i] == "\\" and i + 1 < n and text[i + 1] in _SPECIAL:
+            i += 1
+        out.append(text[i])
+        i += 1
+    return "".join(out)
+
+
+def _entity_end(text: str, i: int) -> int:
+    """
+    Trả vị trí ngay sau entity bắt đầu tại i (Markdown legacy, không lồng nhau),
+    hoặc -1 nếu entity không đóng → Telegram sẽ báo "can't parse entities".
+    """
+    ch = text[i]
+    if text.startswith("```", i):
+        j = text.find("```", i + 3)
+        return j + 3 if j != -1 else -1
+    if ch in "*_`":
+        j = text.find(ch, i + 1)
+        return j + 1 if j != -1 else -1
+    if ch == "[":
+        j = text.find("]", i + 1)
+        if j == -1 or not text.startswith("(", j + 1):
+            return -1
+        k = text.find(")", j + 2)
+        return k + 1 if k != -1 else -1
+    return -1
+
+
+def _span_at(text: str, pos: int) -> Optional[Tuple[int, int]]:
+    """(start, end) của entity / cặp escape chứa vị trí cắt `pos` (start < pos < end) trong text đã sanitize."""
+    i, n = 0, len(text)
+    while i < n and i < pos:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n and text[i + 1] in _SPECIAL:
+            end = i + 2
+        elif ch in _SPECIAL:
+            end = _entity_end(text, i)
+            if end == -1:  # không xảy ra sau sanitize; coi như ký tự thường
+                end = i + 1
+        else:
+            i += 1
+            continue
+        if end > pos:
+            return i, end
+        i = end
+    return None
+
+
+def sanitize_markdown(text: str) -> str:
+    """
+    Kiểm tra Markdown legacy cục bộ: giữ nguyên entity hợp lệ, escape ký tự mở
+    entity không có cặp đóng. Tránh phải gửi lại lần 2 dạng plain khi LLM
+    sinh markup hỏng (vd. dấu * lẻ, snake_case, link thiếu ngoặc).
+    """
+    text = text or ""
+    out = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n and text[i + 1] in _SPECIAL:
+            out.append(text[i:i + 2])
+            i += 2
+            continue
+        if ch in _SPECIAL:
+            end = _entity_end(text, i)
+            if end == -1:
+                out.append("\\" + ch)
+                i += 1
+                continue
+            out.append(text[i:end])
+            i = end
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _cut_point(text: str, limit: int) -> int:
+    """Chọn điểm cắt ≤ limit: ưu tiên ranh giới đoạn, rồi dòng, rồi khoảng trắng."""
+    for sep in ("\n\n", "\n", " "):
+        j = text.rfind(sep, 0, limit)
+        if j > limit // 2:
+            return j + len(sep)
+    return limit
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LEN, markdown: bool = False) -> List[str]:
+    """
+    Cắt tin dài theo đoạn (paragraph) để mỗi phần ≤ limit ký tự.
+    markdown=True: `text` đã qua sanitize_markdown — không cắt giữa entity / cặp escape; entity dài
+    hơn cả 1 phần (khối code, đoạn in đậm dài) được đóng ở cuối phần này và mở lại ở phần sau.
+    """
+    text = (text or "").strip()
+    parts: List[str] = []
+    reserve = 4 if markdown else 0  # chỗ cho dấu đóng "\n```" thêm vào cuối phần
+    while len(text) > limit:
+        cut = _cut_point(text, limit - reserve)
+        close = reopen = ""
+        span = _span_at(text, cut) if markdown else None
+        if span is not None:
+            start, _ = span
+            if start > limit // 4:
+                cut = start  # lùi về trước entity
+            elif text.startswith("```", start):
+                close, reopen = "\n```", "```\n"
+            elif text[start] in "*_`":
+                close = reopen = text[start]
+            # link quá dài: cắt cứng (Telegram báo lỗi parse → _send_chunk gửi dạng thường phần đó)
+        head = text[:cut].strip()
+        if head:
+            parts.append(head + close)
+        text = reopen + text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
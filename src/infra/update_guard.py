@@ -0,0 +1,57 @@
+# src/infra/update_guard.py — Kiểm tra nhẹ trước pipeline, dùng chung cho webhook (app.py) và poller
+#
+# Cùng 1 bộ luật cho mọi đường nhận update:
+#   - update không có chat / text (sticker, ảnh, join…) → bỏ qua, không gọi LLM
+#   - dedupe (bot, update_id) trong RAM
+#   - rate-limit theo chat (token bucket)
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+RATE_LIMIT_REPLY = "Nhiều tin nhắn quá 😅 đợi mình tí nhé…"
+
+_lock = threading.Lock()
+_seen = deque(maxlen=512)
+_buckets: Dict[Hashable, Dict[str, int]] = {}  # chat_key -> {t: last_ts, tok: tokens}
+
+
+def extract(update: Dict[str, Any]) -> Tuple[Optional[int], Optional[str]]:
+    """(chat_id, text) của message / edited_message; thiếu → None."""
+    msg = (update.get("message") or update.get("edited_message")) or {}
+    return (msg.get("chat") or {}).get("id"), msg.get("text")
+
+
+def is_seen(bot_key: str, update_id: Any) -> bool:
+    with _lock:
+        return (bot_key, update_id) in _seen
+
+
+def mark_seen(bot_key: str, update_id: Any) -> None:
+    with _lock:
+        _seen.append((bot_key, update_id))
+
+
+def forget(bot_key: str, update_id: Any) -> None:
+    """Handler lỗi (500): bỏ dấu đã thấy để lần Telegram gửi lại được xử lý."""
+    with _lock:
+        try:
+            _seen.remove((bot_key, update_id))
+        except ValueError:
+            pass
+
+
+def allow_chat(key: Hashable, limit: int = 12, refill: int = 12, window: int = 60) -> bool:
+    """Token bucket đơn giản: limit token / window giây (refill đều)."""
+    now = int(time.time())
+    with _lock:
+        q = _buckets.get(key) or {"t": now, "tok": limit}
+        elapsed = now - q["t"]
+        if elapsed > 0:
+            q["tok"] = min(limit, q["tok"] + int(elapsed * (refill / window)))
+            q["t"] = now
+        _buckets[key] = q
+        if q["tok"] > 0:
+            q["tok"] -= 1
+            return True
+        return False
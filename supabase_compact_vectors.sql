@@ -0,0 +1,71 @@
+-- supabase_compact_vectors.sql — Lưu vector gọn (halfvec) + tìm kiếm 2 pha (ANN lượng tử hoá → rerank chính xác)
+-- Yêu cầu pgvector >= 0.7.0 (halfvec, binary_quantize). Chạy SAU supabase_memory_schema.sql.
+-- Bật phía app: EMBED_STORAGE=halfvec
+--
+-- Kích thước / vector 384d:  vector = 1536 B | halfvec = 768 B | bit(384) (chỉ trong index) = 48 B
+
+-- ========== 1) Cột halfvec + backfill ==========
+alter table public.memory_vectors add column if not exists embedding_h halfvec(384);
+alter table public.memory_vectors alter column embedding drop not null;
+
+update public.memory_vectors
+   set embedding_h = embedding::halfvec(384)
+ where embedding_h is null and embedding is not null;
+
+-- ========== 2) Index ==========
+-- Pha 1 (ANN nhanh): HNSW trên binary quantization của halfvec (hamming, 48 B/vector)
+create index if not exists idx_memory_vectors_bq
+  on public.memory_vectors using hnsw ((binary_quantize(embedding_h)::bit(384)) bit_hamming_ops);
+
+-- (tuỳ chọn) Sau khi app đã ghi embedding_h ổn định: bỏ cột/index full precision để giảm I/O
+-- drop index if exists public.idx_memory_vectors_ivf;
+-- update public.memory_vectors set embedding = null where embedding_h is not null;
+-- vacuum full public.memory_vectors;
+
+-- ========== 3) RPC: memory_search_compact(u text, q halfvec(384), k int, c int) ==========
+-- c = số ứng viên của pha 1 (mặc định 8*k); pha 2 rerank chính xác bằng cosine trên halfvec.
+-- Index HNSW là index chung mọi user → `where user_id = u` lọc SAU khi duyệt ef_search ứng viên:
+-- user ít memory trong bảng lớn có thể nhận < k dòng (hoặc 0). pgvector >= 0.8: mục 4 bật
+-- hnsw.iterative_scan = relaxed_order (duyệt tiếp tới khi đủ dòng sau lọc; thứ tự lệch nhẹ không sao
+-- vì pha 2 sắp lại chính xác). pgvector 0.7: GIỚI HẠN còn nguyên — đo bằng scripts/bench_retrieval.py,
+-- thiếu dòng thì dùng memory_search (vector đầy đủ, không qua index bit) cho user đó.
+drop function if exists public.memory_search_compact(text, halfvec(384), int, int);
+create or replace function public.memory_search_compact(u text, q halfvec(384), k int, c int default 0)
+returns table (
+  ref_type text,
+  ref_id   uuid,
+  content  text,
+  score    double precision
+) language sql stable
+set hnsw.ef_search = 200
+as $$
+  with cand as (
+    select id
+    from public.memory_vectors
+    where user_id = u and embedding_h is not null
+    order by binary_quantize(embedding_h)::bit(384) <~> binary_quantize(q)
+    limit coalesce(nullif(c, 0), k * 8)
+  )
+  select v.ref_type, v.ref_id, v.content,
+         1 - (v.embedding_h <=> q) as score
+  from public.memory_vectors v
+  join cand using (id)
+  order by v.embedding_h <=> q
+  limit k
+$$;
+
+-- ========== 4) Iterative scan (pgvector >= 0.8) ==========
+-- Đặt qua ALTER FUNCTION trong DO: trên 0.7 tham số hnsw.iterative_scan không tồn tại (SET ở
+-- create function sẽ lỗi). supabase_memory_mmr.sql / supabase_memory_hybrid.sql làm tương tự.
+do $$
+begin
+  if (select string_to_array(split_part(extversion, '-', 1), '.')::int[] >= array[0, 8]
+        from pg_extension where extname = 'vector') then
+    alter function public.memory_search_compact(text, halfvec(384), int, int) set hnsw.iterative_scan = relaxed_order;
+  else
+    raise notice 'pgvector < 0.8: memory_search_compact có thể trả < k dòng cho user ít memory (xem mục 3)';
+  end if;
+end $$;
+
+notify pgrst, 'reload schema';
+analyze public.memory_vectors;
@@ -0,0 +1,53 @@
+-- supabase_llm_usage.sql — Rollup usage LLM theo phút × chat × model (ghi theo lô từ src/core/usage.py)
+-- Mỗi worker gộp trong RAM rồi gọi usage_rollup(rows) ~1 lần/phút → không có ghi DB theo từng tin.
+
+create table if not exists public.llm_usage_minute (
+  minute            timestamptz not null,
+  chat_id           bigint      not null,
+  model             text        not null,
+  calls             int         not null default 0,
+  prompt_tokens     bigint      not null default 0,
+  completion_tokens bigint      not null default 0,
+  cached_tokens     bigint      not null default 0,
+  cost_usd          numeric(14,8) not null default 0,
+  latency_ms_sum    bigint      not null default 0,
+  latency_ms_max    int         not null default 0,
+  primary key (minute, chat_id, model)
+);
+
+create index if not exists idx_llm_usage_chat_minute on public.llm_usage_minute (chat_id, minute);
+
+-- Upsert cộng dồn (nhiều worker cùng flush 1 phút → cộng, không ghi đè)
+drop function if exists public.usage_rollup(jsonb);
+create or replace function public.usage_rollup(rows jsonb)
+returns void language sql as $$
+  insert into public.llm_usage_minute as t
+    (minute, chat_id, model, calls, prompt_tokens, completion_tokens, cached_tokens,
+     cost_usd, latency_ms_sum, latency_ms_max)
+  select r.minute, r.chat_id, r.model, r.calls, r.prompt_tokens, r.completion_tokens, r.cached_tokens,
+         r.cost_usd, r.latency_ms_sum, r.latency_ms_max
+  from jsonb_to_recordset(rows) as r(
+    minute timestamptz, chat_id bigint, model text, calls int, prompt_tokens bigint,
+    completion_tokens bigint, cached_tokens bigint, cost_usd numeric, latency_ms_sum bigint,
+    latency_ms_max int)
+  on conflict (minute, chat_id, model) do update set
+    calls             = t.calls + excluded.calls,
+    prompt_tokens     = t.prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = t.completion_tokens + excluded.completion_tokens,
+    cached_tokens     = t.cached_tokens + excluded.cached_tokens,
+    cost_usd          = t.cost_usd + excluded.cost_usd,
+    latency_ms_sum    = t.latency_ms_sum + excluded.latency_ms_sum,
+    latency_ms_max    = greatest(t.latency_ms_max, excluded.latency_ms_max)
+$$;
+
+-- Tổng token hôm nay của 1 chat (ngày theo múi giờ tz) — mốc ban đầu cho hạn mức/ngày
+drop function if exists public.usage_today(bigint, text);
+create or replace function public.usage_today(c bigint, tz text default 'Asia/Ho_Chi_Minh')
+returns bigint language sql stable as $$
+  select coalesce(sum(prompt_tokens + completion_tokens), 0)::bigint
+  from public.llm_usage_minute
+  where chat_id = c
+    and minute >= (date_trunc('day', now() at time zone tz) at time zone tz)
+$$;
+
+notify pgrst, 'reload schema';
@@ -0,0 +1,45 @@
+-- supabase_memory_dedupe.sql — Gộp ký ức gần trùng (dedupe-on-write + compaction)
+-- Chạy SAU supabase_memory_schema.sql.
+
+-- ========== 1) Cột đếm / thời điểm cập nhật ==========
+alter table public.memory_vectors add column if not exists meta jsonb not null default '{}'::jsonb;
+alter table public.memory_vectors add column if not exists updated_at timestamptz default now();
+create index if not exists idx_memory_vectors_ref on public.memory_vectors(ref_type, ref_id);
+-- Lần cuối fact được nhắc lại (merge); created_at giữ nguyên = lần đầu ghi nhận
+alter table public.memory_facts add column if not exists last_seen_at timestamptz;
+
+-- ========== 2) RPC: memory_merge(rt text, rid uuid, w float) ==========
+-- Tăng count/weight của ký ức đã có thay vì chèn bản sao (atomic, không read-modify-write ở app).
+drop function if exists public.memory_merge(text, uuid, double precision);
+create or replace function public.memory_merge(rt text, rid uuid, w double precision default 1.0)
+returns int language plpgsql as $$
+declare n int;
+begin
+  update public.memory_vectors
+     set meta = meta
+              || jsonb_build_object('count', coalesce((meta->>'count')::int, 1) + 1)
+              || jsonb_build_object('weight', coalesce((meta->>'weight')::float, 1.0) + w),
+         updated_at = now()
+   where ref_type = rt and ref_id = rid;
+  get diagnostics n = row_count;
+
+  if rt = 'fact' then
+    update public.memory_facts
+       set meta = coalesce(meta, '{}'::jsonb)
+                || jsonb_build_object('count', coalesce((meta->>'count')::int, 1) + 1)
+                || jsonb_build_object('weight', coalesce((meta->>'weight')::float, 1.0) + w),
+           last_seen_at = now()
+     where id = rid;
+  end if;
+  return n;
+end
+$$;
+
+-- ========== 3) RPC: memory_users() — danh sách user cho job compaction ==========
+drop function if exists public.memory_users();
+create or replace function public.memory_users()
+returns table (user_id text, n bigint) language sql stable as $$
+  select user_id, count(*) from public.memory_vectors group by user_id order by 2 desc
+$$;
+
+notify pgrst, 'reload schema';
@@ -0,0 +1,194 @@
+-- supabase_memory_hybrid.sql — Truy xuất lai: từ vựng (FTS + trigram, bỏ dấu tiếng Việt) ⊕ vector bằng RRF
+-- Chạy SAU supabase_memory_schema.sql (+ supabase_memory_mmr.sql; supabase_compact_vectors.sql nếu dùng halfvec).
+-- Bật phía app: MEMORY_HYBRID=1
+--
+-- BGE-small (model tiếng Anh) khớp kém tên riêng / địa danh / mã sản phẩm tiếng Việt ("Dũng", "trà đá").
+--   memory_search_lexical : chỉ từ vựng, KHÔNG cần embedding câu hỏi → app trả luôn nếu khớp đủ mạnh
+--                           (fast path; trả kèm embedding ký ức để vẫn chạy MMR)
+--   memory_search_hybrid  : 1 RPC gộp top-n vector + top-n từ vựng bằng Reciprocal Rank Fusion,
+--                           trả kèm embedding để app chạy MMR như memory_search_candidates
+-- App gửi `qf` = các từ đã bỏ dấu, cách nhau 1 khoảng trắng (core.context.lexical_terms).
+
+-- ========== 0) Extensions ==========
+create extension if not exists "pg_trgm";
+create extension if not exists "unaccent";
+create extension if not exists "btree_gin";
+
+-- ========== 1) Chuẩn hoá tiếng Việt: chữ thường + bỏ dấu ('Dũng' → 'dung', 'Đà Nẵng' → 'da nang') ==========
+-- unaccent() chỉ là STABLE → bọc IMMUTABLE (chỉ định rõ dictionary) để dùng được trong cột generated / index.
+create or replace function public.vi_fold(t text)
+returns text language sql immutable strict parallel safe
+set search_path = public, extensions, pg_catalog
+as $$
+  select replace(lower(unaccent('unaccent'::regdictionary, t)), 'đ', 'd')
+$$;
+
+-- ========== 2) Cột chuẩn hoá + index (generated → luôn khớp content, kể cả dòng cũ) ==========
+-- Lưu ý: ADD COLUMN ... GENERATED STORED viết lại bảng (khoá ghi) — chạy ngoài giờ cao điểm.
+alter table public.memory_vectors
+  add column if not exists content_fold text
+  generated always as (public.vi_fold(content)) stored;
+alter table public.memory_vectors
+  add column if not exists content_tsv tsvector
+  generated always as (to_tsvector('simple', public.vi_fold(content))) stored;
+
+-- btree_gin: lọc user_id và khớp từ trong cùng 1 index GIN
+create index if not exists idx_memory_vectors_tsv
+  on public.memory_vectors using gin (user_id, content_tsv);
+create index if not exists idx_memory_vectors_trgm
+  on public.memory_vectors using gin (user_id, content_fold gin_trgm_ops);
+
+-- ========== 3) Hạng từ vựng (dùng chung cho 2 RPC) ==========
+-- Khớp: bất kỳ từ nào của qf (tsquery OR) hoặc gần đúng theo trigram (sai chính tả / mã sản phẩm viết khác).
+-- lex_score ∈ [0, 1]: max(ts_rank_cd chuẩn hoá rank/(rank+1), word_similarity).
+drop function if exists public.memory_lexical(text, text, int);
+create or replace function public.memory_lexical(u text, qf text, n int)
+returns table (id uuid, lex_score double precision, lex_rank bigint)
+language sql stable as $$
+  with q as (
+    select public.vi_fold(coalesce(qf, '')) as f,
+           -- plainto_tsquery tách từ an toàn (không lỗi cú pháp) → đổi AND thành OR
+           replace(plainto_tsquery('simple', public.vi_fold(coalesce(qf, '')))::text, '&', '|')::tsquery as tq
+  ), hit as (
+    select v.id,
+           greatest(coalesce(ts_rank_cd(v.content_tsv, q.tq, 32), 0),
+                    word_similarity(q.f, v.content_fold))::double precision as lex_score
+    from public.memory_vectors v, q
+    where v.user_id = u
+      and q.f <> ''
+      and (v.content_tsv @@ q.tq or q.f <% v.content_fold)
+  )
+  select id, lex_score, row_number() over (order by lex_score desc, id) as lex_rank
+  from hit
+  order by lex_score desc, id
+  limit n
+$$;
+
+-- ========== 4) RPC: memory_search_lexical(u text, qf text, k int) — fast path không embedding câu hỏi ==========
+-- score = lex_score (app so với MEMORY_LEXICAL_MIN_SCORE); embedding để MMR theo độ liên quan từ vựng.
+drop function if exists public.memory_search_lexical(text, text, int);
+create or replace function public.memory_search_lexical(u text, qf text, k int)
+returns table (
+  ref_type  text,
+  ref_id    uuid,
+  content   text,
+  score     double precision,
+  embedding vector(384)
+) language sql stable as $$
+  select v.ref_type, v.ref_id, v.content, l.lex_score as score, v.embedding
+  from public.memory_lexical(u, qf, k) l
+  join public.memory_vectors v on v.id = l.id
+  where v.embedding is not null
+  order by l.lex_rank
+$$;
+
+drop function if exists public.memory_search_lexical_compact(text, text, int);
+create or replace function public.memory_search_lexical_compact(u text, qf text, k int)
+returns table (
+  ref_type  text,
+  ref_id    uuid,
+  content   text,
+  score     double precision,
+  embedding halfvec(384)
+) language sql stable as $$
+  select v.ref_type, v.ref_id, v.content, l.lex_score as score, v.embedding_h
+  from public.memory_lexical(u, qf, k) l
+  join public.memory_vectors v on v.id = l.id
+  where v.embedding_h is not null
+  order by l.lex_rank
+$$;
+
+-- ========== 5) RPC: memory_search_hybrid(u text, q vector(384), qf text, n int, rrf_k int) ==========
+-- rrf = Σ 1/(rrf_k + rank) trên 2 danh sách; score = cosine thật (kể cả mục chỉ có ở nhánh từ vựng).
+drop function if exists public.memory_search_hybrid(text, vector(384), text, int, int);
+create or replace function public.memory_search_hybrid(u text, q vector(384), qf text, n int, rrf_k int default 60)
+returns table (
+  ref_type  text,
+  ref_id    uuid,
+  content   text,
+  score     double precision,
+  rrf       double precision,
+  lex_rank  bigint,
+  embedding vector(384)
+) language sql stable as $$
+  with vec as (
+    select id, row_number() over (order by embedding <=> q) as vec_rank
+    from (
+      select id, embedding
+      from public.memory_vectors
+      where user_id = u and embedding is not null
+      order by embedding <=> q
+      limit n
+    ) c
+  ), lex as (
+    select id, lex_rank from public.memory_lexical(u, qf, n)
+  ), fused as (
+    select coalesce(vec.id, lex.id) as id,
+           coalesce(1.0 / (rrf_k + vec.vec_rank), 0) + coalesce(1.0 / (rrf_k + lex.lex_rank), 0) as rrf,
+           lex.lex_rank
+    from vec full join lex on lex.id = vec.id
+  )
+  select v.ref_type, v.ref_id, v.content,
+         1 - (v.embedding <=> q) as score,
+         f.rrf::double precision, f.lex_rank, v.embedding
+  from fused f
+  join public.memory_vectors v on v.id = f.id
+  where v.embedding is not null
+  order by f.rrf desc
+  limit n
+$$;
+
+-- ========== 6) RPC: memory_search_hybrid_compact(...) — cùng RRF, nhánh vector theo halfvec 2 pha ==========
+drop function if exists public.memory_search_hybrid_compact(text, halfvec(384), text, int, int);
+create or replace function public.memory_search_hybrid_compact(u text, q halfvec(384), qf text, n int, rrf_k int default 60)
+returns table (
+  ref_type  text,
+  ref_id    uuid,
+  content   text,
+  score     double precision,
+  rrf       double precision,
+  lex_rank  bigint,
+  embedding halfvec(384)
+) language sql stable
+set hnsw.ef_search = 200
+as $$
+  with cand as (
+    select id, embedding_h
+    from public.memory_vectors
+    where user_id = u and embedding_h is not null
+    order by binary_quantize(embedding_h)::bit(384) <~> binary_quantize(q)
+    limit n * 4
+  ), vec as (
+    select id, row_number() over (order by embedding_h <=> q) as vec_rank
+    from (select id, embedding_h from cand order by embedding_h <=> q limit n) c
+  ), lex as (
+    select id, lex_rank from public.memory_lexical(u, qf, n)
+  ), fused as (
+    select coalesce(vec.id, lex.id) as id,
+           coalesce(1.0 / (rrf_k + vec.vec_rank), 0) + coalesce(1.0 / (rrf_k + lex.lex_rank), 0) as rrf,
+           lex.lex_rank
+    from vec full join lex on lex.id = vec.id
+  )
+  select v.ref_type, v.ref_id, v.content,
+         1 - (v.embedding_h <=> q) as score,
+         f.rrf::double precision, f.lex_rank, v.embedding_h
+  from fused f
+  join public.memory_vectors v on v.id = f.id
+  where v.embedding_h is not null
+  order by f.rrf desc
+  limit n
+$$;
+
+-- Lọc user_id sau HNSW chung → pgvector >= 0.8 bật iterative scan (xem supabase_compact_vectors.sql mục 4)
+do $$
+begin
+  if (select string_to_array(split_part(extversion, '-', 1), '.')::int[] >= array[0, 8]
+        from pg_extension where extname = 'vector') then
+    alter function public.memory_search_hybrid_compact(text, halfvec(384), text, int, int) set hnsw.iterative_scan = relaxed_order;
+  else
+    raise notice 'pgvector < 0.8: memory_search_hybrid_compact có thể trả ít ứng viên vector cho user ít memory';
+  end if;
+end $$;
+
+notify pgrst, 'reload schema';
+analyze public.memory_vectors;
@@ -0,0 +1,64 @@
+-- supabase_memory_mmr.sql — Ứng viên truy xuất KÈM embedding cho MMR phía app (core/context.py)
+-- Chạy SAU supabase_memory_schema.sql (và supabase_compact_vectors.sql nếu dùng EMBED_STORAGE=halfvec).
+-- App lấy n ứng viên (mặc định 4*k), tính 1 ma trận tương đồng rồi chọn k mục đa dạng.
+
+-- ========== 1) RPC: memory_search_candidates(u text, q vector(384), n int) ==========
+drop function if exists public.memory_search_candidates(text, vector(384), int);
+create or replace function public.memory_search_candidates(u text, q vector(384), n int)
+returns table (
+  ref_type  text,
+  ref_id    uuid,
+  content   text,
+  score     double precision,
+  embedding vector(384)
+) language sql stable as $$
+  select ref_type, ref_id, content,
+         1 - (embedding <=> q) as score,
+         embedding
+  from public.memory_vectors
+  where user_id = u and embedding is not null
+  order by embedding <=> q
+  limit n
+$$;
+
+-- ========== 2) RPC: memory_search_candidates_compact(u text, q halfvec(384), n int) ==========
+-- Cùng 2 pha như memory_search_compact: ANN trên binary quantization → rerank chính xác halfvec.
+drop function if exists public.memory_search_candidates_compact(text, halfvec(384), int);
+create or replace function public.memory_search_candidates_compact(u text, q halfvec(384), n int)
+returns table (
+  ref_type  text,
+  ref_id    uuid,
+  content   text,
+  score     double precision,
+  embedding halfvec(384)
+) language sql stable
+set hnsw.ef_search = 200
+as $$
+  with cand as (
+    select id
+    from public.memory_vectors
+    where user_id = u and embedding_h is not null
+    order by binary_quantize(embedding_h)::bit(384) <~> binary_quantize(q)
+    limit n * 4
+  )
+  select v.ref_type, v.ref_id, v.content,
+         1 - (v.embedding_h <=> q) as score,
+         v.embedding_h
+  from public.memory_vectors v
+  join cand using (id)
+  order by v.embedding_h <=> q
+  limit n
+$$;
+
+-- Lọc user_id sau HNSW chung → pgvector >= 0.8 bật iterative scan (xem supabase_compact_vectors.sql mục 4)
+do $$
+begin
+  if (select string_to_array(split_part(extversion, '-', 1), '.')::int[] >= array[0, 8]
+        from pg_extension where extname = 'vector') then
+    alter function public.memory_search_candidates_compact(text, halfvec(384), int) set hnsw.iterative_scan = relaxed_order;
+  else
+    raise notice 'pgvector < 0.8: memory_search_candidates_compact có thể trả < n cho user ít memory';
+  end if;
+end $$;
+
+notify pgrst, 'reload schema';
@@ -0,0 +1,274 @@
+-- supabase_messages_partitioning.sql — public.messages: index theo (chat_id, created_at), partition theo tháng, lưu trữ
+-- Chạy SAU supabase_memory_schema.sql. Idempotent: chạy lại không tạo trùng / không copy lại dữ liệu.
+--
+-- Sau migration:
+--   * "N lượt gần nhất của chat" = index scan ngược trên (chat_id, created_at desc) của 1–2 partition mới nhất
+--     → không phụ thuộc tổng lịch sử.
+--   * Partition cũ (đã tóm tắt vào conv_summaries) được gói vào messages_archive (1 dòng jsonb nén / chat / tháng)
+--     rồi detach + drop → bảng nóng chỉ còn vài tháng gần nhất.
+-- Lịch chạy: pg_cron (nếu bật) hoặc scripts/archive_messages.py hằng ngày.
+
+-- ========== 1) Đổi bảng cũ thành messages_legacy (1 lần) ==========
+do $$
+begin
+  if exists (select 1 from pg_class c join pg_namespace n on n.oid = c.relnamespace
+             where n.nspname = 'public' and c.relname = 'messages' and c.relkind = 'r') then
+    alter table public.messages rename to messages_legacy;
+    alter index if exists public.idx_messages_user_id rename to idx_messages_legacy_user_id;
+    alter index if exists public.idx_messages_chat_id rename to idx_messages_legacy_chat_id;
+  end if;
+end $$;
+
+-- ========== 2) Bảng partition theo tháng (cùng cột → insert_message không đổi) ==========
+create sequence if not exists public.messages_id_seq_p;
+
+create table if not exists public.messages (
+  id          bigint not null default nextval('public.messages_id_seq_p'),
+  user_id     bigint not null,
+  chat_id     bigint not null default 0,
+  role        text not null check (role in ('user','assistant','system')),
+  content     text not null,
+  created_at  timestamptz not null default now(),
+  primary key (id, created_at)          -- khoá của bảng partition phải chứa cột partition
+) partition by range (created_at);
+
+alter sequence public.messages_id_seq_p owned by public.messages.id;
+
+-- Đọc lịch sử gần nhất theo chat / theo user. Không INCLUDE content: btree giới hạn ~2.7KB/tuple,
+-- tin dài sẽ làm insert lỗi; heap fetch cho N dòng cuối là rẻ.
+create index if not exists idx_messages_chat_created on public.messages (chat_id, created_at desc) include (role);
+create index if not exists idx_messages_user_created on public.messages (user_id, created_at desc);
+
+-- Lưới an toàn: tin rơi ngoài các partition đã tạo (nên luôn rỗng nếu ensure_partitions chạy đều)
+create table if not exists public.messages_default partition of public.messages default;
+
+-- ========== 3) RPC: messages_ensure_partitions(from_month, months_ahead) ==========
+-- Tạo partition từ from_month (mặc định tháng này) tới months_ahead tháng tới, cộng mọi tháng đang có
+-- dòng nằm trong messages_default (cron trễ / tắt). CREATE ... PARTITION OF sẽ lỗi nếu default đã chứa
+-- dòng của tháng đó → tạo bảng rời, chuyển dòng khỏi default rồi mới ATTACH (cùng 1 transaction).
+drop function if exists public.messages_ensure_partitions(date, int);
+create or replace function public.messages_ensure_partitions(from_month date default null, months_ahead int default 3)
+returns int language plpgsql as $$
+declare
+  start  date := date_trunc('month', coalesce(from_month, now()::date))::date;
+  upto   date := (date_trunc('month', now()) + make_interval(months => months_ahead))::date;
+  m      date;
+  hi     date;
+  part   text;
+  moved  bigint;
+  remain bigint;
+  n      int := 0;
+begin
+  for m in
+    select g::date from generate_series(start, upto, interval '1 month') g
+    union
+    select distinct date_trunc('month', d.created_at)::date from public.messages_default d
+    order by 1
+  loop
+    part := format('messages_y%sm%s', to_char(m, 'YYYY'), to_char(m, 'MM'));
+    continue when to_regclass('public.' || part) is not null;
+    hi := (m + interval '1 month')::date;
+    if exists (select 1 from public.messages_default d where d.created_at >= m and d.created_at < hi) then
+      -- Chặn ghi vào default trong lúc chuyển (insert của tháng này sẽ chờ tới khi ATTACH xong)
+      lock table public.messages_default in exclusive mode;
+      execute format('create table public.%I (like public.messages including defaults including constraints)', part);
+      execute format('with x as (delete from public.messages_default d where d.created_at >= %L and d.created_at < %L returning d.*) '
+                     'insert into public.%I select * from x', m, hi, part);
+      get diagnostics moved = row_count;
+      execute format('alter table public.messages attach partition public.%I for values from (%L) to (%L)', part, m, hi);
+      raise notice 'messages_ensure_partitions: moved % rows of % out of messages_default', moved, part;
+    else
+      execute format('create table public.%I partition of public.messages for values from (%L) to (%L)', part, m, hi);
+    end if;
+    n := n + 1;
+  end loop;
+
+  select count(*) into remain from public.messages_default;
+  if remain > 0 then
+    raise warning 'messages_default still holds % rows (created_at outside every month partition)', remain;
+  end if;
+  return n;
+end $$;
+
+-- ========== 4) Chuyển dữ liệu cũ (1 lần, nếu có messages_legacy) ==========
+do $$
+declare lo date;
+begin
+  if to_regclass('public.messages_legacy') is not null
+     and not exists (select 1 from public.messages limit 1) then
+    select coalesce(min(created_at), now())::date into lo from public.messages_legacy;
+    perform public.messages_ensure_partitions(lo, 3);
+    insert into public.messages (id, user_id, chat_id, role, content, created_at)
+      select id, user_id, chat_id, role, content, coalesce(created_at, now()) from public.messages_legacy;
+    perform setval('public.messages_id_seq_p', greatest(1, (select coalesce(max(id), 0) from public.messages)));
+  else
+    perform public.messages_ensure_partitions(null, 3);
+  end if;
+end $$;
+-- Kiểm tra xong số dòng thì xoá bảng cũ:
+--   drop table public.messages_legacy;
+
+-- ========== 4b) RLS + quyền: bảng mới không kế thừa gì từ messages_legacy → chép lại ==========
+-- Policy (theo tên, bỏ qua nếu đã có), bật RLS nếu bảng cũ bật, GRANT trên bảng + sequence id mới.
+-- Chạy khi messages_legacy còn tồn tại (trước khi drop bảng cũ).
+do $$
+declare
+  p       record;
+  g       record;
+  to_list text;
+begin
+  if to_regclass('public.messages_legacy') is null then
+    return;
+  end if;
+
+  if (select relrowsecurity from pg_class where oid = 'public.messages_legacy'::regclass) then
+    alter table public.messages enable row level security;
+  end if;
+  if (select relforcerowsecurity from pg_class where oid = 'public.messages_legacy'::regclass) then
+    alter table public.messages force row level security;
+  end if;
+
+  for p in
+    select * from pg_policies
+    where schemaname = 'public' and tablename = 'messages_legacy'
+      and policyname not in (select policyname from pg_policies
+                             where schemaname = 'public' and tablename = 'messages')
+  loop
+    select string_agg(case when r = 'public' then 'public' else quote_ident(r) end, ', ')
+      into to_list from unnest(p.roles) r;
+    execute format('create policy %I on public.messages as %s for %s to %s%s%s',
+                   p.policyname, p.permissive, p.cmd, to_list,
+                   case when p.qual is not null then format(' using (%s)', p.qual) else '' end,
+                   case when p.with_check is not null then format(' with check (%s)', p.with_check) else '' end);
+  end loop;
+
+  for g in
+    select grantee, string_agg(privilege_type, ', ') as privs,
+           bool_or(privilege_type = 'INSERT') as can_insert
+    from information_schema.role_table_grants
+    where table_schema = 'public' and table_name = 'messages_legacy'
+    group by grantee
+  loop
+    execute format('grant %s on public.messages to %s', g.privs,
+                   case when g.grantee = 'PUBLIC' then 'public' else quote_ident(g.grantee) end);
+    if g.can_insert then
+      execute format('grant usage, select on sequence public.messages_id_seq_p to %s',
+                     case when g.grantee = 'PUBLIC' then 'public' else quote_ident(g.grantee) end);
+    end if;
+  end loop;
+end $$;
+
+-- ========== 5) Lưu trữ gọn: 1 dòng / chat / tháng ==========
+create table if not exists public.messages_archive (
+  chat_id     bigint not null,
+  month       date   not null,
+  n           int    not null,
+  first_at    timestamptz,
+  last_at     timestamptz,
+  body        jsonb  not null,   -- [[id, user_id, role, content, created_at], ...] theo thời gian
+  archived_at timestamptz default now(),
+  primary key (chat_id, month)
+);
+
+-- lz4 (PG14+) nén TOAST nhanh hơn pglz; bản cũ hơn thì giữ mặc định
+do $$
+begin
+  alter table public.messages_archive alter column body set compression lz4;
+exception when others then null;
+end $$;
+
+-- ========== 6) RPC: messages_archive_month(m) ==========
+-- Chỉ chuyển tin của những chat đã có tóm tắt phủ tới tin cuối cùng trong tháng (conv_summaries.window_end_at).
+-- Partition rỗng sau khi chuyển → detach + drop (trả dung lượng ngay, không cần VACUUM bảng lớn).
+drop function if exists public.messages_archive_month(date);
+create or replace function public.messages_archive_month(m date)
+returns table (archived bigint, remaining bigint, dropped boolean) language plpgsql as $$
+declare
+  part text := format('messages_y%sm%s', to_char(m, 'YYYY'), to_char(m, 'MM'));
+  lo   timestamptz := date_trunc('month', m);
+  hi   timestamptz := date_trunc('month', m) + interval '1 month';
+  a    bigint := 0;
+  r    bigint := 0;
+  d    boolean := false;
+begin
+  if to_regclass('public.' || part) is null then
+    return query select 0::bigint, 0::bigint, false;
+    return;
+  end if;
+
+  with done as (
+    select p.chat_id
+    from public.messages p
+    where p.created_at >= lo and p.created_at < hi
+    group by p.chat_id
+    having max(p.created_at) <= (select max(s.window_end_at) from public.conv_summaries s
+                                 where s.user_id = p.chat_id::text)
+  ), moved as (
+    delete from public.messages x
+    using done
+    where x.created_at >= lo and x.created_at < hi and x.chat_id = done.chat_id
+    returning x.*
+  ), ins as (
+    insert into public.messages_archive as t (chat_id, month, n, first_at, last_at, body)
+    select chat_id, lo::date, count(*), min(created_at), max(created_at),
+           jsonb_agg(jsonb_build_array(id, user_id, role, content, created_at) order by created_at)
+    from moved
+    group by chat_id
+    on conflict (chat_id, month) do update set
+      n           = t.n + excluded.n,
+      first_at    = least(t.first_at, excluded.first_at),
+      last_at     = greatest(t.last_at, excluded.last_at),
+      body        = t.body || excluded.body,
+      archived_at = now()
+  )
+  select count(*) into a from moved;
+
+  execute format('select count(*) from public.%I', part) into r;
+  if r = 0 then
+    execute format('alter table public.messages detach partition public.%I', part);
+    execute format('drop table public.%I', part);
+    d := true;
+  end if;
+  return query select a, r, d;
+end $$;
+
+-- ========== 7) RPC: messages_archive_old(keep_months) — mọi partition cũ hơn keep_months ==========
+drop function if exists public.messages_archive_old(int);
+create or replace function public.messages_archive_old(keep_months int default 6)
+returns table (month date, archived bigint, remaining bigint, dropped boolean) language plpgsql as $$
+declare
+  cutoff date := (date_trunc('month', now()) - make_interval(months => greatest(1, keep_months)))::date;
+  pm     date;
+begin
+  for pm in
+    select to_date(right(c.relname, 7), 'YYYY"m"MM')
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    where i.inhparent = 'public.messages'::regclass
+      and c.relname ~ '^messages_y[0-9]{4}m[0-9]{2}$'
+    order by 1
+  loop
+    exit when pm >= cutoff;
+    return query select pm, x.archived, x.remaining, x.dropped from public.messages_archive_month(pm) x;
+  end loop;
+  perform public.messages_ensure_partitions(null, 3);
+end $$;
+
+-- ========== 8) RPC: messages_partitions() — liệt kê partition + số dòng ước lượng (cho dry-run / giám sát) ==========
+drop function if exists public.messages_partitions();
+create or replace function public.messages_partitions()
+returns table (month date, est_rows bigint, bytes bigint) language sql stable as $$
+  select to_date(right(c.relname, 7), 'YYYY"m"MM'), greatest(c.reltuples, 0)::bigint,
+         pg_total_relation_size(c.oid)
+  from pg_inherits i
+  join pg_class c on c.oid = i.inhrelid
+  where i.inhparent = 'public.messages'::regclass
+    and c.relname ~ '^messages_y[0-9]{4}m[0-9]{2}$'
+  order by 1
+$$;
+
+-- ========== 9) Lịch chạy (tuỳ chọn, nếu đã bật extension pg_cron) ==========
+-- select cron.schedule('messages-archive', '17 3 * * *', $$select * from public.messages_archive_old(6)$$);
+
+notify pgrst, 'reload schema';
+analyze public.messages;
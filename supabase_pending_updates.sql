@@ -0,0 +1,24 @@
+-- supabase_pending_updates.sql — Bàn giao update dang dở giữa các instance (graceful drain)
+-- Instance nhận SIGTERM lưu body update chưa xong vào đây; instance kế tiếp claim ở request đầu.
+
+create table if not exists public.pending_updates (
+  update_id  bigint primary key,
+  body       jsonb not null,
+  created_at timestamptz default now()
+);
+
+-- Nhận tối đa n update (xoá khỏi bảng) — SKIP LOCKED để nhiều instance claim song song không trùng
+drop function if exists public.claim_pending_updates(int);
+create or replace function public.claim_pending_updates(n int default 100)
+returns table (body jsonb) language sql as $$
+  delete from public.pending_updates
+  where update_id in (
+    select update_id from public.pending_updates
+    order by update_id
+    limit n
+    for update skip locked
+  )
+  returning body
+$$;
+
+notify pgrst, 'reload schema';
@@ -0,0 +1,79 @@
+# tests/test_admission.py — AdaptiveLimiter (Gradient2 rút gọn): shed, co khi chậm, nở khi tải cao
+from core.admission import AdaptiveLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def _limiter(**kw):
+    clock = Clock()
+    return AdaptiveLimiter(clock=clock, **kw), clock
+
+
+def test_sheds_beyond_the_limit_and_counts():
+    lim, _ = _limiter(initial=2, min_limit=1, max_limit=10)
+    a, b = lim.try_acquire(), lim.try_acquire()
+    assert a is not None and b is not None
+    assert lim.try_acquire() is None
+    snap = lim.snapshot()
+    assert (snap["inflight"], snap["accepted"], snap["shed"]) == (2, 2, 1)
+    lim.release(a)
+    assert lim.try_acquire() is not None
+
+
+def test_release_without_sample_keeps_limit():
+    lim, _ = _limiter(initial=8)
+    lim.release(lim.try_acquire(), None)
+    assert lim.limit == 8.0 and lim.inflight == 0
+
+
+def _cycle(lim, clock, rtt, n):
+    """n lượt đồng thời (giữ đủ tải), mỗi lượt RTT = rtt."""
+    for _ in range(n):
+        tokens = [lim.try_acquire() for _ in range(int(lim.limit))]
+        clock.t += rtt
+        for t in tokens:
+            if t is not None:
+                lim.release(t, rtt)
+
+
+def test_latency_spike_shrinks_limit_towards_min():
+    lim, clock = _limiter(initial=32, min_limit=2, max_limit=64)
+    _cycle(lim, clock, 0.5, 5)
+    before = lim.limit
+    _cycle(lim, clock, 5.0, 10)
+    assert lim.limit < before / 2
+    assert lim.limit >= 2
+
+
+def test_steady_latency_under_full_load_grows_limit():
+    lim, clock = _limiter(initial=4, min_limit=2, max_limit=64)
+    _cycle(lim, clock, 0.5, 20)
+    assert lim.limit > 4
+
+
+def test_app_limited_does_not_grow_but_still_shrinks():
+    lim, clock = _limiter(initial=32, min_limit=2, max_limit=64)
+    for _ in range(20):  # 1 lượt tại 1 thời điểm: dùng < nửa limit
+        t = lim.try_acquire()
+        clock.t += 0.5
+        lim.release(t, 0.5)
+    assert lim.limit == 32.0
+    for _ in range(20):
+        t = lim.try_acquire()
+        clock.t += 10.0
+        lim.release(t, 10.0)
+    assert lim.limit < 32.0
+
+
+def test_limit_stays_within_bounds():
+    lim, clock = _limiter(initial=3, min_limit=3, max_limit=5)
+    _cycle(lim, clock, 0.1, 50)
+    assert lim.limit <= 5
+    _cycle(lim, clock, 30.0, 50)
+    assert lim.limit >= 3
@@ -0,0 +1,62 @@
+# tests/test_bots.py — cấu hình nhiều bot: secret bắt buộc, bot lạ bị từ chối
+import asyncio
+import json
+
+import pytest
+
+from infra import bots
+
+
+@pytest.fixture
+def config(monkeypatch):
+    def load(items):
+        monkeypatch.setenv("TELEGRAM_TOKEN", "1:default")
+        monkeypatch.setenv("TELEGRAM_SECRET_TOKEN", "s-default")
+        monkeypatch.setenv("BOT_EN_TOKEN", "2:en")
+        monkeypatch.setenv("BOT_EN_SECRET", "s-en")
+        monkeypatch.delenv("BOT_FR_SECRET", raising=False)
+        monkeypatch.setenv("BOTS_CONFIG", json.dumps(items))
+        monkeypatch.setattr(bots, "_bots", None)
+        return bots.all_bots()
+    yield load
+    bots._bots = None
+
+
+def test_non_default_bot_without_secret_is_skipped(config):
+    loaded = config([
+        {"key": "en", "token_env": "BOT_EN_TOKEN", "secret_env": "BOT_EN_SECRET", "namespace": "en"},
+        {"key": "fr", "token": "3:fr", "secret_env": "BOT_FR_SECRET"},
+        {"key": "de", "token": "4:de"},
+    ])
+    assert sorted(loaded) == [bots.DEFAULT_KEY, "en"]
+    assert loaded["en"].token == "2:en" and loaded["en"].secret == "s-en"
+
+
+def test_unknown_bot_key_is_not_activated_as_default(config):
+    config([{"key": "en", "token_env": "BOT_EN_TOKEN", "secret_env": "BOT_EN_SECRET", "namespace": "en"}])
+    assert bots.activate("en").key == "en"
+    assert bots.memory_user(7) == "en:7"
+    assert bots.activate(None).key == bots.DEFAULT_KEY
+    assert bots.activate("gone") is None
+
+
+def test_update_key_separates_bots(config):
+    config([{"key": "en", "token_env": "BOT_EN_TOKEN", "secret_env": "BOT_EN_SECRET"}])
+    assert bots.update_key({"update_id": 5}) == 5
+    assert bots.update_key({"update_id": 5, "_bot": "en"}) != 5
+    assert bots.chat_key(9, "en") == ("en", 9) and bots.chat_key(9, bots.DEFAULT_KEY) == 9
+
+
+def test_handle_update_refuses_update_of_unknown_bot(config, monkeypatch):
+    config([])
+    from functions.http import telegram_webhook as wh
+
+    sent = []
+
+    async def fake_typing(token, chat_id):
+        sent.append(("typing", token))
+
+    monkeypatch.setattr(wh, "send_typing", fake_typing)
+    update = {"update_id": 1, "_bot": "removed", "message": {"message_id": 1, "chat": {"id": 3}, "text": "hi"}}
+    asyncio.run(wh._handle_update(update))
+    assert sent == []
@@ -0,0 +1,162 @@
+# tests/test_coalescer.py — BurstCoalescer: leader / follower / sinh lại khi burst đổi
+import asyncio
+import importlib.util
+import os
+import types
+
+import pytest
+
+from core.coalescer import BurstCoalescer
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _recorder(delay=0.0):
+    prompts, delivered = [], []
+
+    async def generate(text):
+        prompts.append(text)
+        await asyncio.sleep(delay)
+        return f"answer:{text}"
+
+    async def deliver(text, answer):
+        delivered.append((text, answer))
+
+    return prompts, delivered, generate, deliver
+
+
+def test_single_message_is_answered_once_after_the_window():
+    c = BurstCoalescer(window_ms=30, poll_ms=10)
+    prompts, delivered, generate, deliver = _recorder()
+
+    async def main():
+        assert c.offer(1, 10, "xin chào")
+        return await c.run(1, generate, deliver)
+
+    assert _run(main()) == 1
+    assert delivered == [("xin chào", "answer:xin chào")]
+    assert not c.is_active(1)
+
+
+def test_followers_during_the_window_merge_into_one_turn():
+    c = BurstCoalescer(window_ms=60, poll_ms=10)
+    prompts, delivered, generate, deliver = _recorder()
+
+    async def main():
+        assert c.offer(1, 10, "một")
+        leader = asyncio.ensure_future(c.run(1, generate, deliver))
+        await asyncio.sleep(0.02)
+        assert not c.offer(1, 12, "ba")  # thứ tự theo message_id, không theo lúc đến
+        assert not c.offer(1, 11, "hai")
+        return await leader
+
+    assert _run(main()) == 1
+    assert prompts == ["một\nhai\nba"]
+    assert len(delivered) == 1
+
+
+def test_fragment_during_generation_cancels_and_regenerates():
+    c = BurstCoalescer(window_ms=20, max_wait_ms=1000, poll_ms=10)
+    prompts, delivered, generate, deliver = _recorder(delay=0.15)
+
+    async def main():
+        c.offer(1, 10, "câu 1")
+        leader = asyncio.ensure_future(c.run(1, generate, deliver))
+        while not prompts:
+            await asyncio.sleep(0.005)
+        assert not c.offer(1, 11, "câu 2")
+        return await leader
+
+    assert _run(main()) == 2
+    assert prompts == ["câu 1", "câu 1\ncâu 2"]
+    assert delivered == [("câu 1\ncâu 2", "answer:câu 1\ncâu 2")]
+
+
+def test_edited_message_overwrites_its_fragment():
+    c = BurstCoalescer(window_ms=40, poll_ms=10)
+    prompts, _, generate, deliver = _recorder()
+
+    async def main():
+        c.offer(1, 10, "gõ sai")
+        leader = asyncio.ensure_future(c.run(1, generate, deliver))
+        await asyncio.sleep(0.01)
+        c.offer(1, 10, "gõ đúng")
+        await leader
+
+    _run(main())
+    assert prompts == ["gõ đúng"]
+
+
+def test_max_wait_caps_debounce_for_continuous_typing():
+    c = BurstCoalescer(window_ms=50, max_wait_ms=120, poll_ms=10)
+    prompts, _, generate, deliver = _recorder()
+
+    async def main():
+        c.offer(1, 1, "0")
+        leader = asyncio.ensure_future(c.run(1, generate, deliver))
+        for i in range(2, 12):
+            await asyncio.sleep(0.03)
+            c.offer(1, i, str(i))
+        await leader
+
+    _run(main())
+    assert len(prompts[0].split("\n")) < 11  # đã trả lời trước khi user ngừng gõ
+
+
+def test_chats_are_independent():
+    c = BurstCoalescer(window_ms=20, poll_ms=10)
+    prompts, _, generate, deliver = _recorder()
+
+    async def main():
+        assert c.offer(1, 1, "a") and c.offer(2, 1, "b")
+        await asyncio.gather(c.run(1, generate, deliver), c.run(2, generate, deliver))
+
+    _run(main())
+    assert sorted(prompts) == ["a", "b"]
+
+
+def test_generation_error_clears_the_burst():
+    c = BurstCoalescer(window_ms=10, poll_ms=10)
+
+    async def boom(text):
+        raise RuntimeError("llm down")
+
+    async def deliver(text, answer):
+        pass
+
+    async def main():
+        c.offer(1, 1, "x")
+        with pytest.raises(RuntimeError):
+            await c.run(1, boom, deliver)
+
+    _run(main())
+    assert not c.is_active(1)
+    assert c.offer(1, 2, "y")  # tin sau tự làm leader mới
+
+
+def _gunicorn_conf(monkeypatch, window):
+    monkeypatch.setenv("BURST_WINDOW_MS", window)
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+    spec = importlib.util.spec_from_file_location("gunicorn_conf_test", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _server(workers):
+    log = types.SimpleNamespace(warning=lambda *a: None)
+    return types.SimpleNamespace(num_workers=workers, log=log)
+
+
+def test_gunicorn_forces_one_worker_when_coalescing(monkeypatch):
+    server = _server(4)
+    _gunicorn_conf(monkeypatch, "1500").on_starting(server)
+    assert server.num_workers == 1
+
+
+def test_gunicorn_keeps_workers_when_coalescing_is_off(monkeypatch):
+    server = _server(4)
+    _gunicorn_conf(monkeypatch, "0").on_starting(server)
+    assert server.num_workers == 4
@@ -0,0 +1,59 @@
+# tests/test_context.py — MMR đa dạng hoá + nén ngữ cảnh theo ngân sách token
+import numpy as np
+
+from core.context import build_context, compress_snippet, estimate_tokens, mmr_select, tokens
+
+
+def test_mmr_with_lambda_one_is_plain_top_k():
+    q = [1.0, 0.0]
+    cands = [[0.9, 0.1], [1.0, 0.0], [0.0, 1.0], [0.7, 0.7]]
+    assert mmr_select(q, cands, 3, lambda_=1.0) == [1, 0, 3]
+
+
+def test_mmr_skips_near_duplicates():
+    q = [1.0, 0.0, 0.0]
+    cands = [[1.0, 0.0, 0.0], [0.99, 0.01, 0.0], [0.8, 0.0, 0.6]]
+    # Top-K theo cosine: 0, 1 (gần như trùng 0); MMR: 0 rồi 2 (khác hướng, vẫn liên quan)
+    assert mmr_select(q, cands, 2, lambda_=0.3) == [0, 2]
+
+
+def test_mmr_uses_given_relevance_instead_of_query():
+    cands = [[1.0, 0.0], [0.0, 1.0], [0.0, 1.0]]
+    assert mmr_select(None, cands, 2, lambda_=0.5, relevance=[0.1, 0.9, 0.8]) == [1, 0]
+    assert mmr_select(None, cands, 2, lambda_=1.0, relevance=[0.1, 0.9, 0.8]) == [1, 2]
+
+
+def test_mmr_edge_cases():
+    assert mmr_select([1.0, 0.0], [], 3) == []
+    assert mmr_select([1.0, 0.0], [[1.0, 0.0]], 0) == []
+    out = mmr_select([1.0, 0.0], np.eye(2, dtype=np.float32), 5)
+    assert sorted(out) == [0, 1]
+
+
+def test_compress_keeps_short_text_verbatim():
+    assert compress_snippet("  Ngắn gọn.  ", set(), 50) == "Ngắn gọn."
+
+
+def test_compress_keeps_most_relevant_sentences_in_original_order():
+    text = ("Hôm qua trời mưa rất to ở quận một. Bạn Lan thích uống trà đá vào buổi chiều. "
+            "Cửa hàng mở cửa lúc tám giờ sáng. Lan cũng thích trà sữa trân châu.")
+    out = compress_snippet(text, set(tokens("Lan thích trà gì")), 35)
+    assert out == "Bạn Lan thích uống trà đá vào buổi chiều. Lan cũng thích trà sữa trân châu."
+    assert estimate_tokens(out) <= 35
+
+
+def test_compress_truncates_one_long_sentence_at_a_word_boundary():
+    text = " ".join(["dàiiii"] * 100)
+    out = compress_snippet(text, {"daiiii"}, 10)
+    assert out.endswith("…")
+    assert estimate_tokens(out) <= 10
+    assert all(w == "dàiiii" for w in out[:-1].split())
+
+
+def test_build_context_respects_budget_without_cutting_items():
+    items = [{"content": "Lan thích trà đá."}, {"content": "x" * 300}, {"content": "Lan sống ở Huế."}]
+    out = build_context(items, "Lan", token_budget=20, snippet_tokens=80)
+    lines = out.split("\n")
+    assert lines[0] == "- Lan thích trà đá."
+    assert "- Lan sống ở Huế." in lines
+    assert estimate_tokens(out) <= 20 + len(lines)
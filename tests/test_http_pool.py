@@ -0,0 +1,32 @@
+# tests/test_http_pool.py — client httpx dùng chung theo (event loop, tên)
+import asyncio
+
+from infra import http_pool
+
+
+def test_clients_are_shared_per_loop_and_name_and_closed_by_run():
+    seen = {}
+
+    async def main():
+        a = http_pool.get_client("telegram:1")
+        seen["a"] = a
+        assert http_pool.get_client("telegram:1") is a
+        assert http_pool.get_client("telegram:2") is not a
+        return "done"
+
+    assert http_pool.run(main()) == "done"
+    assert seen["a"].is_closed
+
+
+def test_each_loop_gets_its_own_client():
+    async def grab():
+        return http_pool.get_client("llm:x")
+
+    async def main():
+        c = await grab()
+        await http_pool.aclose_loop()
+        return c
+
+    first = asyncio.run(main())
+    second = asyncio.run(main())
+    assert first is not second and first.is_closed and second.is_closed
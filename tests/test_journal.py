@@ -0,0 +1,103 @@
+# tests/test_journal.py — UpdateJournal: trùng / lỗi giữa chừng / gửi lại / nhận orphan
+import os
+import time
+
+import pytest
+
+from infra import journal as journal_mod
+from infra.journal import LOGGED, RECEIVED, REPLIED, UpdateJournal
+
+
+def _update(uid, text="hi"):
+    return {"update_id": uid, "message": {"message_id": uid, "chat": {"id": 1}, "text": text}}
+
+
+def _state(j, uid):
+    return j._submit(lambda conn: conn.execute(
+        "select state, owner, answer from updates where update_id = ?", (uid,)).fetchone(), wait=True)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    j = UpdateJournal(str(tmp_path / "journal.db"))
+    yield j
+    j.close()
+
+
+def test_begin_records_received_and_rejects_duplicate_while_handling(journal):
+    assert journal.begin(_update(1))
+    assert _state(journal, 1)[:2] == (RECEIVED, os.getpid())
+    assert not journal.begin(_update(1))
+
+
+def test_complete_makes_redelivery_a_duplicate(journal):
+    assert journal.begin(_update(2))
+    journal.mark_replied(2, "answer")
+    assert _state(journal, 2)[0] == REPLIED
+    journal.complete(2)
+    assert _state(journal, 2)[0] == LOGGED
+    assert not journal.begin(_update(2))
+
+
+def test_release_after_failure_lets_telegram_retry_through(journal):
+    assert journal.begin(_update(3))
+    journal.release(3)  # handler lỗi → 500
+    assert _state(journal, 3) is None
+    assert journal.begin(_update(3))
+
+
+def test_release_keeps_replied_entry(journal):
+    assert journal.begin(_update(4))
+    journal.mark_replied(4, "answer")
+    journal.release(4)
+    assert _state(journal, 4)[0] == REPLIED
+    assert not journal.begin(_update(4))
+
+
+def test_redelivery_of_abandoned_received_entry_is_taken_over(journal):
+    # Entry 'received' của chính process này nhưng không còn ai xử lý (vd. release chưa chạy được)
+    assert journal.begin(_update(5))
+    journal._untrack(5)
+    assert journal.begin(_update(5, "retry"))
+    assert not journal.begin(_update(5))
+
+
+def test_received_entry_of_dead_owner_is_taken_over(journal, monkeypatch):
+    assert journal.begin(_update(6))
+    journal._submit(lambda conn: conn.execute("update updates set owner = 999999 where update_id = 6"), wait=True)
+    monkeypatch.setattr(journal_mod, "_alive", lambda pid: pid == os.getpid())
+    assert journal.begin(_update(6))
+    assert _state(journal, 6)[1] == os.getpid()
+
+
+def test_received_entry_of_live_other_owner_stays_duplicate(journal, monkeypatch):
+    assert journal.begin(_update(7))
+    journal._submit(lambda conn: conn.execute("update updates set owner = 999999 where update_id = 7"), wait=True)
+    monkeypatch.setattr(journal_mod, "_alive", lambda pid: True)
+    assert not journal.begin(_update(7))
+
+
+def test_claim_orphans_takes_only_unfinished_entries_of_dead_owners(journal, monkeypatch):
+    for uid in (10, 11, 12, 13):
+        assert journal.begin(_update(uid))
+    journal.mark_replied(11, "done")
+    journal.complete(12)
+    journal._submit(lambda conn: conn.execute("update updates set owner = 999999 where update_id != 13"), wait=True)
+    monkeypatch.setattr(journal_mod, "_alive", lambda pid: pid == os.getpid())
+
+    claimed = journal.claim_orphans()
+    assert [(u["update_id"], state, answer) for u, state, answer in claimed] == [
+        (10, RECEIVED, None), (11, REPLIED, "done")]
+    assert _state(journal, 10)[1] == os.getpid()
+    # Đã nhận → đang xử lý ở process này: redelivery là trùng, lần claim sau không nhận lại
+    assert not journal.begin(_update(10))
+    assert journal.claim_orphans() == []
+
+
+def test_unawaited_operations_are_flushed_before_later_reads(journal):
+    ops = [journal._submit(lambda conn, i=i: conn.execute(
+        "insert into updates(update_id, body, state, owner, updated_at) values (?,?,?,?,?)",
+        (100 + i, "{}", RECEIVED, os.getpid(), time.time())), wait=False) for i in range(20)]
+    assert ops == [None] * 20
+    assert journal._submit(lambda conn: conn.execute(
+        "select count(*) from updates where update_id >= 100").fetchone()[0], wait=True) == 20
@@ -0,0 +1,106 @@
+# tests/test_lexical.py — từ khoá từ vựng tiếng Việt + fast path lexical của MemoryStore
+import asyncio
+
+import pytest
+
+from core import memory_store
+from core.context import fold_vi, lexical_terms, term_coverage
+from tests.test_memory_store import FakeDB, FakeEmb, _store
+
+
+def test_fold_vi():
+    assert fold_vi("Dũng ĐÀ Nẵng") == "dung da nang"
+
+
+def test_lexical_terms_drop_stopwords_short_tokens_and_repeats():
+    assert lexical_terms("Bạn có nhớ quán Phở Thìn ở Hà Nội không? phở") == ["quan", "pho", "thin", "ha", "noi"]
+    assert lexical_terms("Phở Thìn", fold=False) == ["phở", "thìn"]
+    assert lexical_terms("a b c") == []
+
+
+def test_stopwords_are_matched_with_accents():
+    # "đã" là hư từ, "đá" (trà đá) thì không
+    assert lexical_terms("trà đá đã") == ["tra", "da"]
+    assert lexical_terms("trà đá đã", fold=False) == ["trà", "đá"]
+
+
+def test_term_coverage_folded_vs_exact():
+    text = "Lan thích uống trà đá ở Đà Nẵng"
+    assert term_coverage(["tra", "da"], text) == 1.0
+    assert term_coverage(["trà", "đá"], text, fold=False) == 1.0
+    assert term_coverage(["trả", "đủ"], text, fold=False) == 0.0
+    assert term_coverage(["tra", "xyz"], text) == 0.5
+    assert term_coverage([], text) == 0.0
+
+
+@pytest.fixture
+def hybrid(monkeypatch):
+    monkeypatch.setattr(memory_store, "HYBRID", True)
+    monkeypatch.setattr(memory_store, "STORAGE", "vector")
+    monkeypatch.setattr(memory_store, "LEXICAL_EXIT", 0.6)
+    monkeypatch.setattr(memory_store, "LEXICAL_MIN_SCORE", 0.6)
+    monkeypatch.setattr(memory_store, "MMR_LAMBDA", 0.5)
+
+
+def _row(content, score, emb=(1.0, 0.0, 0.0), **extra):
+    return {"ref_type": "fact", "ref_id": content, "content": content, "score": score,
+            "embedding": "[" + ",".join(map(str, emb)) + "]", **extra}
+
+
+class CountingEmb(FakeEmb):
+    def __init__(self):
+        self.calls = 0
+
+    async def embed(self, texts):
+        self.calls += 1
+        return await super().embed(texts)
+
+
+def _search(db, query, **kw):
+    store = _store(db)
+    store.emb = CountingEmb()
+    out = asyncio.run(store.search_diverse("7", query, top_k=2, **kw))
+    return out, store.emb.calls, [n for _, n, _ in db.calls]
+
+
+def test_strong_exact_lexical_hit_skips_embedding(hybrid):
+    db = FakeDB({"memory_search_lexical": [_row("Quán Phở Thìn ở Lò Đúc", 0.9)]})
+    out, embeds, rpcs = _search(db, "phở thìn")
+    assert embeds == 0 and rpcs == ["memory_search_lexical"]
+    assert out == [{"ref_type": "fact", "ref_id": "Quán Phở Thìn ở Lò Đúc",
+                    "content": "Quán Phở Thìn ở Lò Đúc", "score": 0.9}]
+
+
+def test_accent_mismatch_falls_through_to_hybrid(hybrid):
+    db = FakeDB({
+        "memory_search_lexical": [_row("trả đủ tiền rồi", 0.9)],
+        "memory_search_hybrid": [_row("Lan thích trà đá", 0.8, rrf=0.03, lex_rank=None)],
+    })
+    out, embeds, rpcs = _search(db, "trà đá")
+    assert embeds == 1 and rpcs == ["memory_search_lexical", "memory_search_hybrid"]
+    assert [r["content"] for r in out] == ["Lan thích trà đá"]
+
+
+def test_single_term_or_weak_score_never_exits_early(hybrid):
+    db = FakeDB({"memory_search_lexical": [_row("Dũng", 0.95)], "memory_search_hybrid": []})
+    _, embeds, rpcs = _search(db, "Dũng")
+    assert embeds == 1 and "memory_search_lexical" not in rpcs  # < LEXICAL_MIN_TERMS: không gọi RPC lexical
+
+    db = FakeDB({"memory_search_lexical": [_row("Phở Thìn", 0.3)], "memory_search_hybrid": []})
+    _, embeds, _ = _search(db, "phở thìn")
+    assert embeds == 1
+
+
+def test_min_score_raises_the_lexical_floor(hybrid):
+    db = FakeDB({"memory_search_lexical": [_row("Phở Thìn", 0.7)], "memory_search_hybrid": []})
+    _, embeds, _ = _search(db, "phở thìn", min_score=0.8)
+    assert embeds == 1
+
+
+def test_lexical_exit_hits_go_through_mmr(hybrid):
+    rows = [_row("Phở Thìn Lò Đúc", 0.95, (1, 0, 0)), _row("Phở Thìn Lò Đúc cũ", 0.94, (1, 0, 0)),
+            _row("Phở Thìn Bờ Hồ", 0.9, (0, 1, 0))]
+    db = FakeDB({"memory_search_lexical": rows})
+    out, embeds, _ = _search(db, "phở thìn")
+    assert embeds == 0
+    assert [r["content"] for r in out] == ["Phở Thìn Lò Đúc", "Phở Thìn Bờ Hồ"]
@@ -0,0 +1,89 @@
+# tests/test_lifecycle.py — drain: chờ update đang chạy, flush, bàn giao mảnh burst đã ack, nhận lại
+import threading
+import time
+
+import pytest
+
+from infra import lifecycle as lifecycle_mod
+from infra import supabase_client
+from infra.lifecycle import Lifecycle
+
+
+def _update(uid, bot=None):
+    u = {"update_id": uid, "message": {"message_id": uid, "chat": {"id": 1}, "text": str(uid)}}
+    if bot:
+        u["_bot"] = bot
+    return u
+
+
+@pytest.fixture
+def lc(tmp_path, monkeypatch):
+    monkeypatch.setattr(lifecycle_mod, "SPOOL_PATH", str(tmp_path / "spool.json"))
+    monkeypatch.setattr(supabase_client, "_client", None)  # không Supabase → spool ra file
+    return Lifecycle()
+
+
+def test_drain_flag_and_inflight_tracking(lc):
+    u = _update(1)
+    lc.enter(u)
+    assert lc.inflight_count() == 1 and not lc.draining
+    lc.begin_drain()
+    assert lc.draining
+    lc.exit(u)
+    assert lc.inflight_count() == 0
+    assert lc.wait_idle(0.1)
+
+
+def test_wait_idle_times_out_from_drain_start(lc):
+    lc.enter(_update(1))
+    lc.begin_drain()
+    t = time.monotonic()
+    assert not lc.wait_idle(0.05)
+    assert time.monotonic() - t < 1.0
+
+
+def test_wait_idle_returns_when_last_update_exits(lc):
+    u = _update(1)
+    lc.enter(u)
+    lc.begin_drain()
+    threading.Timer(0.05, lc.exit, args=(u,)).start()
+    assert lc.wait_idle(2.0)
+
+
+def test_only_acked_burst_fragments_are_handed_off_and_claimed_once(lc):
+    leader, f1, f2 = _update(1), _update(2), _update(3, bot="en")
+    lc.enter(leader)  # chưa ack → Telegram tự gửi lại, không bàn giao
+    lc.defer(1, f1)
+    lc.defer(("en", 1), f2)
+    lc.defer(1, f1)  # trùng → 1 lần
+    assert lc.is_deferred(f1) and not lc.is_deferred(leader)
+    assert [u["update_id"] for u in lc.unfinished()] == [2, 3]
+
+    flushed = []
+    lc.on_drain(lambda: flushed.append(True))
+    lc.exit(leader)
+    lc.shutdown(deadline_s=0.1)
+    assert flushed == [True]
+
+    claimed = Lifecycle().claim()
+    assert sorted(u["update_id"] for u in claimed) == [2, 3]
+    assert Lifecycle().claim() == []
+
+
+def test_release_chat_returns_fragments_once(lc):
+    f = _update(5)
+    lc.defer(7, f)
+    assert lc.release_chat(7) == [f]
+    assert lc.release_chat(7) == []
+    assert lc.unfinished() == []
+
+
+def test_resumer_runs_immediately_and_stops_on_drain(lc):
+    runs = []
+    lc.start_resumer(lambda: runs.append(1), interval_s=60)
+    lc.start_resumer(lambda: runs.append(2), interval_s=60)  # 1 lần / process
+    time.sleep(0.05)
+    lc.begin_drain()
+    lc._resumer.join(1.0)
+    assert runs and set(runs) == {1}
+    assert not lc._resumer.is_alive()
@@ -0,0 +1,112 @@
+# tests/test_memory_store.py — MemoryStore với Supabase giả: ghi không chặn loop, dedupe-on-write
+import asyncio
+import threading
+
+import pytest
+
+from core import memory_store
+from core.memory_store import MemoryStore
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Call:
+    def __init__(self, db, kind, name, payload):
+        self.db, self.kind, self.name, self.payload = db, kind, name, payload
+
+    def execute(self):
+        self.db.threads.add(threading.get_ident())
+        self.db.calls.append((self.kind, self.name, self.payload))
+        return _Result(self.db.reply(self.kind, self.name, self.payload))
+
+
+class _Table:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def insert(self, payload):
+        return _Call(self.db, "insert", self.name, payload)
+
+
+class FakeDB:
+    """Đủ cho db.rpc(...).execute() / db.table(...).insert(...).execute(); `rpc_rows` theo tên RPC."""
+
+    def __init__(self, rpc_rows=None):
+        self.rpc_rows = rpc_rows or {}
+        self.calls = []
+        self.threads = set()
+
+    def rpc(self, name, params):
+        return _Call(self, "rpc", name, params)
+
+    def table(self, name):
+        return _Table(self, name)
+
+    def reply(self, kind, name, payload):
+        if kind == "insert":
+            return [{"id": f"{name}-1"}]
+        return self.rpc_rows.get(name, [])
+
+
+class FakeEmb:
+    async def embed(self, texts):
+        return [[1.0, 0.0, 0.0] for _ in texts]
+
+    def to_db(self, vec):
+        return "[" + ",".join(str(x) for x in vec) + "]"
+
+
+def _store(db):
+    store = MemoryStore.__new__(MemoryStore)
+    store.db, store.emb, store.vec_col = db, FakeEmb(), "embedding"
+    return store
+
+
+@pytest.fixture(autouse=True)
+def _vector_storage(monkeypatch):
+    monkeypatch.setattr(memory_store, "STORAGE", "vector")
+    monkeypatch.setattr(memory_store, "DEDUPE_THRESHOLD", 0.92)
+
+
+def test_add_fact_inserts_fact_and_vector_off_the_event_loop():
+    db = FakeDB()
+    store = _store(db)
+
+    async def main():
+        await store.add_fact(7, "thích trà đá", weight=2.0)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert [(k, n) for k, n, _ in db.calls] == [
+        ("rpc", "memory_search"), ("insert", "memory_facts"), ("insert", "memory_vectors")]
+    assert db.calls[2][2]["ref_id"] == "memory_facts-1" and db.calls[2][2]["ref_type"] == "fact"
+    assert loop_thread not in db.threads
+
+
+def test_add_fact_merges_near_duplicate_instead_of_inserting():
+    db = FakeDB({"memory_search": [{"ref_type": "fact", "ref_id": "f-9", "score": 0.95}]})
+    asyncio.run(_store(db).add_fact(7, "thích trà đá"))
+    assert [(k, n) for k, n, _ in db.calls] == [("rpc", "memory_search"), ("rpc", "memory_merge")]
+    assert db.calls[1][2] == {"rt": "fact", "rid": "f-9", "w": 1.0}
+
+
+def test_add_summary_always_keeps_the_summary_row():
+    db = FakeDB({"memory_search": [{"ref_type": "summary", "ref_id": "s-1", "score": 0.99}]})
+    asyncio.run(_store(db).add_summary(7, "2026-01-01", "2026-01-02", "tóm tắt"))
+    assert [(k, n) for k, n, _ in db.calls] == [
+        ("insert", "conv_summaries"), ("rpc", "memory_search"), ("rpc", "memory_merge")]
+
+
+def test_dedupe_error_falls_back_to_insert():
+    class Broken(FakeDB):
+        def reply(self, kind, name, payload):
+            if name == "memory_search":
+                raise RuntimeError("rpc down")
+            return super().reply(kind, name, payload)
+
+    db = Broken()
+    asyncio.run(_store(db).add_fact(7, "x"))
+    assert [n for _, n, _ in db.calls][-2:] == ["memory_facts", "memory_vectors"]
@@ -0,0 +1,66 @@
+# tests/test_profiling.py — SampledProfiler: lấy mẫu CPU theo thread, gom cấp phát ngoài lock
+import time
+import tracemalloc
+
+from infra import profiling
+from infra.profiling import SampledProfiler
+
+
+def _busy(seconds):
+    end = time.monotonic() + seconds
+    n = 0
+    while time.monotonic() < end:
+        n += 1
+    return n
+
+
+def test_sampled_requests_produce_collapsed_stacks(tmp_path):
+    p = SampledProfiler(rate=1.0, control_dir=str(tmp_path))
+    with p.sample():
+        _busy(0.1)
+    out = p.collapsed(merge=False)
+    assert "test_profiling:_busy" in out
+    assert p.status()["profiled"] == 1 and p.status()["samples"] > 0
+
+
+def test_rate_zero_samples_nothing(tmp_path):
+    p = SampledProfiler(rate=0.0, control_dir=str(tmp_path))
+    with p.sample():
+        _busy(0.02)
+    assert p.status()["profiled"] == 0 and p.collapsed(merge=False) == ""
+
+
+def test_alloc_snapshot_is_taken_outside_the_lock(tmp_path, monkeypatch):
+    p = SampledProfiler(rate=1.0, alloc=True, control_dir=str(tmp_path))
+    held = []
+    real = tracemalloc.take_snapshot
+
+    def snapshot():
+        held.append(p._lock.locked())
+        return real()
+
+    monkeypatch.setattr(profiling.tracemalloc, "take_snapshot", snapshot)
+    with p.sample():
+        keep = [bytearray(64 * 1024) for _ in range(4)]
+    assert held == [False]
+    assert not tracemalloc.is_tracing()
+    assert p.top_allocations(5)
+    del keep
+
+
+def test_nested_alloc_windows_stop_tracing_only_at_the_end(tmp_path):
+    p = SampledProfiler(rate=1.0, alloc=True, control_dir=str(tmp_path))
+    with p.sample():
+        with p.sample():
+            pass
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+
+
+def test_configure_reaches_other_workers_through_control_file(tmp_path):
+    a = SampledProfiler(control_dir=str(tmp_path))
+    b = SampledProfiler(control_dir=str(tmp_path))
+    a.configure(0.25, alloc=True, reset=True)
+    b._checked = 0.0
+    b._refresh()
+    assert (b.rate, b.alloc, b.epoch) == (0.25, True, 1)
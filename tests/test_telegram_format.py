@@ -0,0 +1,67 @@
+# tests/test_telegram_format.py — sanitize Markdown legacy, cắt tin dài không vỡ entity
+import pytest
+
+from infra.telegram_format import (
+    _span_at, escape_markdown, sanitize_markdown, split_message, unescape_markdown,
+)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("*đậm* và _nghiêng_", "*đậm* và _nghiêng_"),
+    ("snake_case", "snake\\_case"),
+    ("a_b_c", "a_b_c"),  # legacy: _b_ là entity nghiêng hợp lệ
+    ("2 * 3 = 6", "2 \\* 3 = 6"),
+    ("[link](http://x.y)", "[link](http://x.y)"),
+    ("[thiếu ngoặc] nhé", "\\[thiếu ngoặc] nhé"),
+    ("```code```", "```code```"),
+    ("`mở không đóng", "\\`mở không đóng"),
+    ("đã escape \\_ sẵn", "đã escape \\_ sẵn"),
+])
+def test_sanitize_markdown(raw, expected):
+    assert sanitize_markdown(raw) == expected
+
+
+def test_unescape_reverses_sanitize_and_escape():
+    for raw in ("snake_case *lẻ", "a [b c", "`x"):
+        assert unescape_markdown(sanitize_markdown(raw)) == raw
+        assert unescape_markdown(escape_markdown(raw)) == raw
+
+
+def test_span_at_finds_entity_around_cut():
+    text = "abc *bold text* xyz"
+    assert _span_at(text, 8) == (4, 15)
+    assert _span_at(text, 2) is None
+    assert _span_at("a \\_ b", 3) == (2, 4)
+
+
+def _balanced(part: str) -> bool:
+    return sanitize_markdown(part) == part
+
+
+def test_split_plain_prefers_paragraphs():
+    text = "a" * 30 + "\n\n" + "b" * 30
+    assert split_message(text, limit=40) == ["a" * 30, "b" * 30]
+
+
+def test_split_never_exceeds_limit_and_keeps_entities_valid():
+    text = " ".join(f"*từ{i}* _x{i}_ snake_{i}" for i in range(200))
+    parts = split_message(sanitize_markdown(text), limit=100, markdown=True)
+    assert all(len(p) <= 100 for p in parts)
+    assert all(_balanced(p) for p in parts)
+
+
+def test_long_code_block_is_closed_and_reopened():
+    text = "Ví dụ:\n```" + "\n".join(f"line {i}" for i in range(60)) + "```"
+    parts = split_message(sanitize_markdown(text), limit=120, markdown=True)
+    assert len(parts) > 1
+    assert all(len(p) <= 120 for p in parts)
+    assert all(p.count("```") % 2 == 0 for p in parts)
+    assert parts[1].startswith("```")
+
+
+def test_long_bold_run_is_closed_and_reopened():
+    text = "*" + " ".join(["đậm"] * 80) + "*"
+    parts = split_message(sanitize_markdown(text), limit=60, markdown=True)
+    assert len(parts) > 1
+    assert all(p.startswith("*") and p.endswith("*") for p in parts)
+    assert all(_balanced(p) for p in parts)
@@ -0,0 +1,113 @@
+# tests/test_telegram_polling.py — TelegramPoller chạy với scripts/fake_bot_api.py (Bot API giả, stdlib)
+import asyncio
+import json
+import random
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from infra import telegram_api, update_guard
+from functions.polling.telegram_polling import TelegramPoller
+from scripts import fake_bot_api
+
+
+@pytest.fixture
+def bot_api(monkeypatch):
+    with fake_bot_api._lock:
+        fake_bot_api._updates.clear()
+        fake_bot_api._sent.clear()
+        fake_bot_api._calls["getUpdates"] = 0
+    update_guard._seen.clear()
+    update_guard._buckets.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake_bot_api.Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(telegram_api, "BASE", f"http://127.0.0.1:{server.server_address[1]}")
+    yield fake_bot_api
+    server.shutdown()
+    server.server_close()
+
+
+def _run(poller, expected, handled):
+    async def main():
+        task = asyncio.ensure_future(poller.run())
+        while len(handled) < expected and not task.done():
+            await asyncio.sleep(0.02)
+        poller.stop()
+        await asyncio.wait_for(task, 10)
+    asyncio.run(main())
+
+
+def test_poller_handles_every_update_in_chat_order(bot_api, tmp_path):
+    bot_api._gen(chats=6, per_chat=4)
+    handled = []
+
+    async def handler(update):
+        await asyncio.sleep(random.uniform(0, 0.02))
+        handled.append((update["message"]["chat"]["id"], update["message"]["message_id"]))
+
+    poller = TelegramPoller("tok", handler, state_path=str(tmp_path / "state.json"), limit=10, timeout=1)
+    _run(poller, 24, handled)
+
+    assert len(handled) == 24
+    for chat in range(1, 7):
+        assert [m for c, m in handled if c == chat] == [1, 2, 3, 4]
+    state = json.loads((tmp_path / "state.json").read_text())
+    assert state == {"offset": 25, "pending": []}
+    assert bot_api._calls["getUpdates"] >= 3  # limit=10 → nhiều trang
+
+
+def test_poller_skips_updates_without_text_but_advances_offset(bot_api, tmp_path):
+    bot_api._updates.extend([
+        {"update_id": 1, "message": {"message_id": 1, "chat": {"id": 5}, "sticker": {}}},
+        {"update_id": 2, "message": {"message_id": 2, "chat": {"id": 5}, "text": "hi"}},
+    ])
+    handled = []
+
+    async def handler(update):
+        handled.append(update["update_id"])
+
+    poller = TelegramPoller("tok", handler, state_path=str(tmp_path / "state.json"), timeout=1)
+    _run(poller, 1, handled)
+    assert handled == [2]
+    assert poller.state.offset == 3
+
+
+def test_poller_replays_pending_updates_from_state(bot_api, tmp_path):
+    pending = {"update_id": 7, "message": {"message_id": 1, "chat": {"id": 9}, "text": "còn dở"}}
+    (tmp_path / "state.json").write_text(json.dumps({"offset": 8, "pending": [pending]}))
+    bot_api._updates.append({"update_id": 8, "message": {"message_id": 2, "chat": {"id": 9}, "text": "mới"}})
+    handled = []
+
+    async def handler(update):
+        handled.append(update["update_id"])
+
+    poller = TelegramPoller("tok", handler, state_path=str(tmp_path / "state.json"), timeout=1)
+    _run(poller, 2, handled)
+    assert handled == [7, 8]
+    assert json.loads((tmp_path / "state.json").read_text())["pending"] == []
+
+
+def test_poller_tags_updates_of_named_bot(bot_api, tmp_path):
+    bot_api._gen(chats=1, per_chat=1)
+    seen = []
+
+    async def handler(update):
+        seen.append(update.get("_bot"))
+
+    poller = TelegramPoller("tok", handler, state_path=str(tmp_path / "state.json"), timeout=1, bot_key="en")
+    _run(poller, 1, seen)
+    assert seen == ["en"]
+
+
+def test_rate_limited_chat_gets_one_notice_per_dropped_update(bot_api, tmp_path):
+    bot_api._gen(chats=1, per_chat=14)  # allow_chat: 12 tin / phút
+    handled = []
+
+    async def handler(update):
+        handled.append(update["update_id"])
+
+    poller = TelegramPoller("tok", handler, state_path=str(tmp_path / "state.json"), timeout=1)
+    _run(poller, 12, handled)
+    assert len(handled) == 12
+    assert bot_api._sent.get("1") == 2
@@ -0,0 +1,117 @@
+# tests/test_telegram_send.py — lịch gửi GCRA, lùi theo 429, fallback plain, chỉ gửi lại lỗi pha kết nối
+import asyncio
+
+import httpx
+import pytest
+
+from infra import telegram_api
+from infra.telegram_api import SendScheduler, _send_chunk
+
+
+def test_gcra_allows_burst_then_spaces_sends_per_chat():
+    s = SendScheduler(global_rps=1000, chat_rps=1.0)
+    delays = [s.reserve(1) for _ in range(5)]
+    assert delays[:3] == [0.0, 0.0, 0.0]
+    assert delays[3] == pytest.approx(1.0, abs=0.05)
+    assert delays[4] == pytest.approx(1.0, abs=0.05)  # chưa tới lượt thì không đặt trước slot
+    assert s.reserve(2) == 0.0  # chat khác không bị ảnh hưởng
+
+
+def test_groups_use_the_stricter_per_minute_rate():
+    s = SendScheduler(global_rps=1000, chat_rps=1.0, group_rpm=20)
+    delays = [s.reserve(-100) for _ in range(4)]
+    assert delays[:3] == [0.0, 0.0, 0.0]
+    assert delays[3] == pytest.approx(3.0, abs=0.05)
+
+
+def test_global_rate_applies_across_chats():
+    s = SendScheduler(global_rps=2.0)
+    delays = [s.reserve(chat) for chat in range(1, 5)]
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2] == pytest.approx(0.5, abs=0.05)
+    assert delays[3] == pytest.approx(0.5, abs=0.05)
+
+
+def test_penalize_blocks_chat_and_optionally_everyone():
+    s = SendScheduler(global_rps=1000)
+    s.penalize(1, 3.0)
+    assert s.reserve(1) == pytest.approx(3.0, abs=0.05)
+    assert s.reserve(2) == 0.0
+    assert s.reserve(1) == pytest.approx(3.0, abs=0.05)  # vẫn chặn, không tích thêm
+    s.penalize(1, 10.0, global_scope=True)
+    assert s.reserve(3) == pytest.approx(10.0, abs=0.05)
+
+
+def test_waiting_for_global_rate_does_not_book_ahead():
+    s = SendScheduler(global_rps=2.0)
+    assert s.reserve(1) == 0.0 and s.reserve(2) == 0.0
+    waits = [s.reserve(3) for _ in range(5)]
+    assert all(w == pytest.approx(0.5, abs=0.05) for w in waits)
+
+
+def test_expired_blocks_are_dropped():
+    s = SendScheduler(global_rps=1000)
+    s.penalize(1, 0.0)
+    s.reserve(1)
+    assert 1 not in s._blocked
+
+
+def _run_chunk(responses, text="a \\_ b", parse_mode="Markdown"):
+    """Gửi 1 phần qua MockTransport; responses: list Response hoặc Exception theo thứ tự gọi."""
+    sent = []
+
+    def handler(request):
+        sent.append(telegram_api.fastjson.loads(request.content))
+        r = responses[len(sent) - 1]
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await _send_chunk(client, "tok-test", 77, text, parse_mode)
+
+    return asyncio.run(main()), sent
+
+
+@pytest.fixture(autouse=True)
+def _no_sleep(monkeypatch):
+    async def instant(_):
+        return None
+    monkeypatch.setattr(telegram_api.asyncio, "sleep", instant)
+    telegram_api._schedulers.clear()
+
+
+def test_parse_error_falls_back_to_unescaped_plain_text():
+    ok, sent = _run_chunk([
+        httpx.Response(400, json={"ok": False, "error_code": 400, "description": "Bad Request: can't parse entities"}),
+        httpx.Response(200, json={"ok": True, "result": {}}),
+    ])
+    assert ok
+    assert sent[0] == {"chat_id": 77, "text": "a \\_ b", "parse_mode": "Markdown"}
+    assert sent[1] == {"chat_id": 77, "text": "a _ b"}
+
+
+def test_429_penalizes_and_retries():
+    ok, sent = _run_chunk([
+        httpx.Response(429, json={"ok": False, "error_code": 429, "parameters": {"retry_after": 2}}),
+        httpx.Response(200, json={"ok": True, "result": {}}),
+    ])
+    assert ok and len(sent) == 2
+
+
+def test_connect_errors_are_retried():
+    ok, sent = _run_chunk([
+        httpx.ConnectError("refused"),
+        httpx.ConnectTimeout("slow"),
+        httpx.Response(200, json={"ok": True, "result": {}}),
+    ])
+    assert ok and len(sent) == 3
+
+
+def test_read_timeout_after_send_is_not_retried():
+    ok, sent = _run_chunk([
+        httpx.ReadTimeout("sent, no answer"),
+        httpx.Response(200, json={"ok": True, "result": {}}),
+    ])
+    assert not ok and len(sent) == 1
@@ -0,0 +1,95 @@
+# tests/test_tiered_provider.py — phân tầng model: classify, leo thang, timeout từng lần gọi
+import asyncio
+
+import pytest
+
+from core.llm_provider import ChatMessage, ChatResult
+from core.providers.tiered_provider import LARGE, SMALL, TieredProvider, classify, needs_escalation
+
+
+@pytest.mark.parametrize("text, hits, tier", [
+    ("chào bạn", 0, SMALL),
+    ("hôm nay thứ mấy?", 0, SMALL),
+    ("Tại sao Python chậm hơn C?", 0, LARGE),           # how-word + tech word
+    ("sửa giúp `print(x)` với", 0, LARGE),               # code
+    ("x" * 300, 0, LARGE),                               # quá dài
+    ("x" * 150, 0, SMALL),
+    ("x" * 150, 3, LARGE),                               # dài vừa + nhiều mảnh nhớ
+    ("so sánh docker và VM", 0, LARGE),                  # 2 tech words
+    ("a?\nb?", 0, SMALL),
+])
+def test_classify(text, hits, tier):
+    assert classify(text, hits) == tier
+
+
+@pytest.mark.parametrize("text, finish, reason", [
+    ("", "stop", "empty"),
+    ("abc", "length", "truncated"),
+    ("Xin lỗi, tôi không thể giúp việc này.", "stop", "refusal"),
+    ("Được nhé!", "stop", None),
+])
+def test_needs_escalation(text, finish, reason):
+    assert needs_escalation(ChatResult(text=text, finish_reason=finish)) == reason
+
+
+class Fake:
+    def __init__(self, name, text="ok", delay=0.0, error=None):
+        self.name, self.text, self.delay, self.error = name, text, delay, error
+        self.calls = 0
+
+    async def chat_with_usage(self, messages, max_tokens, temperature):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return ChatResult(text=self.text, model=self.name, finish_reason="stop")
+
+
+MSG = [ChatMessage(role="user", content="chào")]
+
+
+def _chat(provider, **kw):
+    return asyncio.run(provider.chat_with_usage(MSG, 64, 0.3, **kw))
+
+
+def test_simple_turn_is_served_by_small():
+    small, large = Fake("s"), Fake("l")
+    res = _chat(TieredProvider(small, large))
+    assert (res.model, res.tier, large.calls) == ("s", SMALL, 0)
+
+
+def test_explicit_large_tier_skips_small():
+    small, large = Fake("s"), Fake("l")
+    res = _chat(TieredProvider(small, large), tier=LARGE)
+    assert (res.model, small.calls) == ("l", 0)
+
+
+def test_refusal_escalates_and_keeps_small_usage_chain():
+    small, large = Fake("s", text="Xin lỗi, tôi không thể giúp."), Fake("l", text="Đây nhé")
+    res = _chat(TieredProvider(small, large))
+    assert res.model == "l" and res.escalated_from.model == "s"
+
+
+def test_escalation_timeout_keeps_small_answer():
+    small = Fake("s", text="Xin lỗi, tôi không thể giúp.")
+    large = Fake("l", delay=1.0)
+    res = _chat(TieredProvider(small, large, timeout=0.05))
+    assert res.model == "s"
+
+
+def test_escalation_failure_with_empty_small_answer_raises():
+    small, large = Fake("s", text=""), Fake("l", error=RuntimeError("down"))
+    with pytest.raises(RuntimeError):
+        _chat(TieredProvider(small, large))
+
+
+def test_timeout_applies_per_call():
+    small = Fake("s", delay=1.0)
+    with pytest.raises(asyncio.TimeoutError):
+        _chat(TieredProvider(small, Fake("l"), timeout=0.05))
+
+
+def test_no_escalation_when_disabled():
+    small, large = Fake("s", text=""), Fake("l")
+    res = _chat(TieredProvider(small, large, escalate=False))
+    assert res.model == "s" and large.calls == 0
@@ -0,0 +1,52 @@
+# tests/test_webhook_redelivery.py — handler lỗi (500) → lần Telegram gửi lại phải được xử lý, không bị coi là trùng
+import pytest
+
+from infra import bots, update_guard
+from infra.journal import UpdateJournal
+
+SECRET = "s3cret"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("TELEGRAM_TOKEN", "123:abc")
+    monkeypatch.setenv("TELEGRAM_SECRET_TOKEN", SECRET)
+    monkeypatch.setenv("LLM_API_KEY", "")
+    monkeypatch.delenv("BOTS_CONFIG", raising=False)
+    monkeypatch.setattr(bots, "_bots", None)
+
+    import app as app_module
+    from functions.http import telegram_webhook as wh
+
+    journal = UpdateJournal(str(tmp_path / "journal.db"))
+    monkeypatch.setattr(wh, "get_journal", lambda: journal)
+    monkeypatch.setattr(wh.lifecycle, "start_resumer", lambda run: None)
+
+    calls = []
+
+    async def handle(update):
+        calls.append(update["update_id"])
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(wh, "_handle_update", handle)
+    yield app_module.app.test_client(), calls
+    journal.close()
+    monkeypatch.setattr(bots, "_bots", None)
+
+
+def _post(c, update_id):
+    body = {"update_id": update_id, "message": {"message_id": 1, "chat": {"id": 42}, "text": "hello"}}
+    return c.post("/telegram/webhook", json=body, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+
+
+def test_retry_after_handler_error_is_processed(client):
+    c, calls = client
+    assert _post(c, 9001).status_code == 500
+    r = _post(c, 9001)
+    assert r.status_code == 200 and "handled_ms" in r.get_json()
+    assert calls == [9001, 9001]
+    # Đã xử lý xong → lần gửi lại tiếp theo mới là trùng
+    assert _post(c, 9001).get_json() == {"ok": True}
+    assert calls == [9001, 9001]
+    assert update_guard.is_seen(bots.DEFAULT_KEY, 9001)